@@ -2,34 +2,114 @@
 
 import os
 import re
-import json
+import time
+import mimetypes
 import logging
-import requests
 import sqlite3
-from datetime import datetime, timedelta
-from flask import Flask, send_from_directory, render_template, url_for, after_this_request, jsonify, request, session, redirect
+from datetime import datetime
+from flask import (Flask, send_file, render_template, url_for, after_this_request, jsonify, request,
+                   session, redirect, Response, stream_with_context, g, before_render_template,
+                   template_rendered)
 from urllib.parse import unquote
 
 # --- 导入自定义模块 ---
-from config import REPO_DIR, LOG_FILE
-from database import (record_ncm_access, record_not_found, get_db_stats,
-                      get_ncm_stats, get_song_info, update_song_info,
-                      add_ncm_no_lyrics_entry, get_ncm_no_lyrics_stats,
-                      remove_ncm_no_lyrics_entry, get_ncm_dashboard_stats,
-                      get_contributors_info, update_contributors_info,
-                      record_traffic, get_traffic_stats)
-from proxy_manager import get_proxy_status
-from git_manager import get_last_update_status
-from utils import get_dir_size_mb
+from config import (REPO_DIR, DIR_LISTING_PAGE_SIZE, DIR_LISTING_MAX_PAGE_SIZE,
+                    LYRIC_CACHE_MAX_AGE, LYRIC_CACHE_STALE_WHILE_REVALIDATE, LOG_STREAM_HEARTBEAT)
+from db_pool import get_connection_for_path
+from database import (get_ncm_stats, get_song_info, update_song_info,
+                      get_ncm_no_lyrics_stats,
+                      get_ncm_dashboard_stats,
+                      get_traffic_stats)
+from log_writer import (enqueue_traffic, enqueue_ncm_access, enqueue_ncm_lyrics_found,
+                        enqueue_not_found, get_log_writer_stats)
+from repo_index import get_repo_index, normalize_path
+from compressed_cache import choose_variant, has_variants
+from lyric_cache import get_cached_body, put_cached_body, can_cache, get_lyric_cache_stats
+from status_snapshot import get_status_snapshot
+from logging_config import log_buffer, log_stream_slots
+from log_tail import read_tail, read_since
 from ncm_api import fetch_song_details_from_api
+from ncm_enricher import submit_missing_song, get_enricher_stats
+from contributors import get_contributors_snapshot, request_contributors_refresh
+from proxy_manager import get_proxy_report
+from metrics import record_request, record_response_bytes, render_metrics
+from request_timing import begin_request, span, add_span, timed_iter, server_timing_header, finish_request
 
 # --- 初始化 ---
 logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
 
+NCM_LYRIC_PATTERN = re.compile(r'ncm-lyrics/(\d+)\.ttml')
+# 文件只会在仓库同步后变化，ETag随之改变，因此可以放心让客户端缓存
+LYRIC_CACHE_CONTROL = (
+    f'public, max-age={LYRIC_CACHE_MAX_AGE}, '
+    f'stale-while-revalidate={LYRIC_CACHE_STALE_WHILE_REVALIDATE}'
+)
+
 # --- 中间件 ---
 
+@app.before_request
+def start_request_timer():
+    g.request_timing = begin_request()
+
+@before_render_template.connect_via(app)
+def start_render_span(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def end_render_span(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        add_span('render', start, time.perf_counter() - start)
+
+def get_route_label():
+    # 使用路由规则而不是实际路径作为标签，标签的取值数量有限
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.after_request
+def add_server_timing(response):
+    """
+    最后执行的中间件：写入 Server-Timing 响应头，并在响应结束（流式响应输出完毕）后
+    检查总耗时，超过阈值时把完整的耗时分解写入慢请求日志
+    """
+    timing = g.get('request_timing')
+    if timing is None:
+        return response
+    response.headers['Server-Timing'] = server_timing_header(timing)
+    # 日志推送等长连接的耗时没有意义，不计入慢请求
+    if response.mimetype != 'text/event-stream':
+        method, path, route = request.method, request.path, get_route_label()
+        query, status = request.query_string.decode('latin-1'), response.status_code
+        response.call_on_close(lambda: finish_request(timing, method, path, route, status, query))
+    return response
+
+def count_streamed_bytes(chunks, on_close):
+    """包装流式响应，输出结束后以实际发送的字节数调用 on_close"""
+    sent_bytes = 0
+    try:
+        for chunk in chunks:
+            sent_bytes += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        # 确保内层生成器（及其持有的请求上下文）随响应一起关闭
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        on_close(sent_bytes)
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由规则记录请求数、耗时和响应字节数，流式响应在输出结束后补记字节数"""
+    route = get_route_label()
+    timing = g.get('request_timing')
+    elapsed = timing.elapsed() if timing else 0
+    sent_bytes = 0 if request.method == 'HEAD' else response.content_length
+    record_request(route, request.method, response.status_code, sent_bytes, elapsed)
+    if response.content_length is None and response.is_streamed and request.method != 'HEAD':
+        response.response = count_streamed_bytes(response.response,
+                                                 lambda sent: record_response_bytes(route, sent))
+    return response
+
 @app.after_request
 def after_request_func(response):
     """在每次请求后记录流量和响应大小"""
@@ -37,16 +117,19 @@ def after_request_func(response):
     excluded_api_paths = [
         '/api/status',
         '/api/log',
+        '/api/log/stream',
         '/api/ncm_dashboard',
         '/api/traffic',
-        '/api/contributors'
+        '/api/contributors',
+        '/metrics'
     ]
 
     # 排除对静态文件、特定API端点、非成功响应或无内容响应的记录
     # 这样可以确保对 /api/db/ 资源的访问被正确统计
+    # 流式响应（如大目录列表）没有预先确定的长度，在输出结束后按实际字节数记录
     if (request.path.startswith('/static/') or
         request.path in excluded_api_paths or
-        not response.content_length):
+        not (response.content_length or response.is_streamed)):
         return response
     
     # 获取真实IP，优先从 X-Forwarded-For 获取，并处理多IP地址的情况
@@ -57,9 +140,18 @@ def after_request_func(response):
         ip_address = request.remote_addr
         
     user_agent = request.headers.get('User-Agent')
-    response_size = response.content_length
+    path = request.path
+
+    if response.content_length:
+        # 放入异步写入队列，由后台线程批量写入数据库
+        with span('queue'):
+            enqueue_traffic(path, ip_address, user_agent, response.content_length)
+    else:
+        def record_streamed_traffic(sent_bytes):
+            if sent_bytes:
+                enqueue_traffic(path, ip_address, user_agent, sent_bytes)
 
-    record_traffic(request.path, ip_address, user_agent, response_size)
+        response.response = count_streamed_bytes(response.response, record_streamed_traffic)
     
     return response
 
@@ -73,61 +165,46 @@ def index():
 @app.route('/api/status')
 def api_status():
     """提供主页需要的全部动态数据"""
-    dir_size_mb = get_dir_size_mb()
-    ncm_count, not_found_count = get_db_stats()
-    no_lyrics_count = len(get_ncm_no_lyrics_stats())
-    last_update_time, last_update_status = get_last_update_status()
-    proxy_status = get_proxy_status()
-    
-    # 对代理状态进行排序，以便在前端直接使用
-    # sorted返回一个列表，列表中的元素是元组 (key, value)
-    sorted_proxy_status = sorted(proxy_status.items(), key=lambda item: item[1], reverse=True)
-
-    status_data = {
-        'last_update_time': last_update_time,
-        'last_update_status': last_update_status,
-        'dir_size_mb': dir_size_mb,
-        'ncm_count': ncm_count,
-        'not_found_count': not_found_count,
-        'no_lyrics_count': no_lyrics_count,
-        'proxy_status': sorted_proxy_status
-    }
+    # 仓库大小、数据库计数和代理状态来自按输入版本缓存的快照，
+    # 下面的运行时计数器本身就保存在内存中，直接读取
+    status_data = dict(get_status_snapshot())
+    status_data.update({
+        'log_writer': get_log_writer_stats(),
+        'lyric_cache': get_lyric_cache_stats(),
+        'ncm_enricher': get_enricher_stats()
+    })
     return jsonify(status_data)
 
+@app.route('/metrics')
+def metrics_view():
+    """Prometheus 指标，合并了所有工作进程的数据"""
+    return Response(render_metrics(get_proxy_report()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/db/', defaults={'path': ''})
 @app.route('/api/db/<path:path>')
 def serve_db_path(path):
     """提供对 'db_mirror' 目录中文件和目录列表的访问，并实现点击跳转"""
     base_dir = os.path.abspath(REPO_DIR)
     decoded_path = unquote(path)
-    target_path = os.path.join(base_dir, decoded_path)
+    rel_path = normalize_path(decoded_path)
 
-    if not target_path.startswith(base_dir):
+    if rel_path is None:
         return "禁止访问。", 403
 
-    if not os.path.exists(base_dir):
+    # 文件是否存在、目录列表均从内存索引中获取，不再访问文件系统
+    index = get_repo_index()
+    if index is None:
         return "仓库尚未克隆，请稍候。", 503
 
-    if not os.path.exists(target_path):
-        # 路径不存在，记录404
-        record_not_found(decoded_path)
-        
-        # 检查是否是NCM歌词路径
-        match = re.search(r'ncm-lyrics/(\d+)\.ttml', decoded_path)
-        if match:
-            song_id = match.group(1)
-            logger.info(f"路径 {decoded_path} 未找到，检查是否为有效的NCM歌曲...")
-            song_details = fetch_song_details_from_api([song_id])
-            if song_id in song_details:
-                # 歌曲有效，但没有歌词文件，记录到ncm_no_lyrics
-                add_ncm_no_lyrics_entry(song_id, song_details[song_id])
-
+    if not index.exists(rel_path):
+        with span('queue'):
+            record_missing_path(decoded_path)
         return "路径未找到。", 404
 
-    if os.path.isdir(target_path):
-        entries = os.listdir(target_path)
-        dirs = sorted([d for d in entries if os.path.isdir(os.path.join(target_path, d))])
-        files = sorted([f for f in entries if os.path.isfile(os.path.join(target_path, f))])
+    if index.is_dir(rel_path):
+        after = request.args.get('after')
+        limit = get_listing_limit()
+        dirs, files, next_after = index.list_dir_page(rel_path, after=after, limit=limit)
         
         breadcrumbs = [{'name': '根目录', 'path': ''}]
         if decoded_path:
@@ -138,32 +215,131 @@ def serve_db_path(path):
                 current_path = os.path.join(current_path, part)
                 breadcrumbs.append({'name': part, 'path': current_path.replace('\\', '/')})
 
-        return render_template('dir_view.html', 
-                               current_dir=decoded_path, 
-                               dirs=dirs, 
-                               files=files,
-                               parent_dir=os.path.dirname(decoded_path).replace('\\', '/') if decoded_path else None,
-                               breadcrumbs=breadcrumbs)
+        # 大目录逐块渲染并流式输出，单次请求的内存占用只与每页条目数有关
+        context = {
+            'current_dir': decoded_path,
+            'dirs': dirs,
+            'files': files,
+            'parent_dir': os.path.dirname(decoded_path).replace('\\', '/') if decoded_path else None,
+            'breadcrumbs': breadcrumbs,
+            'after': after,
+            'next_after': next_after,
+            'limit': limit
+        }
+        app.update_template_context(context)
+        with span('render'):
+            template = app.jinja_env.get_template('dir_view.html')
+        return Response(stream_with_context(timed_iter('render', template.generate(context))), mimetype='text/html')
     
     else:
-        match = re.search(r'ncm-lyrics/(\d+)\.ttml', decoded_path)
-        if match:
-            song_id = match.group(1)
-            # 记录本次成功访问
-            record_ncm_access(song_id)
-            # 如果这首歌之前在“无歌词”列表里，现在将它移除
-            remove_ncm_no_lyrics_entry(song_id)
-        
+        with span('queue'):
+            record_served_path(decoded_path)
+
+        size, mtime, etag = index.get_file(rel_path)
+        # 优先使用同步时预先生成的压缩版本，请求时不做任何压缩
+        variant = choose_variant(etag, request.accept_encodings)
+
         @after_this_request
         def add_header(response):
             if response.status_code == 200:
                 logger.info(f"成功提供文件: {decoded_path}, 状态码: {response.status_code}")
-                response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-                response.headers['Pragma'] = 'no-cache'
-                response.headers['Expires'] = '0'
+            # Range 请求返回的206是压缩后内容的片段，同样需要 Content-Encoding，否则客户端会把压缩数据当作原文
+            if response.status_code in (200, 206, 304):
+                response.headers['Cache-Control'] = LYRIC_CACHE_CONTROL
+                if variant:
+                    response.headers['Content-Encoding'] = variant[0]
+                if has_variants(etag):
+                    response.vary.add('Accept-Encoding')
             return response
-            
-        return send_from_directory(base_dir, decoded_path)
+
+        encoding, source_path = variant if variant else (None, os.path.join(base_dir, rel_path))
+        # 不同编码的内容不同，ETag也需要区分
+        response_etag = f"{etag}-{encoding}" if encoding else etag
+
+        # 热门文件直接从内存缓存返回，未命中时读入缓存，过大的文件仍交给send_file
+        body = get_cached_body(rel_path, encoding, etag)
+        if body is None and variant and not os.path.isfile(source_path):
+            # 主进程应用变更集时会删除过期的压缩版本，本进程在同步到该变更集之前仍可能选中它，此时改用原文件。
+            # add_header 按 variant 决定是否加 Content-Encoding，因此一并清除
+            variant = None
+            encoding, source_path = None, os.path.join(base_dir, rel_path)
+            response_etag = etag
+            body = get_cached_body(rel_path, encoding, etag)
+        if body is None and can_cache(size):
+            try:
+                with span('fs'), open(source_path, 'rb') as f:
+                    body = f.read()
+                put_cached_body(rel_path, encoding, etag, body)
+            except OSError as e:
+                logger.warning(f"读取文件 {source_path} 失败: {e}")
+                body = None
+
+        if body is not None:
+            download_name = os.path.basename(rel_path)
+            response = Response(body, mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+            response.headers.set('Content-Disposition', 'inline', filename=download_name)
+            response.set_etag(response_etag)
+            response.last_modified = mtime
+            response.expires = time.time() + LYRIC_CACHE_MAX_AGE
+            # If-None-Match / If-Modified-Since 命中时返回304，同时支持Range请求。
+            # 缓存的是压缩后的内容时，206返回的是压缩数据的片段，Content-Encoding 由上面的 add_header 加上
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+        # 使用索引中的内容哈希作为ETag，If-None-Match / If-Modified-Since 命中时返回304
+        with span('fs'):
+            return send_file(source_path, download_name=os.path.basename(rel_path),
+                             etag=response_etag, last_modified=mtime,
+                             max_age=LYRIC_CACHE_MAX_AGE, conditional=True)
+
+def record_missing_path(decoded_path):
+    """记录一次404访问；NCM歌词路径交给后台任务确认是否为有效歌曲，不阻塞本次响应"""
+    enqueue_not_found(decoded_path)
+    match = NCM_LYRIC_PATTERN.search(decoded_path)
+    if match:
+        submit_missing_song(match.group(1))
+
+def record_served_path(decoded_path):
+    """记录一次成功的NCM歌词访问"""
+    match = NCM_LYRIC_PATTERN.search(decoded_path)
+    if match:
+        song_id = match.group(1)
+        # 记录本次成功访问
+        enqueue_ncm_access(song_id)
+        # 如果这首歌之前在“无歌词”列表里，现在将它移除
+        enqueue_ncm_lyrics_found(song_id)
+
+def get_listing_limit():
+    """从请求参数中读取每页条目数，并限制在允许的范围内"""
+    limit = request.args.get('limit', DIR_LISTING_PAGE_SIZE, type=int)
+    return max(1, min(limit, DIR_LISTING_MAX_PAGE_SIZE))
+
+@app.route('/api/list/', defaults={'path': ''})
+@app.route('/api/list/<path:path>')
+def api_list_dir(path):
+    """以JSON格式分页提供目录列表，参数 after 为上一页返回的 next_after 游标"""
+    rel_path = normalize_path(unquote(path))
+    if rel_path is None:
+        return jsonify({'error': '禁止访问。'}), 403
+
+    index = get_repo_index()
+    if index is None:
+        return jsonify({'error': '仓库尚未克隆，请稍候。'}), 503
+
+    page = index.list_dir_page(rel_path, after=request.args.get('after'), limit=get_listing_limit())
+    if page is None:
+        return jsonify({'error': '目录未找到。'}), 404
+
+    dirs, files, next_after = page
+    file_entries = []
+    for name in files:
+        size, mtime, etag = index.get_file(f"{rel_path}/{name}" if rel_path else name)
+        file_entries.append({'name': name, 'size': size, 'mtime': int(mtime), 'etag': etag})
+    return jsonify({
+        'path': rel_path,
+        'dirs': dirs,
+        'files': file_entries,
+        'next_after': next_after
+    })
 
 @app.route('/log')
 def log_view():
@@ -172,15 +348,50 @@ def log_view():
 
 @app.route('/api/log')
 def api_log():
-    """以JSON格式提供最新的日志内容"""
-    try:
-        with open(LOG_FILE, 'r', encoding='utf-8') as f:
-            # 读取文件尾部的内容可能更高效，但简单起见，我们继续读取最后1000行
-            lines = f.readlines()
-            log_content = "".join(lines[-1000:])
-    except FileNotFoundError:
-        log_content = "日志文件未找到。"
-    return jsonify({'log_content': log_content})
+    """
+    以JSON格式提供日志内容：不带游标时返回最后若干行，带游标时只返回之后新增的内容。
+    seq 为内存日志缓冲区当前位置的游标，可作为实时推送的起点。
+    """
+    cursor = request.args.get('cursor')
+    seq = log_buffer.cursor()
+    with span('fs'):
+        if cursor:
+            log_content, cursor, reset = read_since(cursor)
+        else:
+            log_content, cursor = read_tail()
+            reset = True
+        if log_content is None:
+            log_content = "日志文件未找到。"
+    return jsonify({'log_content': log_content, 'cursor': cursor, 'reset': reset, 'seq': seq})
+
+@app.route('/api/log/stream')
+def api_log_stream():
+    """通过SSE实时推送内存日志缓冲区中的新日志，断线重连时根据 Last-Event-ID 续传"""
+    after_seq = log_buffer.stream_start(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    # 每个连接在整个推送期间占用一个服务线程，超出上限时拒绝
+    if not log_stream_slots.acquire(blocking=False):
+        return Response("实时日志连接数已达上限，请稍后重试。", status=503, headers={'Retry-After': '30'})
+
+    def generate():
+        nonlocal after_seq
+        # 建议浏览器断线3秒后重连
+        yield "retry: 3000\n\n"
+        while True:
+            records = log_buffer.get_since(after_seq, timeout=LOG_STREAM_HEARTBEAT)
+            if not records:
+                # 心跳，既保持连接，也让服务端及时发现客户端已断开
+                yield ": keep-alive\n\n"
+                continue
+            for seq, text in records:
+                yield log_buffer.format_event(seq, text)
+            after_seq = records[-1][0]
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(log_stream_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # 禁止Nginx等反向代理缓冲，否则推送会被攒成一批
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/ncm_view')
 def ncm_view():
@@ -240,7 +451,8 @@ def ncm_refresh_song(song_id):
     """刷新指定歌曲的网易云信息"""
     try:
         logger.info(f"收到刷新歌曲 {song_id} 信息的请求。")
-        new_song_details = fetch_song_details_from_api([song_id])
+        with span('http.ncm'):
+            new_song_details = fetch_song_details_from_api([song_id])
         
         if song_id in new_song_details:
             #print(f"刷新歌曲 {song_id} 的信息: {new_song_details[song_id]}")
@@ -286,127 +498,12 @@ def contributors_view():
 
 @app.route('/api/contributors')
 def api_contributors():
-    """
-    以JSON格式提供贡献者数据，优先从数据库缓存读取，
-    仅当数据不存在或陈旧时才从API获取，并处理GitHub API限速。
-    """
-    contributors_file = os.path.join(REPO_DIR, 'metadata', 'contributors.jsonl')
-    if not os.path.exists(contributors_file):
-        logger.error(f"贡献者文件未找到: {contributors_file}")
-        return jsonify({'error': '贡献者数据文件未找到。'}), 404
-
-    # 1. 从.jsonl文件读取所有贡献者基本信息
-    all_contributors = {}
-    with open(contributors_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                data = json.loads(line)
-                github_id = str(data.get('githubId'))
-                if github_id:
-                    all_contributors[github_id] = {'count': data.get('count', 0)}
-            except json.JSONDecodeError:
-                logger.warning(f"无法解析行: {line.strip()}")
-    
-    github_ids = list(all_contributors.keys())
-    
-    # 2. 从数据库批量获取缓存信息
-    cached_info = get_contributors_info(github_ids)
-    
-    # 3. 确定哪些贡献者需要从API更新
-    ids_to_fetch = []
-    now = datetime.now()
-    for gid in github_ids:
-        info = cached_info.get(gid)
-        if not info:
-            ids_to_fetch.append(gid)
-        else:
-            last_updated = datetime.strptime(info['last_updated'], '%Y-%m-%d %H:%M:%S.%f')
-            if now - last_updated > timedelta(days=1): # 缓存有效期为1天
-                ids_to_fetch.append(gid)
-
-    # 4. 从API获取需要更新的数据
-    rate_limited = False
-    if ids_to_fetch:
-        logger.info(f"需要从API获取 {len(ids_to_fetch)} 位贡献者的信息。")
-        newly_fetched_info = {}
-        avatar_dir = os.path.join('static', 'avatars')
-        os.makedirs(avatar_dir, exist_ok=True)
-
-        for gid in ids_to_fetch:
-            if rate_limited:
-                break
-            
-            api_url = f"https://api.github.com/user/{gid}"
-            try:
-                response = requests.get(api_url, timeout=5)
-                if response.status_code in [403, 429]:
-                    logger.warning(f"GitHub API速率限制已触发。")
-                    rate_limited = True
-                    continue
-                
-                response.raise_for_status()
-                user_data = response.json()
-                avatar_url = user_data.get('avatar_url')
-
-                # 下载并保存头像
-                if avatar_url:
-                    try:
-                        avatar_response = requests.get(avatar_url, timeout=10)
-                        avatar_response.raise_for_status()
-                        avatar_path = os.path.join(avatar_dir, f"{gid}.png")
-                        with open(avatar_path, 'wb') as f:
-                            f.write(avatar_response.content)
-                    except requests.RequestException as e:
-                        logger.error(f"下载ID {gid} 的头像失败: {e}")
-
-                newly_fetched_info[gid] = {
-                    'login': user_data.get('login'),
-                    'name': user_data.get('name'),
-                    'avatar_url': avatar_url # 数据库中仍然存储原始URL
-                }
-            except requests.RequestException as e:
-                logger.error(f"无法从GitHub API获取ID {gid} 的信息: {e}")
-
-        # 5. 更新数据库缓存
-        if newly_fetched_info:
-            update_contributors_info(newly_fetched_info)
-            cached_info.update(newly_fetched_info)
-
-    # 6. 组合最终数据
-    final_contributors_data = []
-    for gid, data in all_contributors.items():
-        info = cached_info.get(gid)
-        local_avatar_path = os.path.join('static', 'avatars', f"{gid}.png")
-        
-        if info:
-            # 检查本地头像是否存在，决定使用本地路径还是远程URL
-            if os.path.exists(local_avatar_path):
-                avatar = url_for('static', filename=f'avatars/{gid}.png')
-            else:
-                avatar = info.get('avatar_url') # 回退到原始URL
-
-            final_contributors_data.append({
-                'login': info.get('login'),
-                'avatar_url': avatar,
-                'name': info.get('name'),
-                'count': data.get('count', 0)
-            })
-        else:
-            # 如果API限速或失败，则显示占位符
-            final_contributors_data.append({
-                'login': f"ID: {gid}",
-                'avatar_url': 'https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png',
-                'name': '（加载失败或被限速）',
-                'count': data.get('count', 0)
-            })
-
-    # 按贡献数量降序排序
-    final_contributors_data.sort(key=lambda x: x['count'], reverse=True)
-    
-    return jsonify({
-        'contributors': final_contributors_data,
-        'rate_limited': rate_limited
-    })
+    """以JSON格式提供贡献者数据，数据由后台任务预先生成，这里只读取内存中的快照"""
+    snapshot = get_contributors_snapshot()
+    if snapshot is None:
+        request_contributors_refresh()
+        return jsonify({'error': '贡献者数据正在生成，请稍后刷新页面。'}), 503
+    return Response(snapshot, mimetype='application/json')
 
 # --- 数据库管理 ---
 DB_DIR = os.path.join('data', 'db')
@@ -443,32 +540,29 @@ def db_admin_logout():
     return redirect(url_for('db_admin'))
 
 def get_db_connection(db_name):
-    """安全地获取数据库连接"""
+    """安全地从连接池借出数据库连接（上下文管理器），路径无效时返回None"""
     db_path = os.path.join(DB_DIR, db_name)
     # 安全检查，确保路径仍然在预期的目录下
     if not os.path.abspath(db_path).startswith(os.path.abspath(DB_DIR)):
         return None
-    try:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"连接数据库 {db_name} 失败: {e}")
+    if not os.path.isfile(db_path):
+        logger.error(f"数据库文件不存在: {db_name}")
         return None
+    return get_connection_for_path(db_path)
 
 @app.route('/db_admin/view/<db_name>')
 def db_view(db_name):
     if not session.get('logged_in'):
         return redirect(url_for('db_admin'))
 
-    conn = get_db_connection(db_name)
-    if not conn:
+    db_conn = get_db_connection(db_name)
+    if not db_conn:
         return "数据库连接失败或无效的数据库文件。", 404
 
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    with db_conn as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = [row[0] for row in cursor.fetchall()]
 
     # 我们需要再次渲染db_admin.html，但这次要带上数据库和表的信息
     db_files = [f for f in os.listdir(DB_DIR) if f.endswith('.db')]
@@ -483,45 +577,43 @@ def table_view(db_name, table_name):
     if not session.get('logged_in'):
         return redirect(url_for('db_admin'))
 
-    conn = get_db_connection(db_name)
-    if not conn:
+    db_conn = get_db_connection(db_name)
+    if not db_conn:
         return "数据库连接失败或无效的数据库文件。", 404
 
-    cursor = conn.cursor()
-    
-    # 安全检查：确保表名是合法的，防止SQL注入
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-    if cursor.fetchone() is None:
-        conn.close()
-        return "表不存在。", 404
-
-    # 获取表数据和列名
-    search_query = request.form.get('search_query', '')
-    search_column = request.form.get('search_column', '')
-
-    query = f"SELECT * FROM {table_name}"
-    params = []
-    
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns_info = cursor.fetchall()
-    columns = [col['name'] for col in columns_info]
-    pk_column = next((col['name'] for col in columns_info if col['pk']), None)
+    with db_conn as conn:
+        cursor = conn.cursor()
 
-    if request.method == 'POST' and search_query and search_column in columns:
-        query += f" WHERE {search_column} LIKE ?"
-        params.append(f"%{search_query}%")
+        # 安全检查：确保表名是合法的，防止SQL注入
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if cursor.fetchone() is None:
+            return "表不存在。", 404
 
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    
-    # 获取列名
-    columns = [description[0] for description in cursor.description]
-    
-    # 获取该数据库中所有表的列表
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row[0] for row in cursor.fetchall()]
-    
-    conn.close()
+        # 获取表数据和列名
+        search_query = request.form.get('search_query', '')
+        search_column = request.form.get('search_column', '')
+
+        query = f"SELECT * FROM {table_name}"
+        params = []
+
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns_info = cursor.fetchall()
+        columns = [col['name'] for col in columns_info]
+        pk_column = next((col['name'] for col in columns_info if col['pk']), None)
+
+        if request.method == 'POST' and search_query and search_column in columns:
+            query += f" WHERE {search_column} LIKE ?"
+            params.append(f"%{search_query}%")
+
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+        # 获取列名
+        columns = [description[0] for description in cursor.description]
+
+        # 获取该数据库中所有表的列表
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = [row[0] for row in cursor.fetchall()]
 
     # 获取所有数据库文件的列表
     db_files = [f for f in os.listdir(DB_DIR) if f.endswith('.db')]
@@ -543,40 +635,37 @@ def delete_row(db_name, table_name):
     if not session.get('logged_in'):
         return redirect(url_for('db_admin'))
 
-    conn = get_db_connection(db_name)
-    if not conn:
+    db_conn = get_db_connection(db_name)
+    if not db_conn:
         return "数据库连接失败或无效的数据库文件。", 404
 
-    cursor = conn.cursor()
-    
-    # 获取主键
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns_info = cursor.fetchall()
-    pk_column = None
-    for col in columns_info:
-        if col['pk']:
-            pk_column = col['name']
-            break
-    
-    if not pk_column:
-        conn.close()
-        return "无法找到主键，无法删除。", 400
+    with db_conn as conn:
+        cursor = conn.cursor()
 
-    row_id = request.form.get('row_id')
-    if not row_id:
-        conn.close()
-        return "未提供行ID。", 400
+        # 获取主键
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns_info = cursor.fetchall()
+        pk_column = None
+        for col in columns_info:
+            if col['pk']:
+                pk_column = col['name']
+                break
 
-    try:
-        query = f"DELETE FROM {table_name} WHERE {pk_column} = ?"
-        cursor.execute(query, (row_id,))
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"删除行失败: {e}")
-        return f"删除失败: {e}", 500
-    finally:
-        conn.close()
+        if not pk_column:
+            return "无法找到主键，无法删除。", 400
+
+        row_id = request.form.get('row_id')
+        if not row_id:
+            return "未提供行ID。", 400
+
+        try:
+            query = f"DELETE FROM {table_name} WHERE {pk_column} = ?"
+            cursor.execute(query, (row_id,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"删除行失败: {e}")
+            return f"删除失败: {e}", 500
 
     return redirect(url_for('table_view', db_name=db_name, table_name=table_name))
 
@@ -595,82 +684,76 @@ def update_cell():
     if not all([db_name, table_name, pk_val, column, new_value is not None]):
         return jsonify({'success': False, 'error': 'Missing data'}), 400
 
-    conn = get_db_connection(db_name)
-    if not conn:
+    db_conn = get_db_connection(db_name)
+    if not db_conn:
         return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
-    cursor = conn.cursor()
+    with db_conn as conn:
+        cursor = conn.cursor()
 
-    # Security check: Validate table_name from a list of allowed tables
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-    if cursor.fetchone() is None:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Table not found'}), 404
+        # Security check: Validate table_name from a list of allowed tables
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if cursor.fetchone() is None:
+            return jsonify({'success': False, 'error': 'Table not found'}), 404
 
-    # Get column names and primary key
-    cursor.execute(f"PRAGMA table_info('{table_name}')")
-    columns_info = cursor.fetchall()
-    columns = [col['name'] for col in columns_info]
-    pk_column = next((col['name'] for col in columns_info if col['pk']), None)
+        # Get column names and primary key
+        cursor.execute(f"PRAGMA table_info('{table_name}')")
+        columns_info = cursor.fetchall()
+        columns = [col['name'] for col in columns_info]
+        pk_column = next((col['name'] for col in columns_info if col['pk']), None)
 
-    if not pk_column:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Primary key not found'}), 400
+        if not pk_column:
+            return jsonify({'success': False, 'error': 'Primary key not found'}), 400
 
-    # Security check: Validate column name
-    if column not in columns:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Column not found'}), 404
+        # Security check: Validate column name
+        if column not in columns:
+            return jsonify({'success': False, 'error': 'Column not found'}), 404
 
-    # Prevent updating the primary key itself
-    if column == pk_column:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Cannot update primary key'}), 400
+        # Prevent updating the primary key itself
+        if column == pk_column:
+            return jsonify({'success': False, 'error': 'Cannot update primary key'}), 400
 
-    try:
-        # Using f-strings here is safe because table_name and column have been validated
-        query = f'UPDATE "{table_name}" SET "{column}" = ? WHERE "{pk_column}" = ?'
-        cursor.execute(query, (new_value, pk_val))
-        conn.commit()
-
-        return jsonify({'success': True})
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"更新单元格失败: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        conn.close()
+        try:
+            # Using f-strings here is safe because table_name and column have been validated
+            query = f'UPDATE "{table_name}" SET "{column}" = ? WHERE "{pk_column}" = ?'
+            cursor.execute(query, (new_value, pk_val))
+            conn.commit()
+
+            return jsonify({'success': True})
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"更新单元格失败: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/db_admin/add/<db_name>/<table_name>', methods=['POST'])
 def add_row(db_name, table_name):
     if not session.get('logged_in'):
         return redirect(url_for('db_admin'))
 
-    conn = get_db_connection(db_name)
-    if not conn:
+    db_conn = get_db_connection(db_name)
+    if not db_conn:
         return "数据库连接失败或无效的数据库文件。", 404
 
-    cursor = conn.cursor()
-    
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns_info = cursor.fetchall()
-    columns = [col['name'] for col in columns_info]
-    
-    form_data = request.form.to_dict()
-    values = []
-    for col in columns:
-        values.append(form_data.get(col))
+    with db_conn as conn:
+        cursor = conn.cursor()
 
-    try:
-        placeholders = ', '.join(['?'] * len(columns))
-        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-        cursor.execute(query, values)
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"添加行失败: {e}")
-        return f"添加失败: {e}", 500
-    finally:
-        conn.close()
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns_info = cursor.fetchall()
+        columns = [col['name'] for col in columns_info]
+
+        form_data = request.form.to_dict()
+        values = []
+        for col in columns:
+            values.append(form_data.get(col))
+
+        try:
+            placeholders = ', '.join(['?'] * len(columns))
+            query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+            cursor.execute(query, values)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"添加行失败: {e}")
+            return f"添加失败: {e}", 500
 
     return redirect(url_for('table_view', db_name=db_name, table_name=table_name))
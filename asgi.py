@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+
+# 异步服务入口 (ASGI)，使用方法: uvicorn asgi:app --host 0.0.0.0 --port 5000
+# 多进程部署: gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+# uvicorn 和 gunicorn 为可选依赖，见 requirements-optional.txt
+#
+# 访问量最大的接口由本模块直接处理：歌词文件 (/api/db/)、/api/status、/api/ncm_dashboard
+# 和 /api/traffic。路径判断、条件请求和内存缓存命中都在事件循环中完成，读文件和查询数据库
+# 交给有界线程池，一个进程即可保持大量长连接，而不必为每个连接占用一个线程。
+# 这些接口的请求路径上没有外部HTTP请求：404歌词的有效性检测和贡献者刷新都在后台线程中进行。
+# 日志推送 (/api/log/stream) 也在事件循环中等待新日志，长时间打开的日志页面不占用线程。
+# 其余页面（目录列表、Range请求、管理页面等）仍交给 Flask 应用处理。
+
+import io
+import os
+import sys
+import time
+import asyncio
+import contextvars
+import logging
+import mimetypes
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, quote, parse_qs
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, http_date, quote_etag
+from werkzeug.sansio.http import is_resource_modified
+
+# 导入 main 会先配置日志，并注册本进程的同步监听者
+from main import start_services
+from app import app as flask_app, record_missing_path, record_served_path, LYRIC_CACHE_CONTROL
+from config import (REPO_DIR, LYRIC_CACHE_MAX_AGE, ASGI_FILE_WORKERS, ASGI_DB_WORKERS, ASGI_MAX_PENDING,
+                    ASGI_STREAM_CHUNK_SIZE, ASGI_LOG_STREAM_MAX_CLIENTS, LOG_STREAM_HEARTBEAT)
+from database import init_db, get_ncm_dashboard_stats, get_traffic_stats
+from repo_index import get_repo_index, normalize_path
+from compressed_cache import choose_variant, has_variants
+from lyric_cache import get_cached_body, put_cached_body, can_cache, get_lyric_cache_stats
+from status_snapshot import get_status_snapshot
+from log_writer import enqueue_traffic, get_log_writer_stats
+from logging_config import log_buffer
+from ncm_enricher import get_enricher_stats
+from metrics import record_request, prune_metrics_dir
+from request_timing import begin_request, span, server_timing_header, finish_request
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusy(Exception):
+    """线程池排队已满"""
+
+
+class BoundedExecutor:
+    """
+    带排队上限的线程池。排队已满时立即拒绝新任务（返回503），
+    而不是让请求在队列中无限等待。计数只在事件循环线程中修改，无需加锁。
+    """
+
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"asgi-{name}")
+
+    async def run(self, func, *args, admit=True):
+        """
+        在线程池中执行 func。admit 为 False 时不检查排队上限，
+        用于已经开始发送的响应（例如大文件的后续分块），避免响应中途失败。
+        """
+        if admit and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusy(self.name)
+        self.pending += 1
+        # 在当前 Context 的副本中执行，线程中的步骤（如SQLite查询）也计入当前请求的耗时分解
+        context = contextvars.copy_context()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {'pending': self.pending, 'rejected': self.rejected}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局变量：读文件、查数据库以及运行 Flask 应用的线程池
+_file_executor = BoundedExecutor('file', ASGI_FILE_WORKERS, ASGI_MAX_PENDING)
+_db_executor = BoundedExecutor('db', ASGI_DB_WORKERS, ASGI_MAX_PENDING)
+_wsgi_executor = BoundedExecutor('wsgi', ASGI_FILE_WORKERS, ASGI_MAX_PENDING)
+
+# 正在读取的文件：(仓库路径, 编码, ETag) -> asyncio.Task，只在事件循环线程中访问
+_inflight_reads = {}
+# 当前的实时日志推送连接数，只在事件循环线程中修改
+_log_streams = 0
+
+REPO_ABS_DIR = os.path.abspath(REPO_DIR)
+
+
+def get_asgi_stats():
+    """返回各线程池的排队数和拒绝次数，以及实时日志推送的连接数"""
+    stats = {executor.name: executor.stats() for executor in (_file_executor, _db_executor, _wsgi_executor)}
+    stats['log_streams'] = _log_streams
+    return stats
+
+
+# --- 请求与响应工具 ---
+
+def _request_headers(scope):
+    """把请求头转换为 {小写名称: 值}，同名的头用逗号合并"""
+    headers = {}
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        headers[name] = f"{headers[name]},{value}" if name in headers else value
+    return headers
+
+
+def _client_ip(scope, headers):
+    """获取真实IP，优先从 X-Forwarded-For 获取，与 Flask 中的处理一致"""
+    x_forwarded_for = headers.get('x-forwarded-for')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+def _query_arg(scope, name, default=None):
+    values = parse_qs(scope['query_string'].decode('latin-1')).get(name)
+    return values[0] if values else default
+
+
+async def _send_response(send, status, headers, body=b'', method='GET'):
+    """发送完整的响应，headers 为 werkzeug 的 Headers"""
+    if 'Content-Length' not in headers and status not in (204, 304):
+        headers['Content-Length'] = str(len(body))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.to_wsgi_list()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if method == 'HEAD' else body})
+
+
+async def _send_text(send, status, text, method='GET'):
+    headers = Headers({'Content-Type': 'text/html; charset=utf-8'})
+    await _send_response(send, status, headers, text.encode('utf-8'), method)
+
+
+async def _send_json(send, data, method='GET'):
+    # 与 Flask 的 jsonify 使用相同的序列化方式，两种服务方式的响应完全一致
+    body = (flask_app.json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+    await _send_response(send, 200, Headers({'Content-Type': 'application/json'}), body, method)
+
+
+def _content_disposition(download_name):
+    try:
+        download_name.encode('ascii')
+        return f'inline; filename="{download_name}"'
+    except UnicodeEncodeError:
+        return f"inline; filename*=UTF-8''{quote(download_name, safe='')}"
+
+
+def _content_type(download_name):
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    return f"{mimetype}; charset=utf-8" if mimetype.startswith('text/') else mimetype
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def _read_into_cache(rel_path, encoding, etag, source_path):
+    body = await _file_executor.run(_read_file, source_path)
+    put_cached_body(rel_path, encoding, etag, body)
+    return body
+
+
+def _finish_read(key, task):
+    if _inflight_reads.get(key) is task:
+        del _inflight_reads[key]
+    # 标记异常已被取出，所有等待的请求都已取消时不会产生警告
+    if not task.cancelled():
+        task.exception()
+
+
+async def _load_body(rel_path, encoding, etag, source_path):
+    """
+    读取文件并放入内存缓存。同一文件的并发未命中只读取一次，
+    其余请求等待同一个结果，避免同步后大量请求同时读取同一个文件。
+    读取在独立的任务中进行，不属于任何一个请求：发起读取的请求被取消时，其他请求仍能拿到结果。
+    """
+    key = (rel_path, encoding, etag)
+    task = _inflight_reads.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_read_into_cache(rel_path, encoding, etag, source_path))
+        _inflight_reads[key] = task
+        task.add_done_callback(lambda done: _finish_read(key, done))
+    # shield: 某个等待的请求被取消时不影响读取和其他请求
+    return await asyncio.shield(task)
+
+
+# --- 热点接口 ---
+
+def _record_traffic(scope, headers, sent):
+    if scope['method'] == 'GET' and sent:
+        with span('queue'):
+            enqueue_traffic(scope['path'], _client_ip(scope, headers), headers.get('user-agent'), sent)
+
+
+async def _send_not_found(scope, headers, send):
+    # 与 Flask 的 after_request_func 一致，404的响应体同样计入流量
+    body = "路径未找到。"
+    await _send_text(send, 404, body, scope['method'])
+    _record_traffic(scope, headers, len(body.encode('utf-8')))
+
+
+async def serve_db_file(scope, receive, send):
+    """提供歌词文件，行为与 app.serve_db_path 一致；目录列表和 Range 请求交给 Flask"""
+    method = scope['method']
+    decoded_path = unquote(scope['path'][len('/api/db/'):])
+    rel_path = normalize_path(decoded_path)
+    index = get_repo_index()
+    headers = _request_headers(scope)
+    if rel_path is None or index is None or 'range' in headers:
+        return await call_flask(scope, receive, send)
+
+    if not index.exists(rel_path):
+        with span('queue'):
+            record_missing_path(decoded_path)
+        return await _send_not_found(scope, headers, send)
+    if index.is_dir(rel_path):
+        return await call_flask(scope, receive, send)
+
+    with span('queue'):
+        record_served_path(decoded_path)
+    size, mtime, etag = index.get_file(rel_path)
+    # 优先使用同步时预先生成的压缩版本，请求时不做任何压缩
+    variant = choose_variant(etag, parse_accept_header(headers.get('accept-encoding')))
+    encoding = variant[0] if variant else None
+    # 不同编码的内容不同，ETag也需要区分
+    response_etag = f"{etag}-{encoding}" if encoding else etag
+    response_headers = _file_headers(mtime, response_etag, encoding, has_variants(etag))
+
+    # If-None-Match / If-Modified-Since 命中时返回304，不读取文件
+    if not is_resource_modified(http_if_modified_since=headers.get('if-modified-since'),
+                                http_if_none_match=headers.get('if-none-match'),
+                                etag=response_etag,
+                                last_modified=datetime.fromtimestamp(mtime, timezone.utc)):
+        return await _send_response(send, 304, response_headers, method=method)
+
+    source_path = variant[1] if variant else os.path.join(REPO_ABS_DIR, rel_path)
+    sent = await _send_file_body(send, method, rel_path, size, etag, encoding, source_path, response_headers)
+    if sent is None and variant:
+        # 主进程应用变更集时会删除过期的压缩版本，本进程在同步到该变更集之前仍可能选中它，此时改用原文件
+        response_headers = _file_headers(mtime, etag, None, has_variants(etag))
+        source_path = os.path.join(REPO_ABS_DIR, rel_path)
+        sent = await _send_file_body(send, method, rel_path, size, etag, None, source_path, response_headers)
+    if sent is None:
+        # 文件在索引更新前已被同步删除
+        return await _send_not_found(scope, headers, send)
+
+    logger.info(f"成功提供文件: {decoded_path}, 状态码: 200")
+    _record_traffic(scope, headers, sent)
+
+
+def _file_headers(mtime, response_etag, encoding, vary):
+    headers = Headers()
+    headers['Cache-Control'] = LYRIC_CACHE_CONTROL
+    headers['ETag'] = quote_etag(response_etag)
+    headers['Last-Modified'] = http_date(mtime)
+    headers['Expires'] = http_date(time.time() + LYRIC_CACHE_MAX_AGE)
+    headers['Accept-Ranges'] = 'bytes'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if vary:
+        headers['Vary'] = 'Accept-Encoding'
+    return headers
+
+
+async def _send_file_body(send, method, rel_path, size, etag, encoding, source_path, headers):
+    """发送200响应：热门文件直接从内存缓存返回，未命中时在线程池中读入缓存，过大的文件分块发送。
+    文件无法读取时不发送任何内容并返回None，否则返回发送的字节数"""
+    download_name = os.path.basename(rel_path)
+    headers['Content-Type'] = _content_type(download_name)
+    headers['Content-Disposition'] = _content_disposition(download_name)
+
+    body = get_cached_body(rel_path, encoding, etag)
+    if body is None and can_cache(size):
+        try:
+            # 包括在线程池中排队的时间
+            with span('fs'):
+                body = await _load_body(rel_path, encoding, etag, source_path)
+        except OSError as e:
+            logger.warning(f"读取文件 {source_path} 失败: {e}")
+            return None
+
+    if body is not None:
+        await _send_response(send, 200, headers, body, method)
+        return len(body)
+    return await _stream_file(send, source_path, headers, method)
+
+
+async def _stream_file(send, path, headers, method):
+    """分块发送大文件，每次只在内存中保留一块；文件无法打开时返回None，否则返回发送的字节数"""
+    try:
+        with span('fs'):
+            f = await _file_executor.run(open, path, 'rb')
+    except OSError as e:
+        logger.warning(f"读取文件 {path} 失败: {e}")
+        return None
+    try:
+        headers['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.to_wsgi_list()],
+        })
+        sent = 0
+        while method != 'HEAD':
+            with span('fs'):
+                chunk = await _file_executor.run(f.read, ASGI_STREAM_CHUNK_SIZE, admit=False)
+            if not chunk:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            sent += len(chunk)
+        await send({'type': 'http.response.body', 'body': b''})
+        return sent
+    finally:
+        f.close()
+
+
+async def api_status(scope, receive, send):
+    """与 app.api_status 相同，快照在输入变化后需要查询数据库，因此在线程池中获取"""
+    status_data = dict(await _db_executor.run(get_status_snapshot))
+    status_data.update({
+        'log_writer': get_log_writer_stats(),
+        'lyric_cache': get_lyric_cache_stats(),
+        'ncm_enricher': get_enricher_stats(),
+        'asgi': get_asgi_stats()
+    })
+    await _send_json(send, status_data, scope['method'])
+
+
+async def api_ncm_dashboard(scope, receive, send):
+    period = _query_arg(scope, 'period', 'today')
+    await _send_json(send, await _db_executor.run(get_ncm_dashboard_stats, period), scope['method'])
+
+
+async def api_traffic(scope, receive, send):
+    period = _query_arg(scope, 'period', 'today')
+    await _send_json(send, await _db_executor.run(get_traffic_stats, period), scope['method'])
+
+
+async def api_log_stream(scope, receive, send):
+    """
+    与 app.api_log_stream 相同，但在事件循环中等待：新日志写入缓冲区时通过监听者唤醒本连接，
+    没有新日志时定时发送心跳。客户端断开后立即结束。
+    """
+    global _log_streams
+    method = scope['method']
+    headers = _request_headers(scope)
+    if _log_streams >= ASGI_LOG_STREAM_MAX_CLIENTS:
+        response_headers = Headers({'Content-Type': 'text/html; charset=utf-8', 'Retry-After': '30'})
+        body = "实时日志连接数已达上限，请稍后重试。".encode('utf-8')
+        return await _send_response(send, 503, response_headers, body, method)
+    after_seq = log_buffer.stream_start(headers.get('last-event-id') or _query_arg(scope, 'after'))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                    # 禁止Nginx等反向代理缓冲，否则推送会被攒成一批
+                    (b'x-accel-buffering', b'no')],
+    })
+    if method == 'HEAD':
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    disconnected = asyncio.Event()
+
+    def on_new_record():
+        # 由写日志的线程调用
+        loop.call_soon_threadsafe(wakeup.set)
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+        wakeup.set()
+
+    _log_streams += 1
+    log_buffer.add_listener(on_new_record)
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        # 建议浏览器断线3秒后重连
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while True:
+            # 先清除再读取：读取之后写入的日志一定会再次唤醒
+            wakeup.clear()
+            if disconnected.is_set():
+                break
+            records = log_buffer.get_since(after_seq)
+            if records:
+                body = ''.join(log_buffer.format_event(seq, text) for seq, text in records)
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+                after_seq = records[-1][0]
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), LOG_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+    finally:
+        watcher.cancel()
+        log_buffer.remove_listener(on_new_record)
+        _log_streams -= 1
+
+
+ROUTES = {
+    '/api/status': api_status,
+    '/api/ncm_dashboard': api_ncm_dashboard,
+    '/api/traffic': api_traffic,
+    '/api/log/stream': api_log_stream,
+}
+
+# 长连接的耗时没有意义，不计入慢请求日志（与 Flask 中的处理一致）
+EVENT_STREAM_ROUTES = ('/api/log/stream',)
+
+
+# --- 其余请求交给 Flask ---
+
+def _build_environ(scope, body):
+    """按 PEP 3333 由 ASGI scope 构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        # 请求体已在事件循环中完整读取
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in _request_headers(scope).items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f"HTTP_{key}"
+        environ[key] = value
+    return environ
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def _read_block(chunks, limit):
+    """在线程中连续取出响应块，直到凑满 limit 字节或响应结束，返回 (数据, 是否已结束)"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            return b''.join(parts), False
+    return b''.join(parts), True
+
+
+async def call_flask(scope, receive, send):
+    """
+    在线程池中运行 Flask 应用。响应逐块转发，日志推送等流式响应只在等待下一块时占用线程；
+    客户端断开后关闭响应，使生成器及时结束。
+    """
+    body = await _read_body(receive)
+    if body is None:
+        return
+    environ = _build_environ(scope, body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    def start_app():
+        # Flask 处理过的请求由 Flask 的中间件记录指标
+        scope['amll.flask'] = True
+        result = flask_app(environ, start_response)
+        return result, iter(result)
+
+    # Flask 的请求上下文保存在 contextvars 中，同一个响应的每一步可能由不同线程执行，
+    # 因此都在同一个 Context 中运行（各步骤依次执行，不会同时进入）
+    context = contextvars.copy_context()
+    result, chunks = await _wsgi_executor.run(context.run, start_app)
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        # 模板逐段渲染的响应每段只有几十字节，凑满一块再切回事件循环；
+        # 日志推送的每条消息都必须立即发出
+        is_event_stream = any(k == b'content-type' and v.startswith(b'text/event-stream')
+                              for k, v in started['headers'])
+        limit = 1 if is_event_stream else ASGI_STREAM_CHUNK_SIZE
+        finished = False
+        while not finished and not disconnected.is_set():
+            block, finished = await _wsgi_executor.run(context.run, _read_block, chunks, limit, admit=False)
+            if block:
+                await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        if hasattr(result, 'close'):
+            # close 会触发 after_request 中注册的回调（例如记录流式响应的流量）
+            await _wsgi_executor.run(context.run, result.close, admit=False)
+
+
+# --- 入口 ---
+
+async def _lifespan(receive, send):
+    """服务启动时初始化数据库并启动后台服务，与 main.py 的单进程模式相同"""
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await loop.run_in_executor(None, init_db)
+                # gunicorn 的主控进程启动时已清除指标文件；直接用 uvicorn 运行时没有主控进程钩子，
+                # 只清除已退出进程留下的文件
+                if 'gunicorn' not in sys.modules:
+                    await loop.run_in_executor(None, prune_metrics_dir)
+                await loop.run_in_executor(None, start_services)
+            except Exception as e:
+                logger.error(f"ASGI服务启动失败: {e}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for executor in (_file_executor, _db_executor, _wsgi_executor):
+                executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler = None
+    route = 'unmatched'
+    if scope['method'] in ('GET', 'HEAD'):
+        handler = ROUTES.get(scope['path'])
+        if handler is not None:
+            route = scope['path']
+        elif scope['path'].startswith('/api/db/'):
+            handler = serve_db_file
+            # 与 Flask 的路由规则一致，两种服务方式的指标可以直接相加
+            route = '/api/db/<path:path>'
+
+    # 每个请求在各自的 asyncio 任务中处理，耗时记录保存在任务自己的 Context 中
+    timing = begin_request()
+    start = timing.start
+    response = {'status': 500, 'elapsed': None, 'bytes': 0}
+
+    async def observed_send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['elapsed'] = time.perf_counter() - start
+            if not scope.get('amll.flask'):
+                # 交给 Flask 的请求由 Flask 的中间件添加
+                timing_header = server_timing_header(timing).encode('latin-1')
+                message = dict(message, headers=[*message['headers'], (b'server-timing', timing_header)])
+        else:
+            response['bytes'] += len(message.get('body', b''))
+        await send(message)
+
+    try:
+        await (handler or call_flask)(scope, receive, observed_send)
+    except ExecutorBusy as e:
+        logger.warning(f"线程池 {e} 排队已满，拒绝请求: {scope['path']}")
+        headers = Headers({'Content-Type': 'text/html; charset=utf-8', 'Retry-After': '1'})
+        await _send_response(observed_send, 503, headers, "服务器繁忙，请稍后重试。".encode('utf-8'), scope['method'])
+    finally:
+        if not scope.get('amll.flask'):
+            elapsed = response['elapsed'] if response['elapsed'] is not None else time.perf_counter() - start
+            record_request(route, scope['method'], response['status'], response['bytes'], elapsed)
+            if route not in EVENT_STREAM_ROUTES:
+                finish_request(timing, scope['method'], scope['path'], route, response['status'],
+                               scope['query_string'].decode('latin-1'))
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+# database.py 的性能基准测试
+# 先在独立的工作目录中生成指定规模的合成数据（歌曲和路径的热度服从Zipf分布），
+# 然后对写入和统计查询分别计时，输出 p50/p99 延迟和每秒处理行数。
+# 写入的行数按写入的记录数计算，查询的行数按返回的记录数计算（统计接口每次算作一行）。
+# 结果以JSON格式保存，可以用 --compare 与之前某次提交的结果对比。
+#
+# 用法:
+#   python benchmarks/db_benchmark.py --rows 1000000
+#   python benchmarks/db_benchmark.py --rows 10000000 --workdir /data/bench-10m --output result.json
+#   python benchmarks/db_benchmark.py --rows 1000000 --compare baseline.json
+#
+# 生成数据耗时较长（1亿行约需数十分钟），同一工作目录中规模和随机种子相同的数据会被直接复用。
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import sqlite3
+import subprocess
+import tempfile
+from datetime import datetime
+from itertools import accumulate
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# 获取logger实例
+logger = logging.getLogger('db_benchmark')
+
+PERIODS = ('today', 'monthly', 'yearly', 'total')
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Version/17.4 Safari/605.1.15',
+    'AMLL-Player/1.0',
+    'python-requests/2.31.0',
+    'curl/8.5.0',
+)
+INSERT_CHUNK_SIZE = 50000
+
+
+# --- 合成数据 ---
+
+def zipf_cum_weights(n, s):
+    """Zipf分布的累积权重，第k个元素（从0开始）的权重为 1/(k+1)^s"""
+    return list(accumulate(1.0 / (k + 1) ** s for k in range(n)))
+
+
+def dataset_sizes(rows):
+    """由日志行数推算其余各表的规模"""
+    songs = max(1000, rows // 50)
+    return {
+        'ncm_access_log': rows,
+        'traffic_log': rows,
+        'ncm_song_info': songs,
+        'ncm_no_lyrics': songs // 5,
+        'not_found': max(100, rows // 100),
+        'ips': max(100, rows // 200),
+    }
+
+
+def _timestamps(count, days, rng):
+    """在最近 days 天内按时间顺序生成 count 个时间戳字符串（格式与 sqlite3 的 datetime 适配器一致）"""
+    end = time.time()
+    start = end - days * 24 * 60 * 60
+    step = (end - start) / max(count, 1)
+    for i in range(count):
+        yield str(datetime.fromtimestamp(start + (i + rng.random()) * step))
+
+
+def _insert_chunked(conn, sql, rows):
+    """分块写入，每块一个事务"""
+    chunk = []
+    total = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            total += len(chunk)
+            chunk = []
+            if total % (INSERT_CHUNK_SIZE * 20) == 0:
+                logger.info(f"  已写入 {total} 行...")
+    if chunk:
+        conn.executemany(sql, chunk)
+        conn.commit()
+
+
+def _zipf_stream(population, cum_weights, count, rng):
+    """按Zipf分布逐块抽样，避免一次性在内存中生成全部结果"""
+    remaining = count
+    while remaining > 0:
+        k = min(remaining, INSERT_CHUNK_SIZE)
+        yield from rng.choices(population, cum_weights=cum_weights, k=k)
+        remaining -= k
+
+
+def generate_dataset(rows, days, zipf_s, seed):
+    """生成合成数据，返回各表的行数及生成耗时"""
+    from database import init_db, pack_ip, _backfill_ncm_rollups, _backfill_traffic_id_rollups
+    from db_pool import get_connection
+
+    rng = random.Random(seed)
+    sizes = dataset_sizes(rows)
+    init_db()
+
+    # 歌曲ID随机分布，热度排名与ID大小无关
+    song_ids = [str(i) for i in rng.sample(range(100000, 3000000000), sizes['ncm_song_info'])]
+    song_weights = zipf_cum_weights(len(song_ids), zipf_s)
+    lyric_paths = [f"/api/db/ncm-lyrics/{song_id}.ttml" for song_id in song_ids]
+    other_paths = ['/api/db/', '/api/db/ncm-lyrics/', '/api/db/metadata/contributors.jsonl', '/api/list/ncm-lyrics/']
+    paths = lyric_paths[:len(lyric_paths) // 2] + other_paths + lyric_paths[len(lyric_paths) // 2:]
+    path_weights = zipf_cum_weights(len(paths), zipf_s)
+    ips = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+           for _ in range(sizes['ips'])]
+    ip_weights = zipf_cum_weights(len(ips), zipf_s)
+
+    started = time.perf_counter()
+    with get_connection("ncm") as conn:
+        # 生成数据时不需要保证断电安全
+        conn.execute("PRAGMA synchronous=OFF")
+        logger.info(f"生成 ncm_song_info ({len(song_ids)} 行)...")
+        now = str(datetime.now())
+        _insert_chunked(conn, '''
+            INSERT INTO ncm_song_info (song_id, song_name, artists, album, last_updated) VALUES (?, ?, ?, ?, ?)
+        ''', ((song_id, f"歌曲 {song_id}", f"歌手 {int(song_id) % 5000}", f"专辑 {int(song_id) % 20000}", now)
+              for song_id in song_ids))
+
+        logger.info(f"生成 ncm_no_lyrics ({sizes['ncm_no_lyrics']} 行)...")
+        no_lyrics_ids = rng.sample(song_ids, sizes['ncm_no_lyrics'])
+        _insert_chunked(conn, '''
+            INSERT INTO ncm_no_lyrics (song_id, first_seen, attempt_count) VALUES (?, ?, ?)
+        ''', zip(no_lyrics_ids, sorted(_timestamps(len(no_lyrics_ids), days, rng)),
+                 (rng.randint(1, 50) for _ in no_lyrics_ids)))
+
+        logger.info(f"生成 ncm_access_log ({rows} 行)...")
+        _insert_chunked(conn, "INSERT INTO ncm_access_log (song_id, accessed_at) VALUES (?, ?)",
+                        zip(_zipf_stream(song_ids, song_weights, rows, rng), _timestamps(rows, days, rng)))
+        logger.info("重建 NCM 预聚合表...")
+        _backfill_ncm_rollups(conn.cursor())
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    with get_connection("traffic") as conn:
+        conn.execute("PRAGMA synchronous=OFF")
+        # 查找表的ID按列表顺序分配（随机生成的IP可能重复，重复的共用一个ID）
+        path_ids = {path: i for i, path in enumerate(paths, 1)}
+        ip_ids = {ip: i for i, ip in enumerate(dict.fromkeys(ips), 1)}
+        ua_ids = {ua: i for i, ua in enumerate(USER_AGENTS, 1)}
+        _insert_chunked(conn, "INSERT INTO traffic_paths (id, path) VALUES (?, ?)",
+                        ((i, path) for path, i in path_ids.items()))
+        _insert_chunked(conn, "INSERT INTO traffic_ips (id, ip) VALUES (?, ?)",
+                        ((i, pack_ip(ip)) for ip, i in ip_ids.items()))
+        _insert_chunked(conn, "INSERT INTO traffic_user_agents (id, user_agent) VALUES (?, ?)",
+                        ((i, ua) for ua, i in ua_ids.items()))
+        logger.info(f"生成 traffic_log ({rows} 行)...")
+        _insert_chunked(conn, '''
+            INSERT INTO traffic_log (path_id, ip_id, user_agent_id, response_size_bytes, timestamp) VALUES (?, ?, ?, ?, ?)
+        ''', ((path_ids[path], ip_ids[ip], ua_ids[rng.choice(USER_AGENTS)], rng.randint(500, 60000), ts)
+              for path, ip, ts in zip(_zipf_stream(paths, path_weights, rows, rng),
+                                      _zipf_stream(ips, ip_weights, rows, rng),
+                                      _timestamps(rows, days, rng))))
+        logger.info("重建流量预聚合表...")
+        _backfill_traffic_id_rollups(conn.cursor())
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    with get_connection("system") as conn:
+        logger.info(f"生成 not_found ({sizes['not_found']} 行)...")
+        _insert_chunked(conn, "INSERT OR IGNORE INTO not_found (path, count, last_seen) VALUES (?, ?, ?)",
+                        ((f"ncm-lyrics/{rng.randrange(100000, 3000000000)}.ttml", rng.randint(1, 100), ts)
+                         for ts in _timestamps(sizes['not_found'], days, rng)))
+
+    return {'sizes': sizes, 'generate_seconds': round(time.perf_counter() - started, 1), 'song_ids': song_ids,
+            'song_weights': song_weights}
+
+
+# --- 计时 ---
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def measure(name, func, iterations, warmup, rows_per_op):
+    """运行 warmup 次预热后计时 iterations 次，返回统计结果"""
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    total = sum(durations)
+    result = {
+        'iterations': iterations,
+        'rows_per_op': rows_per_op,
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'mean_ms': round(total / iterations * 1000, 3),
+        'max_ms': round(durations[-1] * 1000, 3),
+        'ops_per_second': round(iterations / total, 1) if total else None,
+        'rows_per_second': round(rows_per_op * iterations / total, 1) if total else None,
+    }
+    logger.info(f"{name:<36} p50 {result['p50_ms']:>10.3f} ms  p99 {result['p99_ms']:>10.3f} ms  "
+                f"{result['rows_per_second']:>12} rows/s")
+    return result
+
+
+def run_benchmarks(song_ids, song_weights, args):
+    import database
+
+    rng = random.Random(args.seed + 1)
+    results = {}
+    now = datetime.now
+
+    def sample_song():
+        return rng.choices(song_ids, cum_weights=song_weights, k=1)[0]
+
+    # 写入：单条写入对应直接调用，批量写入对应异步日志写入线程的刷写
+    results['record_traffic'] = measure('record_traffic', lambda: database.record_traffic(
+        f"/api/db/ncm-lyrics/{sample_song()}.ttml", '10.0.0.1', USER_AGENTS[0], 4096),
+        args.write_iterations, args.warmup, 1)
+    results['record_traffic_batch'] = measure('record_traffic_batch', lambda: database.record_traffic_batch([
+        (f"/api/db/ncm-lyrics/{sample_song()}.ttml", f"10.0.{i % 256}.1", USER_AGENTS[i % len(USER_AGENTS)], 4096, now())
+        for i in range(args.batch_size)]), args.batch_iterations, args.warmup, args.batch_size)
+    results['record_ncm_access'] = measure('record_ncm_access', lambda: database.record_ncm_access(sample_song()),
+                                           args.write_iterations, args.warmup, 1)
+    results['record_ncm_access_batch'] = measure('record_ncm_access_batch', lambda: database.record_ncm_access_batch(
+        [(sample_song(), now()) for _ in range(args.batch_size)]), args.batch_iterations, args.warmup, args.batch_size)
+
+    # 查询
+    results['get_ncm_stats'] = measure('get_ncm_stats', database.get_ncm_stats, args.read_iterations, args.warmup,
+                                       len(database.get_ncm_stats()))
+    for period in PERIODS:
+        results[f'get_ncm_dashboard_stats[{period}]'] = measure(
+            f'get_ncm_dashboard_stats[{period}]', lambda: database.get_ncm_dashboard_stats(period),
+            args.read_iterations, args.warmup, 1)
+    for period in PERIODS:
+        results[f'get_traffic_stats[{period}]'] = measure(
+            f'get_traffic_stats[{period}]', lambda: database.get_traffic_stats(period),
+            args.read_iterations, args.warmup, 1)
+    lookup_ids = rng.sample(song_ids, min(1000, len(song_ids)))
+    results['get_song_info[1000]'] = measure('get_song_info[1000]', lambda: database.get_song_info(lookup_ids),
+                                             args.read_iterations, args.warmup, len(lookup_ids))
+    return results
+
+
+# --- 结果 ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def db_file_sizes():
+    from config import DB_FILES
+    return {key: os.path.getsize(path) for key, path in DB_FILES.items() if os.path.exists(path)}
+
+
+def compare(results, baseline_path):
+    """打印与基线结果的 p50/p99 对比，变化率为正表示变慢"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n与基线对比 ({baseline['meta'].get('commit')} -> {git_commit()}):")
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms'):
+            if old[key]:
+                changes.append(f"{key} {old[key]:.3f} -> {result[key]:.3f} ({(result[key] / old[key] - 1) * 100:+.1f}%)")
+        print(f"  {name:<36} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='database.py 性能基准测试')
+    parser.add_argument('--rows', type=int, default=1000000, help='ncm_access_log 和 traffic_log 的行数')
+    parser.add_argument('--days', type=int, default=365, help='合成数据覆盖的天数（截止到当前时间）')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='Zipf分布的指数，越大热点越集中')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='数据所在目录，默认使用临时目录')
+    parser.add_argument('--read-iterations', type=int, default=50)
+    parser.add_argument('--write-iterations', type=int, default=200)
+    parser.add_argument('--batch-iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=None, help='批量写入的行数，默认与异步日志写入线程一致')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='结果JSON文件，默认为 db_benchmark_<rows>_<commit>.json')
+    parser.add_argument('--compare', help='与之前保存的结果JSON对比')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    # 被测代码中每条记录的日志会严重影响计时
+    logging.getLogger('database').setLevel(logging.WARNING)
+
+    output = os.path.abspath(args.output or f"db_benchmark_{args.rows}_{git_commit() or 'unknown'}.json")
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='db_benchmark_'))
+    os.makedirs(workdir, exist_ok=True)
+    # config.py 中的数据库路径是相对路径，切换目录后所有数据库都位于工作目录中
+    os.chdir(workdir)
+
+    from config import LOG_FLUSH_BATCH_SIZE
+    args.batch_size = args.batch_size or LOG_FLUSH_BATCH_SIZE
+
+    dataset_key = {'rows': args.rows, 'days': args.days, 'zipf_s': args.zipf_s, 'seed': args.seed}
+    marker = os.path.join(workdir, 'dataset.json')
+    dataset = None
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved['key'] == dataset_key:
+            logger.info(f"复用 {workdir} 中已生成的数据。")
+            dataset = saved
+            # 歌曲ID列表与生成时完全相同：重新运行相同种子的抽样即可得到
+            rng = random.Random(args.seed)
+            sizes = dataset['sizes']
+            dataset['song_ids'] = [str(i) for i in rng.sample(range(100000, 3000000000), sizes['ncm_song_info'])]
+            dataset['song_weights'] = zipf_cum_weights(sizes['ncm_song_info'], args.zipf_s)
+        else:
+            parser.error(f"{workdir} 中已有不同参数生成的数据，请换一个工作目录。")
+    if dataset is None:
+        logger.info(f"在 {workdir} 中生成 {args.rows} 行合成数据...")
+        dataset = generate_dataset(args.rows, args.days, args.zipf_s, args.seed)
+        with open(marker, 'w', encoding='utf-8') as f:
+            json.dump({'key': dataset_key, 'sizes': dataset['sizes'],
+                       'generate_seconds': dataset['generate_seconds']}, f)
+        logger.info(f"数据生成完成，耗时 {dataset['generate_seconds']} 秒。")
+
+    results = run_benchmarks(dataset['song_ids'], dataset['song_weights'], args)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'dataset': dataset_key,
+            'sizes': dataset['sizes'],
+            'generate_seconds': dataset['generate_seconds'],
+            'db_file_bytes': db_file_sizes(),
+            'batch_size': args.batch_size,
+        },
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"结果已写入 {output}")
+    if compare_path:
+        compare(results, compare_path)
+
+
+if __name__ == '__main__':
+    main()
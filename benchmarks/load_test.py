@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+
+# 端到端HTTP压测
+# 在本机准备全部外部依赖，不访问任何外部服务：
+#   - 一个本地裸仓库，包含接近真实规模的歌词目录树，作为唯一的同步源（不使用任何镜像）；
+#   - 模拟的网易云API（/api/song/detail）和GitHub API（/user/<id> 及头像，支持ETag）。
+# 被测服务在子进程中启动（Flask 或 ASGI），配置被改写为指向上述本地服务。
+# 压测按目标RPS以开环方式发送请求（延迟从计划发送时刻开始计算，服务变慢时排队时间也计入延迟），
+# 流量由热门歌词、冷门歌词、不存在的歌词、目录列表和仪表盘轮询按比例组成。
+# 压测进行到一半时向裸仓库推送一次提交并触发同步，分别统计同步前、同步中和同步后的延迟。
+#
+# 用法:
+#   python benchmarks/load_test.py --rps 500 --duration 60
+#   python benchmarks/load_test.py --server asgi --rps 2000 --connections 256 --output result.json
+#   python benchmarks/load_test.py --mix hot=50,cold=20,miss=15,listing=5,dashboard=10
+#
+# 同步通过向服务进程发送 SIGUSR1 触发，因此只能在类Unix系统上运行。
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 获取logger实例
+logger = logging.getLogger('load_test')
+
+DEFAULT_MIX = 'hot=55,cold=15,miss=10,listing=5,dashboard=15'
+DASHBOARD_PATHS = ('/api/status', '/api/ncm_dashboard?period=today', '/api/traffic?period=today',
+                   '/api/ncm_dashboard?period=total', '/api/traffic?period=monthly', '/api/contributors')
+LISTING_PATHS = ('/api/db/', '/api/db/ncm-lyrics/?limit=200', '/api/list/ncm-lyrics/?limit=200', '/api/db/metadata/')
+# 模拟的网易云API中，ID能被该数整除的歌曲视为不存在
+NCM_INVALID_MODULUS = 4
+
+
+# --- 本地仓库 ---
+
+def _ttml(song_id, rng):
+    """生成一份大小接近真实歌词的TTML文件"""
+    lines = []
+    for i in range(rng.randint(20, 80)):
+        begin = i * 4
+        words = ''.join(f'<span begin="{begin}.{j}" end="{begin}.{j + 1}">词{rng.randint(0, 9999)}</span>'
+                        for j in range(rng.randint(4, 10)))
+        lines.append(f'<p begin="{begin}" end="{begin + 4}">{words}</p>')
+    return (f'<tt xmlns="http://www.w3.org/ns/ttml"><head><metadata><amll:meta key="ncmMusicId" value="{song_id}"/>'
+            f'</metadata></head><body><div>{"".join(lines)}</div></body></tt>')
+
+
+def _git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+
+def build_upstream(workdir, lyric_count, contributor_count, rng):
+    """创建本地裸仓库及其工作副本，返回 (裸仓库URL, 工作副本路径, 歌曲ID列表)"""
+    work = os.path.join(workdir, 'upstream-work')
+    bare = os.path.join(workdir, 'upstream.git')
+    song_ids = sorted(rng.sample(range(100000, 3000000000), lyric_count))
+    os.makedirs(os.path.join(work, 'ncm-lyrics'))
+    for song_id in song_ids:
+        with open(os.path.join(work, 'ncm-lyrics', f'{song_id}.ttml'), 'w', encoding='utf-8') as f:
+            f.write(_ttml(song_id, rng))
+    for directory in ('qq-lyrics', 'spotify-lyrics', 'raw-lyrics'):
+        os.makedirs(os.path.join(work, directory))
+        for song_id in song_ids[:lyric_count // 10]:
+            with open(os.path.join(work, directory, f'{song_id}.ttml'), 'w', encoding='utf-8') as f:
+                f.write(_ttml(song_id, rng))
+    os.makedirs(os.path.join(work, 'metadata'))
+    with open(os.path.join(work, 'metadata', 'contributors.jsonl'), 'w', encoding='utf-8') as f:
+        for github_id in range(1000, 1000 + contributor_count):
+            f.write(json.dumps({'githubId': github_id, 'count': rng.randint(1, 500)}) + '\n')
+    _git(work, 'init', '-q', '-b', 'main')
+    _git(work, 'add', '-A')
+    _git(work, '-c', 'user.name=load-test', '-c', 'user.email=load-test@localhost', 'commit', '-qm', 'initial')
+    _git(workdir, 'clone', '-q', '--bare', work, bare)
+    _git(work, 'remote', 'add', 'origin', bare)
+    return f"file://{bare}", work, [str(song_id) for song_id in song_ids]
+
+
+def push_update(work, song_ids, rng, changes):
+    """向裸仓库推送一次提交：修改、新增、删除各 changes 个歌词文件，返回新增的歌曲ID"""
+    lyric_dir = os.path.join(work, 'ncm-lyrics')
+    for song_id in rng.sample(song_ids, changes):
+        with open(os.path.join(lyric_dir, f'{song_id}.ttml'), 'w', encoding='utf-8') as f:
+            f.write(_ttml(song_id, rng))
+    added = [str(song_id) for song_id in rng.sample(range(3000000000, 4000000000), changes)]
+    for song_id in added:
+        with open(os.path.join(lyric_dir, f'{song_id}.ttml'), 'w', encoding='utf-8') as f:
+            f.write(_ttml(song_id, rng))
+    # 只删除列表末尾的文件，压测中的冷门请求会因此出现少量预期内的404
+    for song_id in song_ids[-changes:]:
+        os.remove(os.path.join(lyric_dir, f'{song_id}.ttml'))
+    _git(work, 'add', '-A')
+    _git(work, '-c', 'user.name=load-test', '-c', 'user.email=load-test@localhost', 'commit', '-qm', 'update')
+    _git(work, 'push', '-q', 'origin', 'main')
+    return added
+
+
+# --- 模拟的外部服务 ---
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """同时模拟网易云API和GitHub API，按路径区分"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        url = urlparse(self.path)
+        if url.path == '/api/song/detail':
+            server.count('ncm')
+            ids = parse_qs(url.query).get('ids', ['[]'])[0].strip('[]')
+            songs = [{'id': int(song_id), 'name': f'歌曲 {song_id}',
+                      'artists': [{'name': f'歌手 {int(song_id) % 500}'}], 'album': {'name': f'专辑 {song_id}'}}
+                     for song_id in ids.split(',') if song_id and int(song_id) % NCM_INVALID_MODULUS]
+            body = json.dumps({'code': 200, 'songs': songs}).encode('utf-8')
+            return self._send(200, body, {'Content-Type': 'application/json'})
+        if url.path.startswith('/user/'):
+            github_id = url.path.rsplit('/', 1)[1]
+            etag = f'"v1-{github_id}"'
+            headers = {'ETag': etag, 'X-RateLimit-Remaining': '5000', 'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+            if self.headers.get('If-None-Match') == etag:
+                server.count('github_304')
+                return self._send(304, headers=headers)
+            server.count('github')
+            body = json.dumps({'login': f'user{github_id}', 'name': f'用户 {github_id}',
+                               'avatar_url': f'{server.base_url}/avatars/{github_id}.png'}).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+            return self._send(200, body, headers)
+        if url.path.startswith('/avatars/'):
+            server.count('avatar')
+            return self._send(200, b'\x89PNG\r\n\x1a\n' + b'\0' * 2048, {'Content-Type': 'image/png', 'ETag': '"avatar-v1"'})
+        self._send(404)
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), FakeUpstreamHandler)
+        self.latency = latency
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+# --- 被测服务（在子进程中运行） ---
+
+def serve(options):
+    """子进程入口：改写配置后按与生产环境相同的方式启动服务"""
+    os.chdir(options['server_dir'])
+    sys.path.insert(0, REPO_ROOT)
+    # 必须在导入其他模块之前改写，各模块在导入时读取配置
+    import config
+    config.REPO_URL = options['repo_url']
+    config.MIRRORS = []
+    config.NCM_API_BASE = options['upstream']
+    config.GITHUB_API_BASE = options['upstream']
+    # 同步只由压测进程通过信号触发
+    config.UPDATE_INTERVAL = 24 * 60 * 60
+    import main
+    import git_manager
+    signal.signal(signal.SIGUSR1,
+                  lambda signum, frame: threading.Thread(target=git_manager.update_repo, daemon=True).start())
+    if options['server'] == 'asgi':
+        import uvicorn
+        uvicorn.run('asgi:app', host='127.0.0.1', port=options['port'], log_level='warning')
+    else:
+        main.init_db()
+        main.start_services()
+        main.app.run(host='127.0.0.1', port=options['port'], threaded=True)
+
+
+# --- 压测客户端 ---
+
+class Connection:
+    """最小的 HTTP/1.1 keep-alive 客户端，支持 Content-Length 和 chunked 响应"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, path, headers=None):
+        """发送GET请求，返回 (状态码, 响应体, 响应头)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "User-Agent: load-test/1.0"]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('连接已被服务端关闭')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+
+        body = b''
+        keep_alive = response_headers.get('connection', '').lower() != 'close' and status_line.startswith(b'HTTP/1.1')
+        if status in (204, 304):
+            pass
+        elif 'content-length' in response_headers:
+            body = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                chunk_size = int((await self.reader.readline()).split(b';')[0], 16)
+                if chunk_size == 0:
+                    while (await self.reader.readline()) not in (b'\r\n', b''):
+                        pass
+                    break
+                chunks.append((await self.reader.readexactly(chunk_size + 2))[:-2])
+            body = b''.join(chunks)
+        else:
+            body = await self.reader.read()
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return status, body, response_headers
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class TrafficMix:
+    """按比例生成请求：(路由类别, 路径, 请求头, 可接受的状态码)"""
+
+    def __init__(self, mix, song_ids, zipf_s, rng):
+        self.routes = list(mix)
+        self.cum_weights = list(accumulate_weights(mix.values()))
+        self.song_ids = song_ids
+        # 热门请求集中在前1%的歌曲上，排名服从Zipf分布
+        self.hot_ids = song_ids[:max(1, len(song_ids) // 100)]
+        self.hot_weights = list(accumulate_weights(1.0 / (k + 1) ** zipf_s for k in range(len(self.hot_ids))))
+        self.rng = rng
+        self.removed = set()
+
+    def next(self):
+        route = self.rng.choices(self.routes, cum_weights=self.cum_weights)[0]
+        encoding = {'Accept-Encoding': 'gzip, br'}
+        if route == 'hot':
+            song_id = self.rng.choices(self.hot_ids, cum_weights=self.hot_weights)[0]
+            return route, f"/api/db/ncm-lyrics/{song_id}.ttml", encoding, (200,)
+        if route == 'cold':
+            song_id = self.rng.choice(self.song_ids)
+            # 同步提交中删除的文件在服务完成同步前后分别返回200和404
+            expected = (200, 404) if song_id in self.removed else (200,)
+            return route, f"/api/db/ncm-lyrics/{song_id}.ttml", encoding, expected
+        if route == 'miss':
+            # 不存在的歌词：触发404记录和后台的网易云API检测
+            return route, f"/api/db/ncm-lyrics/{self.rng.randrange(5000000000, 5000100000)}.ttml", {}, (404,)
+        if route == 'listing':
+            return route, self.rng.choice(LISTING_PATHS), {}, (200,)
+        return route, self.rng.choice(DASHBOARD_PATHS), {}, (200,)
+
+
+def accumulate_weights(weights):
+    total = 0.0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ('hot', 'cold', 'miss', 'listing', 'dashboard'):
+            raise argparse.ArgumentTypeError(f"未知的路由类别: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class LoadTest:
+    def __init__(self, args, mix, port, server_pid, work, song_ids, rng):
+        self.args = args
+        self.mix = mix
+        self.port = port
+        self.server_pid = server_pid
+        self.work = work
+        self.song_ids = song_ids
+        self.rng = rng
+        # (路由类别, 阶段, 延迟秒数, 是否符合预期, 响应字节数)
+        self.samples = []
+        self.phase = 'before_sync'
+        self.sync = {}
+
+    async def one_request(self, pool, route, path, headers, expected, scheduled_at):
+        loop = asyncio.get_running_loop()
+        phase = self.phase
+        conn = await pool.get()
+        ok, size = False, 0
+        try:
+            status, body, _ = await asyncio.wait_for(conn.request(path, headers), self.args.timeout)
+            ok, size = status in expected, len(body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn.close()
+        finally:
+            pool.put_nowait(conn)
+        self.samples.append((route, phase, loop.time() - scheduled_at, ok, size))
+
+    async def run_sync(self):
+        """推送一次提交并触发同步，等待 /api/status 中的同步时间变化"""
+        loop = asyncio.get_running_loop()
+        conn = Connection('127.0.0.1', self.port)
+        before = await self._sync_status(conn)
+        added = await loop.run_in_executor(None, push_update, self.work, self.song_ids, self.rng, self.args.sync_changes)
+        # 发出信号前标记已删除的文件，之后的冷门请求对它们预期404
+        self.traffic.removed.update(self.song_ids[-self.args.sync_changes:])
+        self.phase = 'during_sync'
+        started = loop.time()
+        os.kill(self.server_pid, signal.SIGUSR1)
+        while await self._sync_status(conn) == before:
+            await asyncio.sleep(0.2)
+        self.sync['seconds'] = round(loop.time() - started, 2)
+        self.sync['status'] = (await self._sync_status(conn))[1]
+        status, _, _ = await conn.request(f"/api/db/ncm-lyrics/{added[0]}.ttml")
+        self.sync['new_file_status'] = status
+        self.phase = 'after_sync'
+        conn.close()
+        logger.info(f"同步完成 ({self.sync['status']})，耗时 {self.sync['seconds']} 秒，新增文件返回 {status}。")
+
+    async def _sync_status(self, conn):
+        _, body, _ = await conn.request('/api/status')
+        data = json.loads(body)
+        return data['last_update_time'], data['last_update_status']
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.traffic = TrafficMix(self.mix, self.song_ids, self.args.zipf_s, self.rng)
+        pool = asyncio.Queue()
+        for _ in range(self.args.connections):
+            pool.put_nowait(Connection('127.0.0.1', self.port))
+
+        tasks = set()
+        sync_task = None
+        start = loop.time()
+        interval = 1 / self.args.rps
+        total = int(self.args.duration * self.args.rps)
+        for i in range(total):
+            scheduled_at = start + i * interval
+            delay = scheduled_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if sync_task is None and self.args.sync_at is not None and scheduled_at - start >= self.args.sync_at:
+                sync_task = asyncio.create_task(self.run_sync())
+            task = asyncio.create_task(self.one_request(pool, *self.traffic.next(), scheduled_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        if sync_task:
+            await sync_task
+        self.elapsed = loop.time() - start
+        while not pool.empty():
+            pool.get_nowait().close()
+
+
+# --- 报告 ---
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for _, _, latency, _, _ in samples)
+    errors = sum(1 for *_, ok, _ in samples if not ok)
+
+    def pct(p):
+        return round(latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)] * 1000, 2) if latencies else None
+
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'error_rate': round(errors / len(samples), 4) if samples else None,
+        'bytes': sum(size for *_, size in samples),
+        'p50_ms': pct(50),
+        'p90_ms': pct(90),
+        'p99_ms': pct(99),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+def build_report(test, fake, args):
+    samples = test.samples
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'serve'},
+        'overall': summarize(samples, test.elapsed),
+        'routes': {},
+        'phases': {},
+        'sync': test.sync,
+        'upstream_requests': dict(fake.counts),
+    }
+    for route in test.mix:
+        report['routes'][route] = summarize([s for s in samples if s[0] == route], test.elapsed)
+    for phase in ('before_sync', 'during_sync', 'after_sync'):
+        phase_samples = [s for s in samples if s[1] == phase]
+        if phase_samples:
+            report['phases'][phase] = {
+                'overall': summarize(phase_samples, None),
+                'routes': {route: summarize([s for s in phase_samples if s[0] == route], None) for route in test.mix},
+            }
+    return report
+
+
+def print_report(report):
+    def row(name, stats):
+        print(f"  {name:<22} {stats['requests']:>8} {stats['throughput_rps'] or '':>9} {stats['error_rate']:>8} "
+              f"{stats['p50_ms']:>9} {stats['p90_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9}")
+
+    print(f"\n  {'路由':<20} {'请求数':>6} {'RPS':>9} {'错误率':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    row('overall', report['overall'])
+    for route, stats in report['routes'].items():
+        if stats['requests']:
+            row(route, stats)
+    for phase, data in report['phases'].items():
+        row(phase, data['overall'])
+    print(f"\n  同步: {report['sync'] or '未执行'}")
+    print(f"  模拟外部服务收到的请求: {report['upstream_requests']}")
+
+
+# --- 入口 ---
+
+def wait_until_ready(port, timeout):
+    """等待首次同步完成、贡献者快照生成"""
+    import urllib.request
+    import urllib.error
+    deadline = time.monotonic() + timeout
+    pending = ['/api/db/', '/api/contributors']
+    while pending:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"服务在 {timeout} 秒内未就绪: {pending}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}{pending[0]}", timeout=5) as response:
+                if response.status == 200:
+                    pending.pop(0)
+                    continue
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端HTTP压测，所有外部依赖均在本机模拟')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--rps', type=float, default=300, help='目标每秒请求数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长（秒）')
+    parser.add_argument('--connections', type=int, default=64, help='keep-alive 连接数，也是最大并发请求数')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'流量比例，默认 {DEFAULT_MIX}')
+    parser.add_argument('--lyrics', type=int, default=5000, help='仓库中 ncm-lyrics 的文件数')
+    parser.add_argument('--contributors', type=int, default=50)
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='热门歌词的Zipf指数')
+    parser.add_argument('--sync-at', type=float, default=None, help='开始后第几秒触发同步，默认为压测时长的一半，负数表示不同步')
+    parser.add_argument('--sync-changes', type=int, default=50, help='同步提交中修改、新增、删除的文件数')
+    parser.add_argument('--upstream-latency-ms', type=float, default=50, help='模拟外部服务的响应延迟')
+    parser.add_argument('--timeout', type=float, default=10, help='单个请求的超时时间（秒）')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='仓库和服务数据所在目录，默认使用临时目录')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(json.loads(args.serve))
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    if args.sync_at is None:
+        args.sync_at = args.duration / 2
+    elif args.sync_at < 0:
+        args.sync_at = None
+    rng = random.Random(args.seed)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='load_test_'))
+    os.makedirs(workdir, exist_ok=True)
+
+    logger.info(f"在 {workdir} 中生成本地仓库 ({args.lyrics} 首歌词)...")
+    repo_url, work, song_ids = build_upstream(workdir, args.lyrics, args.contributors, rng)
+    fake = FakeUpstream(args.upstream_latency_ms / 1000)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    server_dir = os.path.join(workdir, 'server')
+    os.makedirs(server_dir)
+    options = {'server_dir': server_dir, 'repo_url': repo_url, 'upstream': fake.base_url,
+               'server': args.server, 'port': args.port}
+    logger.info(f"启动被测服务 ({args.server})，端口 {args.port}...")
+    with open(os.path.join(workdir, 'server.out'), 'wb') as server_out:
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', json.dumps(options)],
+                                  stdout=server_out, stderr=subprocess.STDOUT)
+    try:
+        wait_until_ready(args.port, timeout=120)
+        logger.info(f"服务已就绪，开始压测: {args.rps} RPS，持续 {args.duration} 秒...")
+        test = LoadTest(args, args.mix, args.port, server.pid, work, song_ids, rng)
+        asyncio.run(test.run())
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        fake.shutdown()
+
+    report = build_report(test, fake, args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
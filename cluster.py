@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# 多进程部署的协调
+# 所有工作进程竞争同一个锁文件，抢到锁的进程成为主进程，负责仓库同步、
+# 镜像探测和贡献者刷新等后台任务；锁在进程退出时由操作系统自动释放，
+# 其余进程会在轮询时接替。主进程把同步状态、代理状态和每次同步的变更集
+# 写入 system.db，从进程定期读取，并把变更集交给本进程的索引和缓存。
+
+import os
+import time
+import logging
+import threading
+import proxy_manager
+import git_manager
+from config import LEADER_LOCK_FILE, SHARED_STATE_POLL_INTERVAL
+from database import set_shared_state, get_shared_state, add_sync_event, get_sync_events
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 全局变量：持有锁的文件对象，进程存活期间保持打开
+_lock_file = None
+_leader_lock = threading.Lock()
+
+def try_become_leader():
+    """尝试获取主进程锁，成功（或本进程已是主进程）时返回True"""
+    global _lock_file
+    with _leader_lock:
+        if _lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(LEADER_LOCK_FILE) or '.', exist_ok=True)
+        f = open(LEADER_LOCK_FILE, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        # 写入进程号，便于排查是哪个进程在执行同步
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        _lock_file = f
+    logger.info(f"进程 {os.getpid()} 成为主进程，负责同步任务。")
+    return True
+
+def is_leader():
+    return _lock_file is not None
+
+def publish_sync_event(change_set):
+    """同步监听者（仅主进程）：把变更集写入数据库，供其他进程读取"""
+    add_sync_event(change_set)
+
+def leader_publisher():
+    """主进程的后台任务：同步状态或代理状态变化时写入共享状态"""
+    published = (None, None)
+    while True:
+        current = (git_manager.get_last_update_status(), proxy_manager.status_version)
+        if current != published:
+            try:
+                last_update_time, last_update_status = current[0]
+                set_shared_state('sync_status', {'time': last_update_time, 'status': last_update_status})
+                set_shared_state('proxy_status', {'version': current[1], 'status': proxy_manager.get_proxy_status()})
+                published = current
+            except Exception as e:
+                logger.error(f"写入共享状态失败: {e}")
+        time.sleep(SHARED_STATE_POLL_INTERVAL)
+
+def _apply_shared_state(applied_proxy_version):
+    """把主进程写入的同步状态和代理状态应用到本进程，返回已应用的代理状态版本"""
+    sync_status, _ = get_shared_state('sync_status')
+    if sync_status:
+        git_manager.set_last_update_status(sync_status['time'], sync_status['status'])
+    shared_proxy, _ = get_shared_state('proxy_status')
+    if shared_proxy and shared_proxy['version'] != applied_proxy_version:
+        proxy_manager.replace_proxy_status(shared_proxy['status'])
+        applied_proxy_version = shared_proxy['version']
+    return applied_proxy_version
+
+def follower_loop(on_promoted, last_event_id):
+    """
+    从进程的后台任务：轮询共享状态和同步事件，把 last_event_id 之后的变更集交给本进程的监听者；
+    主进程退出后接替成为主进程，并调用 on_promoted 启动主进程的后台任务。
+    last_event_id 应在本进程构建索引之前读取，构建期间主进程发布的变更集才不会被跳过
+    （重复应用已经反映在索引中的变更集是无害的）。
+    """
+    applied_proxy_version = None
+    logger.info(f"进程 {os.getpid()} 作为从进程运行，从同步事件 {last_event_id} 之后开始跟随。")
+    while True:
+        time.sleep(SHARED_STATE_POLL_INTERVAL)
+        try:
+            for event_id, change_set in get_sync_events(last_event_id):
+                git_manager.publish_change_set(change_set)
+                last_event_id = event_id
+            applied_proxy_version = _apply_shared_state(applied_proxy_version)
+        except Exception as e:
+            logger.error(f"读取共享状态失败: {e}")
+        if try_become_leader():
+            on_promoted()
+            return
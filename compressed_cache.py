@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import time
+import logging
+import threading
+from config import COMPRESSED_CACHE_DIR, COMPRESSIBLE_EXTENSIONS, COMPRESS_MIN_SIZE, REPO_DIR
+from repo_index import get_repo_index
+from cluster import is_leader
+
+# brotli 为可选依赖，未安装时只生成 gzip 版本
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 支持的编码及对应的文件后缀，按服务端偏好排序
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) if brotli else (('gzip', '.gz'),)
+
+# 全局变量：已生成的压缩版本 {ETag: 编码集合}，构建完成后整体替换
+_available = {}
+# 有压缩版本的文件路径 -> ETag，用于增量更新时找出不再被引用的旧版本
+_path_etags = {}
+# 多进程部署时压缩文件由所有工作进程共享。从进程的索引可能落后于主进程（例如启动时用旧索引预压缩），
+# 按从进程的索引删除文件会误删主进程刚生成的版本，因此只有主进程删除文件；
+# 从进程只生成缺失的版本，并从自己的 _available 中移除不再引用的版本
+_build_lock = threading.Lock()
+
+def _variant_path(etag, suffix):
+    """压缩版本以内容哈希命名，内容不变的文件无需重新压缩"""
+    return os.path.join(COMPRESSED_CACHE_DIR, etag[:2], f"{etag}{suffix}")
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0 使输出只取决于内容
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _is_compressible(path, size):
+    return size >= COMPRESS_MIN_SIZE and path.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+
+def _build_file_variants(path, etag):
+    """为单个文件生成缺失的压缩版本，返回可用的编码集合"""
+    data = None
+    encodings = set()
+    created = 0
+    for encoding, suffix in ENCODINGS:
+        variant = _variant_path(etag, suffix)
+        if not os.path.exists(variant):
+            try:
+                if data is None:
+                    with open(os.path.join(REPO_DIR, path), 'rb') as f:
+                        data = f.read()
+                os.makedirs(os.path.dirname(variant), exist_ok=True)
+                # 先写临时文件再替换，避免请求读到写了一半的文件；
+                # 多进程部署时各进程可能同时生成同一个文件，临时文件名带上进程号
+                tmp_path = f"{variant}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(_compress(data, encoding))
+                os.replace(tmp_path, variant)
+                created += 1
+            except OSError as e:
+                logger.warning(f"生成 {path} 的 {encoding} 压缩版本失败: {e}")
+                continue
+        encodings.add(encoding)
+    return encodings, created
+
+def build_compressed_variants(index):
+    """
+    为索引中的可压缩文件增量生成压缩版本：已存在的版本直接复用，
+    不再被任何文件引用的旧版本由主进程删除。
+    """
+    if index is None:
+        return
+    global _available, _path_etags
+    with _build_lock:
+        start = time.perf_counter()
+        available = {}
+        path_etags = {}
+        created = 0
+        for path, (size, _, etag) in index.files.items():
+            if not _is_compressible(path, size):
+                continue
+            encodings, count = _build_file_variants(path, etag)
+            created += count
+            if encodings:
+                available[etag] = encodings
+                path_etags[path] = etag
+
+        _available = available
+        _path_etags = path_etags
+        removed = _remove_stale_variants(available) if is_leader() else 0
+        elapsed = time.perf_counter() - start
+        logger.info(f"预压缩完成: 新生成 {created} 个, 删除过期 {removed} 个, 共 {len(available)} 个文件有压缩版本, 耗时 {elapsed:.2f} 秒。")
+
+def apply_change_set(change_set):
+    """
+    同步监听者：只为变更集中新增或修改的文件生成压缩版本，
+    主进程同时删除不再被引用的旧版本；需要全量刷新时扫描整个索引。
+    """
+    global _available, _path_etags
+    index = get_repo_index()
+    if index is None:
+        return
+    if change_set['full'] or not _path_etags:
+        build_compressed_variants(index)
+        return
+    with _build_lock:
+        start = time.perf_counter()
+        available = dict(_available)
+        path_etags = dict(_path_etags)
+        old_etags = set()
+        created = 0
+        for path in change_set['removed'] + change_set['modified']:
+            etag = path_etags.pop(path, None)
+            if etag:
+                old_etags.add(etag)
+        for path in change_set['added'] + change_set['modified']:
+            entry = index.get_file(path)
+            if entry is None or not _is_compressible(path, entry[0]):
+                continue
+            size, _, etag = entry
+            encodings, count = _build_file_variants(path, etag)
+            created += count
+            if encodings:
+                available[etag] = encodings
+                path_etags[path] = etag
+
+        # 同一内容可能被多个文件引用，只删除已没有任何文件引用的版本
+        stale = old_etags - set(path_etags.values())
+        for etag in stale:
+            available.pop(etag, None)
+        _available = available
+        _path_etags = path_etags
+        removed = 0
+        for etag in (stale if is_leader() else ()):
+            for _, suffix in ENCODINGS:
+                try:
+                    os.remove(_variant_path(etag, suffix))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"删除过期压缩文件 {etag}{suffix} 失败: {e}")
+        elapsed = time.perf_counter() - start
+        logger.info(f"增量预压缩完成: 新生成 {created} 个, 删除过期 {removed} 个, 耗时 {elapsed:.3f} 秒。")
+
+def _remove_stale_variants(available):
+    """删除不再被当前仓库内容引用的压缩文件"""
+    removed = 0
+    if not os.path.isdir(COMPRESSED_CACHE_DIR):
+        return removed
+    for bucket in os.scandir(COMPRESSED_CACHE_DIR):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            etag, _, _ = entry.name.partition('.')
+            if etag not in available:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"删除过期压缩文件 {entry.path} 失败: {e}")
+    return removed
+
+def choose_variant(etag, accept_encodings):
+    """
+    根据请求的 Accept-Encoding 选择最合适的压缩版本。
+    返回 (编码, 文件路径)，没有可用版本或客户端不接受压缩时返回None。
+    """
+    encodings = _available.get(etag)
+    if not encodings:
+        return None
+    offered = [encoding for encoding, _ in ENCODINGS if encoding in encodings]
+    best = accept_encodings.best_match(offered)
+    if best is None:
+        return None
+    suffix = dict(ENCODINGS)[best]
+    return best, os.path.abspath(_variant_path(etag, suffix))
+
+def get_variant_paths(etag):
+    """返回该内容所有已生成的压缩版本 [(编码, 文件路径)]"""
+    encodings = _available.get(etag, ())
+    return [(encoding, os.path.abspath(_variant_path(etag, suffix)))
+            for encoding, suffix in ENCODINGS if encoding in encodings]
+
+def has_variants(etag):
+    """该内容是否有压缩版本（决定响应是否需要 Vary: Accept-Encoding）"""
+    return etag in _available
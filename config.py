@@ -29,3 +29,177 @@ MIRRORS = [
 # 仓库的用户名和仓库名
 REPO_USER = "Steve-xmh"
 REPO_NAME = "amll-ttml-db"
+
+# --- 异步日志写入队列 ---
+# 队列最大长度，超出后新记录将被丢弃（见 log_writer.py 中的溢出策略说明）
+LOG_QUEUE_MAXSIZE = 50000
+# 后台刷写间隔（毫秒）
+LOG_FLUSH_INTERVAL_MS = 500
+# 单次刷写的最大记录数，队列中积压达到该数量时立即刷写
+LOG_FLUSH_BATCH_SIZE = 1000
+# 流量日志中路径、IP、User-Agent 到查找表ID的进程内缓存，每种类型保留的最大项数
+TRAFFIC_INTERN_CACHE_SIZE = 20000
+
+# --- SQLite连接池 ---
+# 每个数据库文件保留的空闲连接数上限
+SQLITE_POOL_SIZE = 8
+# 等待数据库锁的超时时间（毫秒）
+SQLITE_BUSY_TIMEOUT_MS = 5000
+# 内存映射读取的大小（字节）
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+# 每个连接的页缓存大小（KB）
+SQLITE_CACHE_SIZE_KB = 16 * 1024
+# 每个连接缓存的预编译语句数量
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# --- 目录列表分页 ---
+# 目录列表每页默认条目数
+DIR_LISTING_PAGE_SIZE = 500
+# 客户端可请求的每页最大条目数
+DIR_LISTING_MAX_PAGE_SIZE = 5000
+
+# --- 歌词文件的HTTP缓存策略 ---
+# 客户端可直接使用缓存的时间（秒），与自动更新间隔一致
+LYRIC_CACHE_MAX_AGE = UPDATE_INTERVAL
+# 缓存过期后，允许客户端先使用旧内容、同时在后台重新验证的时间（秒）
+LYRIC_CACHE_STALE_WHILE_REVALIDATE = 60 * 60
+
+# --- 预压缩文件 ---
+# 压缩版本的存放目录（按内容哈希命名，可随时删除，下次同步后会重新生成）
+COMPRESSED_CACHE_DIR = "data/compressed"
+# 需要预压缩的文件扩展名
+COMPRESSIBLE_EXTENSIONS = ('.ttml', '.lrc', '.xml', '.json', '.jsonl', '.txt', '.md')
+# 小于该大小（字节）的文件不值得压缩
+COMPRESS_MIN_SIZE = 512
+
+# --- 热门歌词内存缓存 ---
+# 缓存的文件内容总大小上限（字节）
+LYRIC_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 单个文件超过该大小（字节）时不放入缓存
+LYRIC_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+# 启动时根据访问统计预热的热门歌曲数量
+LYRIC_CACHE_PREWARM_COUNT = 1000
+
+# --- 镜像竞速 ---
+# 每轮同时探测的镜像数量（另外总会加上GitHub原始地址）
+MIRROR_RACE_WIDTH = 4
+# 单轮探测（git ls-remote）的最长等待时间（秒）
+MIRROR_PROBE_TIMEOUT = 10
+
+# --- 镜像健康模型 ---
+# 延迟和吞吐量EWMA的平滑系数，越大越偏重最近的测量值
+PROXY_EWMA_ALPHA = 0.3
+# 成功率窗口保留的最近结果数
+PROXY_SUCCESS_WINDOW = 20
+# 失败后的退避时间（秒），每连续失败一次翻倍，直到上限
+PROXY_BACKOFF_BASE = 60
+PROXY_BACKOFF_MAX = 6 * 60 * 60
+# 估算传输耗时使用的数据量（字节），以及没有吞吐量数据时假定的吞吐量（字节/秒）
+PROXY_EXPECTED_TRANSFER_BYTES = 8 * 1024 * 1024
+PROXY_DEFAULT_THROUGHPUT = 256 * 1024
+# 代理状态文件的最短保存间隔（秒）
+PROXY_SAVE_INTERVAL = 60
+# 后台探测所有镜像的间隔（秒）
+PROXY_PROBE_INTERVAL = 15 * 60
+
+# --- 网易云API ---
+# API根地址（可替换为反向代理或测试用的模拟服务）
+NCM_API_BASE = "https://music.163.com"
+# 每个歌曲详情请求携带的最大ID数量
+NCM_API_CHUNK_SIZE = 100
+# 并发请求数
+NCM_API_MAX_WORKERS = 4
+# 每秒最多发出的请求数
+NCM_API_RATE_LIMIT = 10
+# 单个请求的超时时间（秒）
+NCM_API_TIMEOUT = 15
+
+# --- NCM无歌词检测后台任务 ---
+# 待检测歌曲ID队列的最大长度，超出后新ID将被丢弃
+NCM_ENRICH_QUEUE_MAXSIZE = 10000
+# 每批检测的最大ID数量，以及凑批的最长等待时间（毫秒）
+NCM_ENRICH_BATCH_SIZE = 200
+NCM_ENRICH_INTERVAL_MS = 1000
+# 检测结果的缓存时间（秒）：有效歌曲 / 无效歌曲
+NCM_ENRICH_POSITIVE_TTL = 24 * 60 * 60
+NCM_ENRICH_NEGATIVE_TTL = 60 * 60
+# 检测结果缓存的最大条目数
+NCM_ENRICH_CACHE_MAX_ENTRIES = 100000
+
+# --- 贡献者数据 ---
+# GitHub API根地址（可替换为反向代理或测试用的模拟服务）
+GITHUB_API_BASE = "https://api.github.com"
+# 后台定时刷新贡献者数据的间隔（秒）
+CONTRIBUTORS_REFRESH_INTERVAL = 6 * 60 * 60
+# 贡献者信息在数据库中的有效期（秒），过期后用条件请求向GitHub确认
+CONTRIBUTORS_STALE_AFTER = 24 * 60 * 60
+# 并发请求GitHub的线程数
+CONTRIBUTORS_MAX_WORKERS = 4
+# 预先生成的接口响应文件
+CONTRIBUTORS_SNAPSHOT_FILE = "data/contributors.json"
+# 头像保存目录
+AVATAR_DIR = "static/avatars"
+
+# --- 日志查看 ---
+# 首次打开日志页面时返回的行数
+LOG_TAIL_LINES = 1000
+# 单次增量读取返回的最大字节数，超出部分由下一次请求继续读取
+LOG_TAIL_MAX_BYTES = 512 * 1024
+# 内存中保留的最近日志条数，供实时推送（SSE）使用
+LOG_RING_BUFFER_SIZE = 2000
+# 实时推送连接在没有新日志时发送心跳的间隔（秒）
+LOG_STREAM_HEARTBEAT = 15
+# 每个进程同时保持的实时推送连接数上限，超出时返回503，页面退回到增量轮询。
+# 以 WSGI 方式运行时每个连接占用一个服务线程（gunicorn.conf.py 中每个工作进程 8 个）
+LOG_STREAM_MAX_CLIENTS = 2
+
+# --- 多进程部署 ---
+# 选举负责同步任务的主进程所用的锁文件
+LEADER_LOCK_FILE = "data/leader.lock"
+# 从进程轮询共享状态和同步事件的间隔（秒）
+SHARED_STATE_POLL_INTERVAL = 2
+# 数据库中保留的最近同步事件数量
+SYNC_EVENTS_KEEP = 1000
+
+# --- 异步服务 (ASGI) ---
+# 读取歌词文件的线程数
+ASGI_FILE_WORKERS = 16
+# 执行数据库查询的线程数（SQLite查询主要受磁盘限制，线程过多没有意义）
+ASGI_DB_WORKERS = 4
+# 每个线程池最多排队的任务数，超出时直接返回503，避免请求无限堆积
+ASGI_MAX_PENDING = 256
+# 大文件分块发送时每块的大小（字节）
+ASGI_STREAM_CHUNK_SIZE = 64 * 1024
+# 每个进程同时保持的实时日志推送连接数上限。ASGI 方式下每个连接只是事件循环中一个等待的任务，
+# 不占用线程，上限远高于 WSGI 方式的 LOG_STREAM_MAX_CLIENTS
+ASGI_LOG_STREAM_MAX_CLIENTS = 64
+
+# --- 监控指标 ---
+# 各进程定期把本进程的指标写入该目录，/metrics 读取时合并所有进程的数据
+METRICS_DIR = "data/metrics"
+# 写入指标文件的间隔（秒）
+METRICS_FLUSH_INTERVAL = 5
+
+# --- 请求耗时分析 ---
+# 总耗时（毫秒）超过该值的请求，把完整的耗时分解写入慢请求日志
+SLOW_REQUEST_THRESHOLD_MS = 500
+# 慢请求日志文件，每行一个JSON对象
+SLOW_REQUEST_LOG_FILE = "slow_requests.log"
+# 每个请求最多保留的耗时明细条数，超出部分只计入按步骤的汇总
+REQUEST_TIMING_MAX_EVENTS = 200
+
+# --- 原始日志归档 ---
+# 原始访问日志 (ncm_access_log / traffic_log) 在数据库中保留的天数，更早的行移入归档文件；
+# 统计数据来自预聚合表，不受影响。设为 None 时不归档
+RETENTION_DAYS = 90
+# 归档文件目录，每张表每个月一个 gzip 压缩的 JSON Lines 文件
+RETENTION_ARCHIVE_DIR = "data/archive"
+# 后台归档任务的执行间隔（秒）
+RETENTION_INTERVAL = 6 * 60 * 60
+# 每批读取、删除的行数，以及批次之间的停顿（毫秒），避免长时间占用写锁
+RETENTION_BATCH_SIZE = 5000
+RETENTION_BATCH_PAUSE_MS = 50
+# 每批增量 VACUUM 释放的页数
+RETENTION_VACUUM_PAGES = 1000
+# 已有的数据库不是增量 auto_vacuum 时，是否在首次清理后执行一次完整的 VACUUM 进行转换
+RETENTION_CONVERT_AUTO_VACUUM = True
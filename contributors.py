@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+# 贡献者数据后台刷新
+# 仓库同步后和定时任务中刷新贡献者信息：metadata/contributors.jsonl 的修改时间
+# 未变化时不重新解析；过期的用户用带 If-None-Match 的条件请求并发向GitHub确认，
+# 未变化的用户返回304，不消耗API配额。刷新结果写成现成的JSON响应，
+# /api/contributors 只需从内存返回。
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from config import (REPO_DIR, GITHUB_API_BASE, CONTRIBUTORS_REFRESH_INTERVAL, CONTRIBUTORS_STALE_AFTER,
+                    CONTRIBUTORS_MAX_WORKERS, CONTRIBUTORS_SNAPSHOT_FILE, AVATAR_DIR)
+from database import get_contributors_info, update_contributors_info, touch_contributors
+from metrics import record_outbound, host_label
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+CONTRIBUTORS_FILE = os.path.join(REPO_DIR, 'metadata', 'contributors.jsonl')
+PLACEHOLDER_AVATAR = 'https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png'
+GITHUB_API_HOST = host_label(GITHUB_API_BASE)
+
+# 全局变量
+# 上次解析的 contributors.jsonl 修改时间及结果 {github_id: 贡献数}
+_jsonl_mtime = None
+_contributor_counts = {}
+# 预先序列化好的接口响应，以及最后一次读取的快照文件的修改时间
+_snapshot = None
+_snapshot_file_mtime = None
+# GitHub 配额耗尽时，在该时间（时间戳）之前不再发出请求
+_rate_limited_until = 0.0
+_refresh_lock = threading.Lock()
+_refresh_event = threading.Event()
+
+def _read_contributor_counts():
+    """解析 contributors.jsonl，文件修改时间未变化时直接复用上次的结果"""
+    global _jsonl_mtime, _contributor_counts
+    try:
+        mtime = os.stat(CONTRIBUTORS_FILE).st_mtime_ns
+    except OSError:
+        logger.error(f"贡献者文件未找到: {CONTRIBUTORS_FILE}")
+        return None, False
+    if mtime == _jsonl_mtime:
+        return _contributor_counts, False
+
+    counts = {}
+    with open(CONTRIBUTORS_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+                github_id = str(data.get('githubId'))
+                if github_id:
+                    counts[github_id] = data.get('count', 0)
+            except json.JSONDecodeError:
+                logger.warning(f"无法解析行: {line.strip()}")
+    _jsonl_mtime, _contributor_counts = mtime, counts
+    return counts, True
+
+def _note_rate_limit(response):
+    """根据响应头记录配额状态，配额耗尽时返回True"""
+    global _rate_limited_until
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    reset = response.headers.get('X-RateLimit-Reset')
+    exhausted = response.status_code in (403, 429) or remaining == '0'
+    if exhausted:
+        try:
+            _rate_limited_until = max(_rate_limited_until, float(reset))
+        except (TypeError, ValueError):
+            _rate_limited_until = max(_rate_limited_until, time.time() + 60 * 60)
+    return exhausted
+
+def _is_rate_limited():
+    return time.time() < _rate_limited_until
+
+def _fetch_contributor(github_id, cached):
+    """
+    用条件请求刷新一位贡献者的信息和头像。
+    返回 ('updated', 信息) / ('unchanged', None) / ('failed', None) / ('rate_limited', None)。
+    """
+    if _is_rate_limited():
+        return 'rate_limited', None
+    headers = {'Accept': 'application/vnd.github+json'}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    start = time.perf_counter()
+    try:
+        response = requests.get(f"{GITHUB_API_BASE}/user/{github_id}", headers=headers, timeout=5)
+    except requests.RequestException as e:
+        logger.error(f"无法从GitHub API获取ID {github_id} 的信息: {e}")
+        record_outbound('github_api', GITHUB_API_HOST, 0, ok=False)
+        return 'failed', None
+    # 304 和限速也是正常的响应，只有其他错误状态码计为失败
+    record_outbound('github_api', GITHUB_API_HOST, time.perf_counter() - start,
+                    ok=response.ok or response.status_code in (304, 403, 429))
+    if response.status_code == 304:
+        return 'unchanged', None
+    if response.status_code in (403, 429):
+        _note_rate_limit(response)
+        logger.warning("GitHub API速率限制已触发。")
+        return 'rate_limited', None
+    _note_rate_limit(response)
+    if not response.ok:
+        logger.error(f"无法从GitHub API获取ID {github_id} 的信息: HTTP {response.status_code}")
+        return 'failed', None
+
+    user_data = response.json()
+    info = {
+        'login': user_data.get('login'),
+        'name': user_data.get('name'),
+        'avatar_url': user_data.get('avatar_url'),  # 数据库中仍然存储原始URL
+        'etag': response.headers.get('ETag'),
+        'avatar_etag': None,
+    }
+    if info['avatar_url']:
+        # 头像地址未变化时带上头像的ETag，未变化的头像不重新下载
+        avatar_etag = cached.get('avatar_etag') if cached and cached.get('avatar_url') == info['avatar_url'] else None
+        info['avatar_etag'] = _download_avatar(github_id, info['avatar_url'], avatar_etag)
+    return 'updated', info
+
+def _download_avatar(github_id, avatar_url, etag):
+    """下载头像到本地，返回新的ETag；头像未变化时返回原ETag"""
+    avatar_path = os.path.join(AVATAR_DIR, f"{github_id}.png")
+    headers = {}
+    if etag and os.path.exists(avatar_path):
+        headers['If-None-Match'] = etag
+    start = time.perf_counter()
+    try:
+        response = requests.get(avatar_url, headers=headers, timeout=10)
+        if response.status_code == 304:
+            record_outbound('github_avatar', host_label(avatar_url), time.perf_counter() - start)
+            return etag
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"下载ID {github_id} 的头像失败: {e}")
+        record_outbound('github_avatar', host_label(avatar_url), 0, ok=False)
+        return None
+    record_outbound('github_avatar', host_label(avatar_url), time.perf_counter() - start)
+    tmp_path = f"{avatar_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(response.content)
+    os.replace(tmp_path, avatar_path)
+    return response.headers.get('ETag')
+
+def _build_snapshot(counts, cached_info, rate_limited):
+    """组合最终数据并序列化为接口响应"""
+    contributors = []
+    for github_id, count in counts.items():
+        info = cached_info.get(github_id)
+        if info:
+            # 检查本地头像是否存在，决定使用本地路径还是远程URL
+            if os.path.exists(os.path.join(AVATAR_DIR, f"{github_id}.png")):
+                avatar = f"/static/avatars/{github_id}.png"
+            else:
+                avatar = info.get('avatar_url')  # 回退到原始URL
+            contributors.append({
+                'login': info.get('login'),
+                'avatar_url': avatar,
+                'name': info.get('name'),
+                'count': count
+            })
+        else:
+            # 如果API限速或失败，则显示占位符
+            contributors.append({
+                'login': f"ID: {github_id}",
+                'avatar_url': PLACEHOLDER_AVATAR,
+                'name': '（加载失败或被限速）',
+                'count': count
+            })
+    # 按贡献数量降序排序
+    contributors.sort(key=lambda x: x['count'], reverse=True)
+    return json.dumps({
+        'contributors': contributors,
+        'rate_limited': rate_limited,
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }, ensure_ascii=False).encode('utf-8')
+
+def _save_snapshot(snapshot):
+    """原子地写入快照文件，进程重启后可立即提供服务"""
+    os.makedirs(os.path.dirname(CONTRIBUTORS_SNAPSHOT_FILE), exist_ok=True)
+    tmp_path = f"{CONTRIBUTORS_SNAPSHOT_FILE}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(snapshot)
+    os.replace(tmp_path, CONTRIBUTORS_SNAPSHOT_FILE)
+
+def refresh_contributors():
+    """刷新过期的贡献者信息并重新生成快照；没有任何变化时跳过"""
+    global _snapshot
+    with _refresh_lock:
+        counts, file_changed = _read_contributor_counts()
+        if counts is None:
+            return
+        github_ids = list(counts)
+        cached_info = get_contributors_info(github_ids)
+
+        stale_before = datetime.now() - timedelta(seconds=CONTRIBUTORS_STALE_AFTER)
+        ids_to_fetch = []
+        for github_id in github_ids:
+            info = cached_info.get(github_id)
+            if not info or datetime.fromisoformat(str(info['last_updated'])) < stale_before:
+                ids_to_fetch.append(github_id)
+        if not ids_to_fetch and not file_changed and _snapshot is not None:
+            return
+
+        rate_limited = False
+        if ids_to_fetch:
+            start = time.perf_counter()
+            os.makedirs(AVATAR_DIR, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=CONTRIBUTORS_MAX_WORKERS, thread_name_prefix='contributors') as executor:
+                results = list(executor.map(lambda gid: (gid, _fetch_contributor(gid, cached_info.get(gid))), ids_to_fetch))
+            updated, unchanged = {}, []
+            for github_id, (outcome, info) in results:
+                if outcome == 'updated':
+                    updated[github_id] = info
+                elif outcome == 'unchanged':
+                    unchanged.append(github_id)
+                elif outcome == 'rate_limited':
+                    rate_limited = True
+            update_contributors_info(updated)
+            touch_contributors(unchanged)
+            cached_info.update(updated)
+            logger.info(
+                f"贡献者刷新完成: 需要确认 {len(ids_to_fetch)} 位, 更新 {len(updated)} 位, "
+                f"未变化 {len(unchanged)} 位, 耗时 {time.perf_counter() - start:.2f} 秒。"
+            )
+
+        _snapshot = _build_snapshot(counts, cached_info, rate_limited)
+        _save_snapshot(_snapshot)
+
+def get_contributors_snapshot():
+    """
+    返回预先生成的接口响应，本进程尚未生成时读取快照文件，都没有时返回None。
+    多进程部署时只有主进程刷新，其他进程在快照文件更新后重新读取。
+    """
+    global _snapshot, _snapshot_file_mtime
+    try:
+        mtime = os.stat(CONTRIBUTORS_SNAPSHOT_FILE).st_mtime_ns
+    except OSError:
+        return _snapshot
+    if mtime != _snapshot_file_mtime:
+        try:
+            with open(CONTRIBUTORS_SNAPSHOT_FILE, 'rb') as f:
+                _snapshot = f.read()
+            _snapshot_file_mtime = mtime
+        except OSError as e:
+            logger.warning(f"读取贡献者快照失败: {e}")
+    return _snapshot
+
+def request_contributors_refresh():
+    """唤醒后台刷新线程"""
+    _refresh_event.set()
+
+def on_repo_synced(change_set):
+    """同步监听者：contributors.jsonl 有变化时立即刷新"""
+    if change_set['full'] or 'metadata/contributors.jsonl' in change_set['added'] + change_set['modified']:
+        request_contributors_refresh()
+
+def background_contributors_refresher():
+    """后台任务：启动时、仓库同步后以及定时刷新贡献者数据"""
+    logger.info("启动后台贡献者刷新器...")
+    while True:
+        try:
+            refresh_contributors()
+        except Exception as e:
+            logger.error(f"刷新贡献者数据失败: {e}")
+        _refresh_event.wait(CONTRIBUTORS_REFRESH_INTERVAL)
+        _refresh_event.clear()
@@ -3,150 +3,672 @@
 import sqlite3
 import logging
 import os
-from datetime import datetime
-from config import DB_FILES, DB_PATH
+import json
+import time
+import ipaddress
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config import DB_PATH, SYNC_EVENTS_KEEP, TRAFFIC_INTERN_CACHE_SIZE
+from db_pool import get_connection
 
 # 获取logger实例
 logger = logging.getLogger(__name__)
 
+# --- 数据库结构迁移 ---
+# 每个数据库的结构版本保存在 PRAGMA user_version 中。
+# MIGRATIONS 中第N个迁移函数执行完成后，版本号变为N；已执行过的迁移不会重复执行。
+# 新的结构变更只能追加到列表末尾，不要修改已发布的迁移。
+
+def _ncm_base_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_access_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_id TEXT NOT NULL,
+            accessed_at TIMESTAMP NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_song_info (
+            song_id TEXT PRIMARY KEY,
+            song_name TEXT,
+            artists TEXT,
+            album TEXT,
+            last_updated TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_no_lyrics (
+            song_id TEXT PRIMARY KEY,
+            first_seen TIMESTAMP,
+            attempt_count INTEGER DEFAULT 0
+        )
+    ''')
+
+def _ncm_rollup_tables(c):
+    """预聚合(rollup)表，由批量写入路径增量维护"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_song_daily (
+            day TEXT NOT NULL,
+            song_id TEXT NOT NULL,
+            access_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, song_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_hourly (
+            hour TEXT PRIMARY KEY,
+            access_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_song_totals (
+            song_id TEXT PRIMARY KEY,
+            access_count INTEGER NOT NULL DEFAULT 0,
+            last_accessed TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ncm_song_totals_rank
+        ON ncm_song_totals (access_count DESC, last_accessed DESC)
+    ''')
+    _backfill_ncm_rollups(c)
+
+def _ncm_time_indexes(c):
+    """原始日志的覆盖索引，配合 >= ? AND < ? 区间条件使用"""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ncm_access_log_time_song ON ncm_access_log (accessed_at, song_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ncm_access_log_song_time ON ncm_access_log (song_id, accessed_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ncm_no_lyrics_first_seen ON ncm_no_lyrics (first_seen)")
+
+def _traffic_base_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            ip_address TEXT,
+            user_agent TEXT,
+            response_size_bytes INTEGER,
+            timestamp TIMESTAMP NOT NULL
+        )
+    ''')
+
+def _traffic_rollup_tables(c):
+    """预聚合(rollup)表，由批量写入路径增量维护"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_path_daily (
+            day TEXT NOT NULL,
+            path TEXT NOT NULL,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            response_bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, path)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_path_totals (
+            path TEXT PRIMARY KEY,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            response_bytes INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # 每天的独立IP集合，用于统计任意日期范围内的独立访客数
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_ip_daily (
+            day TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            PRIMARY KEY (day, ip_address)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_hourly (
+            hour TEXT PRIMARY KEY,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            response_bytes INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _backfill_traffic_rollups(c)
+
+def _traffic_time_indexes(c):
+    """原始日志的覆盖索引，配合 >= ? AND < ? 区间条件使用"""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traffic_log_time_path ON traffic_log (timestamp, path)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traffic_log_time_ip ON traffic_log (timestamp, ip_address)")
+
+def _system_base_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS not_found (
+            path TEXT PRIMARY KEY,
+            count INTEGER DEFAULT 0,
+            last_seen TIMESTAMP
+        )
+    ''')
+
+def _contributors_base_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contributors (
+            github_id TEXT PRIMARY KEY,
+            login TEXT,
+            name TEXT,
+            avatar_url TEXT,
+            last_updated TIMESTAMP
+        )
+    ''')
+
+def _create_counter(c, name, table):
+    """
+    创建由触发器维护的计数器：表中插入或删除一行时计数器随之加减，
+    读取统计数字时不再需要 COUNT(*) 扫描整张表。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute(f"INSERT OR REPLACE INTO counters (name, value) VALUES (?, (SELECT COUNT(*) FROM {table}))", (name,))
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+        BEGIN UPDATE counters SET value = value + 1 WHERE name = '{name}'; END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+        BEGIN UPDATE counters SET value = value - 1 WHERE name = '{name}'; END
+    ''')
+
+def _ncm_counters(c):
+    _create_counter(c, 'ncm_songs', 'ncm_song_totals')
+    _create_counter(c, 'ncm_no_lyrics', 'ncm_no_lyrics')
+
+def _system_counters(c):
+    _create_counter(c, 'not_found', 'not_found')
+
+def _system_shared_state(c):
+    """多进程部署时在各工作进程之间共享的状态和同步事件"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS shared_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at REAL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sync_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL,
+            payload TEXT
+        )
+    ''')
+
+def _contributors_etag_columns(c):
+    """保存GitHub响应的ETag，刷新时用条件请求，未变化的用户不消耗配额"""
+    c.execute("ALTER TABLE contributors ADD COLUMN etag TEXT")
+    c.execute("ALTER TABLE contributors ADD COLUMN avatar_etag TEXT")
+
+def _replace_table(c, table, create_sql, select_sql):
+    """按 create_sql 新建表结构，写入 select_sql 的结果后替换原表（原表的索引随之删除）"""
+    c.execute(create_sql.format(table=f"{table}_new"))
+    c.execute(f"INSERT INTO {table}_new {select_sql}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def _traffic_lookup_tables(c):
+    """
+    路径、IP、User-Agent 改为保存在查找表中，traffic_log 和预聚合表只保存整数ID（见 _intern_traffic_values）。
+    预聚合表由已有的内容转换，不从原始日志重建：较早的原始日志可能已经归档。
+    """
+    c.connection.create_function('pack_ip', 1, pack_ip, deterministic=True)
+    c.execute("CREATE TABLE IF NOT EXISTS traffic_paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)")
+    # 能解析的IP保存为二进制（IPv4 4字节，IPv6 16字节），其余取值原样保存为文本
+    c.execute("CREATE TABLE IF NOT EXISTS traffic_ips (id INTEGER PRIMARY KEY, ip BLOB NOT NULL UNIQUE)")
+    c.execute("CREATE TABLE IF NOT EXISTS traffic_user_agents (id INTEGER PRIMARY KEY, user_agent TEXT NOT NULL UNIQUE)")
+    c.execute('''
+        INSERT OR IGNORE INTO traffic_paths (path)
+        SELECT path FROM traffic_path_totals UNION SELECT path FROM traffic_path_daily UNION SELECT path FROM traffic_log
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO traffic_ips (ip)
+        SELECT pack_ip(ip_address) FROM (
+            SELECT ip_address FROM traffic_ip_daily
+            UNION SELECT ip_address FROM traffic_log WHERE ip_address IS NOT NULL
+        )
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO traffic_user_agents (user_agent)
+        SELECT DISTINCT user_agent FROM traffic_log WHERE user_agent IS NOT NULL
+    ''')
+
+    # 保留原有的 id 和自增序列：归档文件按 id 去重，已归档的 id 不能再次使用
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'traffic_log'")
+    row = c.fetchone()
+    _replace_table(c, 'traffic_log', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path_id INTEGER NOT NULL,
+            ip_id INTEGER,
+            user_agent_id INTEGER,
+            response_size_bytes INTEGER,
+            timestamp TIMESTAMP NOT NULL
+        )
+    ''', '''
+        SELECT log.id, p.id, i.id, u.id, log.response_size_bytes, log.timestamp
+        FROM traffic_log AS log
+        JOIN traffic_paths AS p ON p.path = log.path
+        LEFT JOIN traffic_ips AS i ON i.ip = pack_ip(log.ip_address)
+        LEFT JOIN traffic_user_agents AS u ON u.user_agent = log.user_agent
+        ORDER BY log.id
+    ''')
+    if row is not None:
+        c.execute("DELETE FROM sqlite_sequence WHERE name = 'traffic_log'")
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('traffic_log', ?)", (row[0],))
+    # 统计查询全部使用预聚合表，原始日志只按时间区间读取和清理（见 retention.py）
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traffic_log_time ON traffic_log (timestamp)")
+
+    _replace_table(c, 'traffic_path_daily', '''
+        CREATE TABLE {table} (
+            day TEXT NOT NULL,
+            path_id INTEGER NOT NULL,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            response_bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, path_id)
+        ) WITHOUT ROWID
+    ''', '''
+        SELECT d.day, p.id, d.request_count, d.response_bytes
+        FROM traffic_path_daily AS d JOIN traffic_paths AS p ON p.path = d.path
+    ''')
+    _replace_table(c, 'traffic_path_totals', '''
+        CREATE TABLE {table} (
+            path_id INTEGER PRIMARY KEY,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            response_bytes INTEGER NOT NULL DEFAULT 0
+        )
+    ''', '''
+        SELECT p.id, t.request_count, t.response_bytes
+        FROM traffic_path_totals AS t JOIN traffic_paths AS p ON p.path = t.path
+    ''')
+    _replace_table(c, 'traffic_ip_daily', '''
+        CREATE TABLE {table} (
+            day TEXT NOT NULL,
+            ip_id INTEGER NOT NULL,
+            PRIMARY KEY (day, ip_id)
+        ) WITHOUT ROWID
+    ''', '''
+        SELECT DISTINCT d.day, i.id
+        FROM traffic_ip_daily AS d JOIN traffic_ips AS i ON i.ip = pack_ip(d.ip_address)
+    ''')
+
+MIGRATIONS = {
+    "ncm": [_ncm_base_tables, _ncm_rollup_tables, _ncm_time_indexes, _ncm_counters],
+    "traffic": [_traffic_base_tables, _traffic_rollup_tables, _traffic_time_indexes, _traffic_lookup_tables],
+    "system": [_system_base_tables, _system_counters, _system_shared_state],
+    "contributors": [_contributors_base_tables, _contributors_etag_columns],
+}
+
+def migrate_db(db_key):
+    """把指定数据库升级到最新的结构版本，每个迁移在独立的事务中执行"""
+    migrations = MIGRATIONS[db_key]
+    with get_connection(db_key) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(migrations):
+            logger.warning(f"数据库 {db_key} 的结构版本 ({version}) 高于当前程序支持的版本 ({len(migrations)})。")
+            return
+        for target_version, migration in enumerate(migrations[version:], start=version + 1):
+            logger.info(f"数据库 {db_key}: 执行迁移 {target_version} ({migration.__name__})...")
+            # 显式开启事务，使DDL语句与版本号更新一起原子地提交
+            conn.execute("BEGIN")
+            try:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {target_version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"数据库 {db_key}: 迁移 {target_version} 失败，已回滚。")
+                raise
+
 def init_db():
-    """初始化所有数据库和表"""
+    """初始化所有数据库，并执行尚未执行的结构迁移"""
     # 确保数据库目录存在
     os.makedirs(DB_PATH, exist_ok=True)
 
-    # 初始化 ncm.db
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ncm_access_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                song_id TEXT NOT NULL,
-                accessed_at TIMESTAMP NOT NULL
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ncm_song_info (
-                song_id TEXT PRIMARY KEY,
-                song_name TEXT,
-                artists TEXT,
-                album TEXT,
-                last_updated TIMESTAMP
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ncm_no_lyrics (
-                song_id TEXT PRIMARY KEY,
-                first_seen TIMESTAMP,
-                attempt_count INTEGER DEFAULT 0
-            )
-        ''')
-        conn.commit()
+    for db_key in MIGRATIONS:
+        migrate_db(db_key)
 
-    # 初始化 traffic.db
-    with sqlite3.connect(DB_FILES["traffic"]) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS traffic_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                path TEXT NOT NULL,
-                ip_address TEXT,
-                user_agent TEXT,
-                response_size_bytes INTEGER,
-                timestamp TIMESTAMP NOT NULL
-            )
-        ''')
-        conn.commit()
+    logger.info("所有数据库初始化完成。")
 
-    # 初始化 system.db
-    with sqlite3.connect(DB_FILES["system"]) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS not_found (
-                path TEXT PRIMARY KEY,
-                count INTEGER DEFAULT 0,
-                last_seen TIMESTAMP
-            )
-        ''')
-        conn.commit()
+def _backfill_ncm_rollups(c):
+    """rollup表为空而原始日志不为空时（旧版本升级），从原始日志一次性重建"""
+    c.execute("SELECT 1 FROM ncm_song_totals LIMIT 1")
+    if c.fetchone():
+        return
+    c.execute("SELECT 1 FROM ncm_access_log LIMIT 1")
+    if not c.fetchone():
+        return
+    logger.info("正在从 ncm_access_log 重建NCM预聚合表...")
+    # 时间戳以 'YYYY-MM-DD HH:MM:SS.ffffff' 格式存储，前10/13个字符即为日期/小时
+    c.execute('''
+        INSERT OR REPLACE INTO ncm_song_daily (day, song_id, access_count)
+        SELECT substr(accessed_at, 1, 10), song_id, COUNT(*)
+        FROM ncm_access_log GROUP BY 1, 2
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO ncm_hourly (hour, access_count)
+        SELECT substr(accessed_at, 1, 13), COUNT(*)
+        FROM ncm_access_log GROUP BY 1
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO ncm_song_totals (song_id, access_count, last_accessed)
+        SELECT song_id, COUNT(*), MAX(accessed_at)
+        FROM ncm_access_log GROUP BY song_id
+    ''')
+    logger.info("NCM预聚合表重建完成。")
 
-    # 初始化 contributors.db
-    with sqlite3.connect(DB_FILES["contributors"]) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS contributors (
-                github_id TEXT PRIMARY KEY,
-                login TEXT,
-                name TEXT,
-                avatar_url TEXT,
-                last_updated TIMESTAMP
-            )
-        ''')
-        conn.commit()
+def _backfill_traffic_rollups(c):
+    """rollup表为空而原始日志不为空时（旧版本升级），从原始日志一次性重建"""
+    c.execute("SELECT 1 FROM traffic_hourly LIMIT 1")
+    if c.fetchone():
+        return
+    c.execute("SELECT 1 FROM traffic_log LIMIT 1")
+    if not c.fetchone():
+        return
+    logger.info("正在从 traffic_log 重建流量预聚合表...")
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_path_daily (day, path, request_count, response_bytes)
+        SELECT substr(timestamp, 1, 10), path, COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY 1, 2
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_path_totals (path, request_count, response_bytes)
+        SELECT path, COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY path
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO traffic_ip_daily (day, ip_address)
+        SELECT DISTINCT substr(timestamp, 1, 10), ip_address
+        FROM traffic_log WHERE ip_address IS NOT NULL
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_hourly (hour, request_count, response_bytes)
+        SELECT substr(timestamp, 1, 13), COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY 1
+    ''')
+    logger.info("流量预聚合表重建完成。")
 
-    logger.info("所有数据库初始化完成。")
+def _backfill_traffic_id_rollups(c):
+    """与 _backfill_traffic_rollups 相同，用于改用查找表之后的结构（基准测试直接写入原始日志后调用）"""
+    c.execute("SELECT 1 FROM traffic_hourly LIMIT 1")
+    if c.fetchone():
+        return
+    logger.info("正在从 traffic_log 重建流量预聚合表...")
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_path_daily (day, path_id, request_count, response_bytes)
+        SELECT substr(timestamp, 1, 10), path_id, COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY 1, 2
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_path_totals (path_id, request_count, response_bytes)
+        SELECT path_id, COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY path_id
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO traffic_ip_daily (day, ip_id)
+        SELECT DISTINCT substr(timestamp, 1, 10), ip_id
+        FROM traffic_log WHERE ip_id IS NOT NULL
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO traffic_hourly (hour, request_count, response_bytes)
+        SELECT substr(timestamp, 1, 13), COUNT(*), IFNULL(SUM(response_size_bytes), 0)
+        FROM traffic_log GROUP BY 1
+    ''')
+    logger.info("流量预聚合表重建完成。")
+
+def _day_key(ts):
+    """rollup表使用的日期键，与数据库中时间戳字符串的前10个字符一致"""
+    return ts.strftime('%Y-%m-%d')
+
+def _hour_key(ts):
+    """rollup表使用的小时键，与数据库中时间戳字符串的前13个字符一致"""
+    return ts.strftime('%Y-%m-%d %H')
+
+def _period_day_range(period):
+    """
+    把统计周期转换为 [start, end) 日期键区间，total 返回 None。
+    日期键 'YYYY-MM-DD' 与时间戳字符串按字典序比较，因此可以直接用于
+    `col >= ? AND col < ?` 形式的区间条件，从而使用索引。
+    """
+    today = datetime.now().date()
+    if period == 'today':
+        start, end = today, today + timedelta(days=1)
+    elif period == 'monthly':
+        start = today.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif period == 'yearly':
+        start = today.replace(month=1, day=1)
+        end = start.replace(year=start.year + 1)
+    else: # total
+        return None
+    return start.isoformat(), end.isoformat()
+
+# --- 流量日志查找表 ---
+# traffic_log 和流量预聚合表中的路径、IP、User-Agent 只保存查找表中的整数ID。
+# 取值到ID的映射缓存在进程内（按类型各保留最近使用的 TRAFFIC_INTERN_CACHE_SIZE 项），
+# 写入时只有缓存中没有的取值需要访问查找表。查找表中的行不会删除，ID一经分配就不再变化。
+
+# 查找表 {类型: (表名, 列名)}
+TRAFFIC_LOOKUPS = {
+    'path': ('traffic_paths', 'path'),
+    'ip': ('traffic_ips', 'ip'),
+    'user_agent': ('traffic_user_agents', 'user_agent'),
+}
+
+# 全局变量
+# 每种类型的缓存 {原始取值: ID}，按最近使用的顺序排列
+_intern_caches = {kind: OrderedDict() for kind in TRAFFIC_LOOKUPS}
+_intern_lock = threading.Lock()
+
+def pack_ip(ip_address):
+    """IP地址转换为二进制形式；无法解析的取值（如伪造的 X-Forwarded-For）原样返回"""
+    if ip_address is None:
+        return None
+    try:
+        return ipaddress.ip_address(ip_address).packed
+    except ValueError:
+        return ip_address
+
+def unpack_ip(value):
+    """pack_ip 的逆操作"""
+    if isinstance(value, bytes):
+        return str(ipaddress.ip_address(value))
+    return value
+
+def _intern_traffic_values(c, kind, values):
+    """
+    返回 ({取值: ID}, {新查到的取值: ID})，None 不计入。缓存中没有的取值先写入查找表（已存在时忽略），
+    再一次查出ID。新查到的ID要等事务提交后再用 _cache_traffic_ids 放入缓存：事务回滚时新分配的ID随之作废。
+    """
+    table, column = TRAFFIC_LOOKUPS[kind]
+    cache = _intern_caches[kind]
+    ids = {}
+    missing = []
+    with _intern_lock:
+        for value in dict.fromkeys(values):
+            if value is None:
+                continue
+            value_id = cache.get(value)
+            if value_id is None:
+                missing.append(value)
+            else:
+                cache.move_to_end(value)
+                ids[value] = value_id
+    if not missing:
+        return ids, {}
+
+    stored = {value: pack_ip(value) for value in missing} if kind == 'ip' else {value: value for value in missing}
+    c.executemany(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", [(v,) for v in stored.values()])
+    found = {}
+    db_values = list(dict.fromkeys(stored.values()))
+    # 分块查询，不超过SQLite的参数个数限制
+    for i in range(0, len(db_values), 500):
+        chunk = db_values[i:i + 500]
+        c.execute(f"SELECT id, {column} FROM {table} WHERE {column} IN ({', '.join('?' for _ in chunk)})", chunk)
+        found.update((row[1], row[0]) for row in c.fetchall())
+    new_ids = {value: found[db_value] for value, db_value in stored.items()}
+    ids.update(new_ids)
+    return ids, new_ids
+
+def _cache_traffic_ids(new_ids_by_kind):
+    """把已提交的新ID放入缓存，超出容量时淘汰最久未使用的项"""
+    with _intern_lock:
+        for kind, new_ids in new_ids_by_kind.items():
+            cache = _intern_caches[kind]
+            cache.update(new_ids)
+            while len(cache) > TRAFFIC_INTERN_CACHE_SIZE:
+                cache.popitem(last=False)
 
 def record_traffic(path, ip_address, user_agent, response_size_bytes):
     """记录每一次的HTTP请求"""
-    with sqlite3.connect(DB_FILES["traffic"]) as conn:
+    record_traffic_batch([(path, ip_address, user_agent, response_size_bytes, datetime.now())])
+
+def record_traffic_batch(rows):
+    """在一个事务中批量写入流量记录，rows为(path, ip, ua, size, timestamp)元组列表"""
+    if not rows:
+        return
+    with get_connection("traffic") as conn:
         c = conn.cursor()
-        now = datetime.now()
-        c.execute(
-            "INSERT INTO traffic_log (path, ip_address, user_agent, response_size_bytes, timestamp) VALUES (?, ?, ?, ?, ?)",
-            (path, ip_address, user_agent, response_size_bytes, now)
+        path_ids, new_paths = _intern_traffic_values(c, 'path', (row[0] for row in rows))
+        ip_ids, new_ips = _intern_traffic_values(c, 'ip', (row[1] for row in rows))
+        ua_ids, new_uas = _intern_traffic_values(c, 'user_agent', (row[2] for row in rows))
+        c.executemany(
+            "INSERT INTO traffic_log (path_id, ip_id, user_agent_id, response_size_bytes, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [(path_ids[path], ip_ids.get(ip_address), ua_ids.get(user_agent), size, ts)
+             for path, ip_address, user_agent, size, ts in rows]
+        )
+
+        # 在同一事务中增量更新rollup表
+        path_daily = {}
+        path_totals = {}
+        hourly = {}
+        ip_daily = set()
+        for path, ip_address, _, size, ts in rows:
+            size = size or 0
+            path_id = path_ids[path]
+            for counters, key in ((path_daily, (_day_key(ts), path_id)),
+                                  (path_totals, path_id),
+                                  (hourly, _hour_key(ts))):
+                count, total_bytes = counters.get(key, (0, 0))
+                counters[key] = (count + 1, total_bytes + size)
+            if ip_address:
+                ip_daily.add((_day_key(ts), ip_ids[ip_address]))
+
+        c.executemany('''
+            INSERT INTO traffic_path_daily (day, path_id, request_count, response_bytes) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, path_id) DO UPDATE SET
+                request_count = request_count + excluded.request_count,
+                response_bytes = response_bytes + excluded.response_bytes
+        ''', [(day, path_id, count, size) for (day, path_id), (count, size) in path_daily.items()])
+        c.executemany('''
+            INSERT INTO traffic_path_totals (path_id, request_count, response_bytes) VALUES (?, ?, ?)
+            ON CONFLICT(path_id) DO UPDATE SET
+                request_count = request_count + excluded.request_count,
+                response_bytes = response_bytes + excluded.response_bytes
+        ''', [(path_id, count, size) for path_id, (count, size) in path_totals.items()])
+        c.executemany('''
+            INSERT INTO traffic_hourly (hour, request_count, response_bytes) VALUES (?, ?, ?)
+            ON CONFLICT(hour) DO UPDATE SET
+                request_count = request_count + excluded.request_count,
+                response_bytes = response_bytes + excluded.response_bytes
+        ''', [(hour, count, size) for hour, (count, size) in hourly.items()])
+        c.executemany(
+            "INSERT OR IGNORE INTO traffic_ip_daily (day, ip_id) VALUES (?, ?)",
+            list(ip_daily)
         )
         conn.commit()
+    _cache_traffic_ids({'path': new_paths, 'ip': new_ips, 'user_agent': new_uas})
 
 def record_ncm_access(song_id):
     """记录每一次NCM歌曲的访问"""
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
+    now = datetime.now()
+    record_ncm_access_batch([(song_id, now)])
+    logger.info(f"记录NCM访问: song_id={song_id} at {now}")
+
+def record_ncm_access_batch(rows):
+    """在一个事务中批量写入NCM访问记录，rows为(song_id, accessed_at)元组列表"""
+    if not rows:
+        return
+    with get_connection("ncm") as conn:
         c = conn.cursor()
-        now = datetime.now()
-        c.execute(
+        c.executemany(
             "INSERT INTO ncm_access_log (song_id, accessed_at) VALUES (?, ?)",
-            (song_id, now)
+            rows
         )
+
+        # 在同一事务中增量更新rollup表
+        song_daily = {}
+        song_totals = {}
+        hourly = {}
+        for song_id, ts in rows:
+            key = (_day_key(ts), song_id)
+            song_daily[key] = song_daily.get(key, 0) + 1
+            count, last_accessed = song_totals.get(song_id, (0, ts))
+            song_totals[song_id] = (count + 1, max(last_accessed, ts))
+            hour = _hour_key(ts)
+            hourly[hour] = hourly.get(hour, 0) + 1
+
+        c.executemany('''
+            INSERT INTO ncm_song_daily (day, song_id, access_count) VALUES (?, ?, ?)
+            ON CONFLICT(day, song_id) DO UPDATE SET
+                access_count = access_count + excluded.access_count
+        ''', [(day, song_id, count) for (day, song_id), count in song_daily.items()])
+        c.executemany('''
+            INSERT INTO ncm_song_totals (song_id, access_count, last_accessed) VALUES (?, ?, ?)
+            ON CONFLICT(song_id) DO UPDATE SET
+                access_count = access_count + excluded.access_count,
+                last_accessed = MAX(IFNULL(last_accessed, ''), excluded.last_accessed)
+        ''', [(song_id, count, last_accessed) for song_id, (count, last_accessed) in song_totals.items()])
+        c.executemany('''
+            INSERT INTO ncm_hourly (hour, access_count) VALUES (?, ?)
+            ON CONFLICT(hour) DO UPDATE SET
+                access_count = access_count + excluded.access_count
+        ''', list(hourly.items()))
         conn.commit()
-        logger.info(f"记录NCM访问: song_id={song_id} at {now}")
 
-def record_not_found(path):
-    """记录404路径"""
-    with sqlite3.connect(DB_FILES["system"]) as conn:
+def record_not_found_batch(rows):
+    """批量记录404路径，rows 为 (路径, 时间) 列表，同一路径先在内存中合并计数"""
+    merged = {}
+    for path, ts in rows:
+        count, last_seen = merged.get(path, (0, ts))
+        merged[path] = (count + 1, max(last_seen, ts))
+    with get_connection("system") as conn:
         c = conn.cursor()
-        now = datetime.now()
-        c.execute('''
-            INSERT INTO not_found (path, count, last_seen) VALUES (?, 1, ?)
+        c.executemany('''
+            INSERT INTO not_found (path, count, last_seen) VALUES (?, ?, ?)
             ON CONFLICT(path) DO UPDATE SET
-            count = count + 1, last_seen = ?
-        ''', (path, now, now))
+            count = count + excluded.count, last_seen = excluded.last_seen
+        ''', [(path, count, last_seen) for path, (count, last_seen) in merged.items()])
         conn.commit()
+    for path in merged:
         logger.warning(f"记录404路径: {path}")
 
+def get_counters(db_key):
+    """读取指定数据库中由触发器维护的全部计数器"""
+    with get_connection(db_key) as conn:
+        c = conn.cursor()
+        c.execute("SELECT name, value FROM counters")
+        return {row['name']: row['value'] for row in c.fetchall()}
+
 def get_db_stats():
     """获取数据库的统计信息"""
-    ncm_count = 0
-    not_found_count = 0
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(DISTINCT song_id) FROM ncm_access_log")
-        ncm_count = c.fetchone()[0]
-    with sqlite3.connect(DB_FILES["system"]) as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM not_found")
-        not_found_count = c.fetchone()[0]
+    ncm_count = get_counters("ncm").get('ncm_songs', 0)
+    not_found_count = get_counters("system").get('not_found', 0)
     return ncm_count, not_found_count
 
+def get_ncm_no_lyrics_count():
+    """获取NCM无歌词记录的数量"""
+    return get_counters("ncm").get('ncm_no_lyrics', 0)
+
 def get_ncm_stats():
-    """计算并获取NCM访问统计数据"""
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        conn.row_factory = sqlite3.Row
+    """从预聚合表获取NCM访问统计数据"""
+    with get_connection("ncm") as conn:
         c = conn.cursor()
         c.execute('''
-            SELECT
-                song_id,
-                COUNT(song_id) AS access_count,
-                MAX(accessed_at) AS last_accessed
-            FROM ncm_access_log
-            GROUP BY song_id
+            SELECT song_id, access_count, last_accessed
+            FROM ncm_song_totals
             ORDER BY access_count DESC, last_accessed DESC
             LIMIT 1000
         ''')
@@ -157,8 +679,7 @@ def get_song_info(song_ids):
     """根据song_id列表从数据库获取已知的歌曲详情"""
     if not song_ids:
         return {}
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection("ncm") as conn:
         c = conn.cursor()
         placeholders = ','.join('?' for _ in song_ids)
         query = f"SELECT song_id, song_name, artists, album FROM ncm_song_info WHERE song_id IN ({placeholders})"
@@ -170,7 +691,7 @@ def update_song_info(song_details_map):
     if not song_details_map:
         logger.warning("没有提供歌曲详情进行更新。",song_details_map)
         return
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
+    with get_connection("ncm") as conn:
         c = conn.cursor()
         now = datetime.now()
         data_to_insert = [
@@ -194,28 +715,26 @@ def update_song_info(song_details_map):
         conn.commit()
         logger.info(f"更新了 {len(data_to_insert)} 首歌曲的信息。")
 
-def add_ncm_no_lyrics_entry(song_id, details):
-    """添加一条NCM无歌词记录，如果已存在则增加尝试次数"""
-    # 首先，无论如何都更新或插入歌曲信息
-    if details:
-        update_song_info({song_id: details})
-
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
+def add_ncm_no_lyrics_entries(attempts):
+    """批量添加NCM无歌词记录，attempts 为 {歌曲ID: 本批次的尝试次数}"""
+    if not attempts:
+        return
+    with get_connection("ncm") as conn:
         c = conn.cursor()
         now = datetime.now()
-        c.execute('''
+        c.executemany('''
             INSERT INTO ncm_no_lyrics (song_id, first_seen, attempt_count)
-            VALUES (?, ?, 1)
+            VALUES (?, ?, ?)
             ON CONFLICT(song_id) DO UPDATE SET
-            attempt_count = attempt_count + 1
-        ''', (song_id, now))
-        logger.info(f"记录一次对无歌词NCM歌曲的访问尝试: {song_id}")
+            attempt_count = attempt_count + excluded.attempt_count
+        ''', [(song_id, now, count) for song_id, count in attempts.items()])
         conn.commit()
+    for song_id, count in attempts.items():
+        logger.info(f"记录 {count} 次对无歌词NCM歌曲的访问尝试: {song_id}")
 
 def get_ncm_no_lyrics_stats():
     """获取所有NCM无歌词的歌曲记录，并从ncm_song_info获取歌曲信息，按尝试次数排序"""
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection("ncm") as conn:
         c = conn.cursor()
         c.execute('''
             SELECT
@@ -233,22 +752,29 @@ def get_ncm_no_lyrics_stats():
 
 def remove_ncm_no_lyrics_entry(song_id):
     """如果歌曲已有歌词，从无歌词记录中移除"""
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
+    remove_ncm_no_lyrics_entries([song_id])
+
+def remove_ncm_no_lyrics_entries(song_ids):
+    """批量从无歌词记录中移除已找到歌词的歌曲"""
+    if not song_ids:
+        return
+    with get_connection("ncm") as conn:
         c = conn.cursor()
-        c.execute("DELETE FROM ncm_no_lyrics WHERE song_id = ?", (song_id,))
-        if c.rowcount > 0:
-            logger.info(f"歌曲 {song_id} 已找到歌词，从'无歌词'列表中移除。")
+        # 同一批次中可能有重复的ID，去重后再删除
+        for song_id in set(song_ids):
+            c.execute("DELETE FROM ncm_no_lyrics WHERE song_id = ?", (song_id,))
+            if c.rowcount > 0:
+                logger.info(f"歌曲 {song_id} 已找到歌词，从'无歌词'列表中移除。")
         conn.commit()
 
 def get_contributors_info(github_ids):
     """根据github_id列表从数据库获取已知的贡献者详情"""
     if not github_ids:
         return {}
-    with sqlite3.connect(DB_FILES["contributors"]) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection("contributors") as conn:
         c = conn.cursor()
         placeholders = ','.join('?' for _ in github_ids)
-        query = f"SELECT github_id, login, name, avatar_url, last_updated FROM contributors WHERE github_id IN ({placeholders})"
+        query = f"SELECT github_id, login, name, avatar_url, last_updated, etag, avatar_etag FROM contributors WHERE github_id IN ({placeholders})"
         c.execute(query, github_ids)
         return {str(row['github_id']): dict(row) for row in c.fetchall()}
 
@@ -256,7 +782,7 @@ def update_contributors_info(contributors_map):
     """批量更新或插入贡献者详情到数据库"""
     if not contributors_map:
         return
-    with sqlite3.connect(DB_FILES["contributors"]) as conn:
+    with get_connection("contributors") as conn:
         c = conn.cursor()
         now = datetime.now()
         data_to_insert = [
@@ -265,66 +791,84 @@ def update_contributors_info(contributors_map):
                 details.get('login'),
                 details.get('name'),
                 details.get('avatar_url'),
-                now
+                now,
+                details.get('etag'),
+                details.get('avatar_etag')
             ) for github_id, details in contributors_map.items()
         ]
         c.executemany('''
-            INSERT INTO contributors (github_id, login, name, avatar_url, last_updated)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO contributors (github_id, login, name, avatar_url, last_updated, etag, avatar_etag)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(github_id) DO UPDATE SET
                 login = excluded.login,
                 name = excluded.name,
                 avatar_url = excluded.avatar_url,
-                last_updated = excluded.last_updated
+                last_updated = excluded.last_updated,
+                etag = excluded.etag,
+                avatar_etag = excluded.avatar_etag
         ''', data_to_insert)
         conn.commit()
         logger.info(f"更新了 {len(data_to_insert)} 位贡献者的信息。")
 
+def touch_contributors(github_ids):
+    """GitHub确认信息未变化（304）时，只刷新这些贡献者的更新时间"""
+    if not github_ids:
+        return
+    with get_connection("contributors") as conn:
+        now = datetime.now()
+        conn.executemany("UPDATE contributors SET last_updated = ? WHERE github_id = ?",
+                         [(now, github_id) for github_id in github_ids])
+        conn.commit()
+
 def get_ncm_dashboard_stats(period='today'):
-    """获取NCM仪表盘的统计数据"""
-    with sqlite3.connect(DB_FILES["ncm"]) as conn:
-        conn.row_factory = sqlite3.Row
+    """从预聚合表获取NCM仪表盘的统计数据"""
+    day_range = _period_day_range(period)
+    with get_connection("ncm") as conn:
         c = conn.cursor()
 
-        if period == 'today':
-            time_filter = "WHERE date(accessed_at) = date('now')"
-            no_lyrics_time_filter = "WHERE date(first_seen) = date('now')"
-        elif period == 'monthly':
-            time_filter = "WHERE strftime('%Y-%m', accessed_at) = strftime('%Y-%m', 'now')"
-            no_lyrics_time_filter = "WHERE strftime('%Y-%m', first_seen) = strftime('%Y-%m', 'now')"
-        elif period == 'yearly':
-            time_filter = "WHERE strftime('%Y', accessed_at) = strftime('%Y', 'now')"
-            no_lyrics_time_filter = "WHERE strftime('%Y', first_seen) = strftime('%Y', 'now')"
+        if day_range:
+            c.execute(
+                "SELECT COUNT(DISTINCT song_id) FROM ncm_song_daily WHERE day >= ? AND day < ?",
+                day_range
+            )
+            acquired = c.fetchone()[0]
+            c.execute(
+                "SELECT COUNT(*) FROM ncm_no_lyrics WHERE first_seen >= ? AND first_seen < ?",
+                day_range
+            )
+            no_lyrics = c.fetchone()[0]
+            song_counts = """
+                SELECT song_id, SUM(access_count) AS access_count
+                FROM ncm_song_daily
+                WHERE day >= ? AND day < ?
+                GROUP BY song_id
+            """
+            params = day_range
         else: # total
-            time_filter = ""
-            no_lyrics_time_filter = ""
-
-        c.execute(f"SELECT COUNT(DISTINCT song_id) FROM ncm_access_log {time_filter}")
-        acquired = c.fetchone()[0]
-        
-        c.execute(f"SELECT COUNT(*) FROM ncm_no_lyrics {no_lyrics_time_filter}")
-        no_lyrics = c.fetchone()[0]
+            c.execute("SELECT COUNT(*) FROM ncm_song_totals")
+            acquired = c.fetchone()[0]
+            c.execute("SELECT COUNT(*) FROM ncm_no_lyrics")
+            no_lyrics = c.fetchone()[0]
+            song_counts = "SELECT song_id, access_count FROM ncm_song_totals"
+            params = ()
 
         c.execute(f'''
-            SELECT s.song_name, COUNT(l.song_id) as count
-            FROM ncm_access_log l
+            SELECT s.song_name, l.access_count AS count
+            FROM ({song_counts}) l
             JOIN ncm_song_info s ON l.song_id = s.song_id
-            {time_filter}
-            GROUP BY l.song_id, s.song_name
             ORDER BY count DESC
             LIMIT 10
-        ''')
+        ''', params)
         hot_songs = [dict(row) for row in c.fetchall()]
 
         c.execute(f'''
-            SELECT s.artists, COUNT(l.song_id) as count
-            FROM ncm_access_log l
+            SELECT s.artists, SUM(l.access_count) AS count
+            FROM ({song_counts}) l
             JOIN ncm_song_info s ON l.song_id = s.song_id
-            {time_filter}
             GROUP BY s.artists
             ORDER BY count DESC
             LIMIT 10
-        ''')
+        ''', params)
         hot_artists = [dict(row) for row in c.fetchall()]
         
     return {
@@ -334,42 +878,58 @@ def get_ncm_dashboard_stats(period='today'):
     }
 
 def get_traffic_stats(period='today'):
-    """获取流量统计数据，确保在没有数据时也能返回有效结构"""
-    with sqlite3.connect(DB_FILES["traffic"]) as conn:
-        conn.row_factory = sqlite3.Row
+    """从预聚合表获取流量统计数据，确保在没有数据时也能返回有效结构"""
+    day_range = _period_day_range(period)
+    with get_connection("traffic") as conn:
         c = conn.cursor()
 
-        if period == 'today':
-            time_filter = "WHERE date(timestamp) = date('now')"
-        elif period == 'monthly':
-            time_filter = "WHERE strftime('%Y-%m', timestamp) = strftime('%Y-%m', 'now')"
-        elif period == 'yearly':
-            time_filter = "WHERE strftime('%Y', timestamp) = strftime('%Y', 'now')"
-        else: # total
-            time_filter = ""
-
         try:
-            c.execute(f"SELECT COUNT(*) FROM traffic_log {time_filter}")
-            total_requests = c.fetchone()[0] or 0
-
-            c.execute(f"SELECT COUNT(DISTINCT ip_address) FROM traffic_log {time_filter}")
-            unique_visitors = c.fetchone()[0] or 0
-            
-            c.execute(f"SELECT SUM(response_size_bytes) FROM traffic_log {time_filter}")
-            total_traffic_bytes = c.fetchone()[0] or 0
-            total_traffic_mb = round(total_traffic_bytes / (1024 * 1024), 2)
-
-            c.execute(f'''
-                SELECT path, COUNT(path) as count
-                FROM traffic_log
-                {time_filter}
-                GROUP BY path
-                ORDER BY count DESC
-                LIMIT 10
-            ''')
+            if day_range:
+                # 小时键 'YYYY-MM-DD HH' 与日期键按字典序比较即可得到日期区间
+                c.execute(
+                    "SELECT SUM(request_count), SUM(response_bytes) FROM traffic_hourly WHERE hour >= ? AND hour < ?",
+                    day_range
+                )
+                total_requests, total_traffic_bytes = c.fetchone()
+
+                c.execute(
+                    "SELECT COUNT(DISTINCT ip_id) FROM traffic_ip_daily WHERE day >= ? AND day < ?",
+                    day_range
+                )
+                unique_visitors = c.fetchone()[0] or 0
+
+                # 先按路径ID聚合出前10名，再查出路径字符串
+                c.execute('''
+                    SELECT p.path, top.count
+                    FROM (
+                        SELECT path_id, SUM(request_count) as count
+                        FROM traffic_path_daily
+                        WHERE day >= ? AND day < ?
+                        GROUP BY path_id
+                        ORDER BY count DESC
+                        LIMIT 10
+                    ) AS top
+                    JOIN traffic_paths AS p ON p.id = top.path_id
+                    ORDER BY top.count DESC
+                ''', day_range)
+            else: # total
+                c.execute("SELECT SUM(request_count), SUM(response_bytes) FROM traffic_hourly")
+                total_requests, total_traffic_bytes = c.fetchone()
+
+                c.execute("SELECT COUNT(DISTINCT ip_id) FROM traffic_ip_daily")
+                unique_visitors = c.fetchone()[0] or 0
+
+                c.execute('''
+                    SELECT p.path, t.request_count as count
+                    FROM traffic_path_totals AS t
+                    JOIN traffic_paths AS p ON p.id = t.path_id
+                    ORDER BY count DESC
+                    LIMIT 10
+                ''')
             top_pages = [dict(row) for row in c.fetchall()]
 
-            top_user_agents = []
+            total_requests = total_requests or 0
+            total_traffic_mb = round((total_traffic_bytes or 0) / (1024 * 1024), 2)
 
         except (sqlite3.OperationalError, TypeError):
             logger.error("查询流量统计数据时出错，可能traffic_log表为空或不存在。")
@@ -384,3 +944,167 @@ def get_traffic_stats(period='today'):
         "total_traffic_mb": total_traffic_mb,
         "top_pages": top_pages
     }
+
+def set_shared_state(key, value):
+    """写入一项在工作进程之间共享的状态，value 会被序列化为JSON"""
+    with get_connection("system") as conn:
+        conn.execute('''
+            INSERT INTO shared_state (key, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        ''', (key, json.dumps(value), time.time()))
+        conn.commit()
+
+def get_shared_state(key):
+    """读取共享状态，返回 (值, 更新时间)；不存在时返回 (None, None)"""
+    with get_connection("system") as conn:
+        row = conn.execute("SELECT value, updated_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None, None
+    return json.loads(row['value']), row['updated_at']
+
+def add_sync_event(payload):
+    """记录一次同步事件并清理过旧的事件，返回事件ID"""
+    with get_connection("system") as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO sync_events (created_at, payload) VALUES (?, ?)", (time.time(), json.dumps(payload)))
+        event_id = c.lastrowid
+        c.execute("DELETE FROM sync_events WHERE id <= ?", (event_id - SYNC_EVENTS_KEEP,))
+        conn.commit()
+        return event_id
+
+def get_sync_events(after_id):
+    """返回ID大于after_id的同步事件 [(ID, 内容)]，按ID排序"""
+    with get_connection("system") as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, payload FROM sync_events WHERE id > ? ORDER BY id", (after_id,))
+        return [(row['id'], json.loads(row['payload'])) for row in c.fetchall()]
+
+def get_last_sync_event_id():
+    """返回最新的同步事件ID，没有事件时返回0"""
+    with get_connection("system") as conn:
+        row = conn.execute("SELECT MAX(id) FROM sync_events").fetchone()
+        return row[0] or 0
+
+# --- 原始日志归档 ---
+# 访问统计全部来自预聚合表，原始日志只用于排查问题，过期的行可以移到归档文件中（见 retention.py）。
+
+# 可以归档的原始日志表 {表名: (数据库, 时间列)}
+ARCHIVABLE_LOGS = {
+    'ncm_access_log': ('ncm', 'accessed_at'),
+    'traffic_log': ('traffic', 'timestamp'),
+}
+
+# 读取原始日志时的 FROM 子句（表别名为 log）和需要转换的列 {列名: 函数}。
+# traffic_log 通过查找表还原为字符串，归档文件的格式与改用查找表之前相同。
+# 查找表都用 LEFT JOIN：找不到对应取值的行也要读出并归档，否则会被直接删除
+_LOG_SOURCES = {
+    'ncm_access_log': ("SELECT log.* FROM ncm_access_log AS log", {}),
+    'traffic_log': ('''
+        SELECT log.id, p.path, i.ip AS ip_address, u.user_agent, log.response_size_bytes, log.timestamp
+        FROM traffic_log AS log
+        LEFT JOIN traffic_paths AS p ON p.id = log.path_id
+        LEFT JOIN traffic_ips AS i ON i.id = log.ip_id
+        LEFT JOIN traffic_user_agents AS u ON u.id = log.user_agent_id
+    ''', {'ip_address': unpack_ip}),
+}
+
+def get_oldest_log_time(table):
+    """返回原始日志中最早一行的时间戳字符串，表为空时返回None"""
+    db_key, time_column = ARCHIVABLE_LOGS[table]
+    with get_connection(db_key) as conn:
+        row = conn.execute(f"SELECT MIN({time_column}) FROM {table}").fetchone()
+    return row[0]
+
+def get_log_rows(table, start, end, after=None, limit=5000):
+    """
+    按 (时间, id) 顺序分页读取时间在 [start, end) 内的原始日志，返回字典列表。
+    after 为上一页最后一行的 (时间, id)，每页在独立的短事务中读取，不会长时间阻止WAL检查点。
+    """
+    db_key, time_column = ARCHIVABLE_LOGS[table]
+    source, converters = _LOG_SOURCES[table]
+    with get_connection(db_key) as conn:
+        if after is None:
+            rows = conn.execute(f'''
+                {source} WHERE log.{time_column} >= ? AND log.{time_column} < ?
+                ORDER BY log.{time_column}, log.id LIMIT ?
+            ''', (start, end, limit)).fetchall()
+        else:
+            rows = conn.execute(f'''
+                {source} WHERE log.{time_column} >= ? AND log.{time_column} < ?
+                AND (log.{time_column}, log.id) > (?, ?)
+                ORDER BY log.{time_column}, log.id LIMIT ?
+            ''', (start, end, after[0], after[1], limit)).fetchall()
+    rows = [dict(row) for row in rows]
+    for row in rows:
+        for column, convert in converters.items():
+            row[column] = convert(row[column])
+    return rows
+
+def delete_log_rows(table, start, end, max_id, limit=5000):
+    """删除最多 limit 行时间在 [start, end) 内且 id 不大于 max_id 的原始日志，返回删除的行数"""
+    db_key, time_column = ARCHIVABLE_LOGS[table]
+    with get_connection(db_key) as conn:
+        c = conn.cursor()
+        c.execute(f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table} WHERE {time_column} >= ? AND {time_column} < ? AND id <= ? LIMIT ?
+            )
+        ''', (start, end, max_id, limit))
+        conn.commit()
+        return c.rowcount
+
+def insert_rehydrated_rows(table, rows):
+    """
+    把归档中的行写入 <表名>_rehydrated，供管理页面或SQL查询使用。
+    列由归档中的字段决定；同一行重复写入时按 id 忽略。返回新写入的行数。
+    """
+    if not rows:
+        return 0
+    db_key, _ = ARCHIVABLE_LOGS[table]
+    columns = list(rows[0])
+    other_columns = [column for column in columns if column != 'id']
+    with get_connection(db_key) as conn:
+        c = conn.cursor()
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table}_rehydrated (
+                id INTEGER PRIMARY KEY, {', '.join(other_columns)}
+            )
+        ''')
+        before = conn.total_changes
+        c.executemany(
+            f"INSERT OR IGNORE INTO {table}_rehydrated ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [tuple(row.get(column) for column in columns) for row in rows]
+        )
+        conn.commit()
+        return conn.total_changes - before
+
+def drop_rehydrated_table(table):
+    """删除 <表名>_rehydrated"""
+    db_key, _ = ARCHIVABLE_LOGS[table]
+    with get_connection(db_key) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}_rehydrated")
+
+def get_vacuum_info(db_key):
+    """返回数据库的 auto_vacuum 模式（2为增量）、空闲页数和总页数"""
+    with get_connection(db_key) as conn:
+        return {
+            'auto_vacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+            'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+            'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+        }
+
+def enable_incremental_vacuum(db_key):
+    """
+    把已有的数据库切换为增量 auto_vacuum。需要执行一次完整的 VACUUM，
+    期间数据库不可写入，只应在后台任务中、数据库刚被清理之后执行。
+    """
+    with get_connection(db_key) as conn:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+def incremental_vacuum(db_key, pages):
+    """释放最多 pages 个空闲页，返回剩余的空闲页数"""
+    with get_connection(db_key) as conn:
+        # execute 只会单步执行一次（只释放一页），executescript 会把语句执行完毕
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
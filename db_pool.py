@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from config import (DB_FILES, SQLITE_POOL_SIZE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE,
+                    SQLITE_CACHE_SIZE_KB, SQLITE_STATEMENT_CACHE_SIZE)
+from metrics import record_sqlite
+from request_timing import add_span
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 全局变量：每个数据库文件(绝对路径)对应一个空闲连接池
+_pools = {}
+_pools_lock = threading.Lock()
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    记录每条语句执行时间的游标（执行到返回第一行为止，不含之后取回结果的时间），
+    同时计入指标和当前请求的耗时分解
+    """
+
+    def _record(self, start):
+        elapsed = time.perf_counter() - start
+        label = self.connection.db_label
+        record_sqlite(label, elapsed)
+        add_span(f"sqlite.{label}", start, elapsed)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._record(start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """按数据库文件统计查询耗时的连接，conn.execute 等快捷方法也经过 TimedCursor"""
+
+    def __init__(self, db_path, *args, **kwargs):
+        super().__init__(db_path, *args, **kwargs)
+        # 指标标签使用不带扩展名的文件名，如 ncm、traffic
+        self.db_label = os.path.splitext(os.path.basename(db_path))[0]
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def _open_connection(db_path):
+    """创建一个新的长连接，并启用WAL及调优后的PRAGMA"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+        # 连接会在线程之间复用，但同一时刻只会被一个线程借出
+        check_same_thread=False,
+        factory=TimedConnection
+    )
+    conn.row_factory = sqlite3.Row
+    # 新建的数据库使用增量 auto_vacuum，归档删除的空间可以分批归还给文件系统；
+    # 对已有数据库没有影响，由 retention.py 在清理后转换
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL模式下读者不会阻塞写者，写者也不会阻塞读者
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+    # 负数表示以KB为单位
+    conn.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}")
+    return conn
+
+def _get_pool(db_path):
+    """获取指定数据库文件的连接池，不存在时创建"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, queue.LifoQueue(maxsize=SQLITE_POOL_SIZE))
+    return pool
+
+@contextmanager
+def get_connection_for_path(db_path):
+    """
+    从连接池借出一个连接，用法与 `with sqlite3.connect(...) as conn` 相同：
+    正常退出时提交未完成的事务，出现异常时回滚，最后把连接归还连接池。
+    """
+    db_path = os.path.abspath(db_path)
+    pool = _get_pool(db_path)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(db_path)
+
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            # 并发高峰时临时创建的多余连接直接关闭
+            conn.close()
+
+def get_connection(db_key):
+    """根据 DB_FILES 中的名称（ncm/traffic/system/contributors）借出连接"""
+    return get_connection_for_path(DB_FILES[db_key])
+
+def close_all_connections():
+    """关闭所有空闲连接（用于进程退出或测试）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        while True:
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
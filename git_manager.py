@@ -7,18 +7,83 @@ import time
 import logging
 import stat
 from datetime import datetime
-from config import REPO_DIR, REPO_URL, REPO_USER, REPO_NAME, UPDATE_INTERVAL
-from proxy_manager import get_best_proxy, update_proxy_status
+from config import (REPO_DIR, REPO_URL, REPO_USER, REPO_NAME, UPDATE_INTERVAL,
+                    MIRROR_RACE_WIDTH, MIRROR_PROBE_TIMEOUT, PROXY_PROBE_INTERVAL)
+from proxy_manager import (rank_proxies, update_proxy_status, record_proxy_latency,
+                           record_proxy_throughput, flush_proxy_status)
+from metrics import record_outbound, record_sync, host_label
 
 # 获取logger实例
 logger = logging.getLogger(__name__)
 
+# 代表不经过镜像、直接访问GitHub原始地址的候选项
+DIRECT = ""
+# 禁止git在认证失败时交互式地询问用户名密码，否则失效的镜像会让探测一直挂起
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
 # 全局变量
 last_update_time = "N/A"
 last_update_status = "N/A"
+# 仓库同步后需要通知的回调函数列表，见 register_sync_listener
+sync_listeners = []
+
+def register_sync_listener(callback):
+    """
+    注册仓库同步完成后的回调，callback(change_set) 会按注册顺序被调用。
+    change_set 为字典：
+      old_head / new_head: 同步前后的提交SHA（克隆时 old_head 为None）
+      added / modified / removed: 新增、修改、删除的文件路径列表
+      full: 为True时表示无法得到增量（如重新克隆），消费者应全量刷新
+    """
+    sync_listeners.append(callback)
+
+def publish_change_set(change_set):
+    """把变更集依次交给所有监听者，单个监听者出错不影响其他监听者"""
+    for callback in sync_listeners:
+        try:
+            callback(change_set)
+        except Exception as e:
+            logger.error(f"同步监听者 {getattr(callback, '__name__', callback)} 处理变更集失败: {e}")
+
+def make_full_change_set(new_head=None):
+    """构造一个表示全量变化的变更集"""
+    return {'old_head': None, 'new_head': new_head, 'added': [], 'modified': [], 'removed': [], 'full': True}
+
+def get_head():
+    """返回本地仓库当前HEAD的提交SHA，失败时返回None"""
+    try:
+        result = subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "HEAD"],
+                                capture_output=True, text=True, check=True, timeout=30)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+
+def diff_change_set(old_head, new_head):
+    """用 git diff --name-status 计算两次提交之间的变更集，失败时返回全量变更集"""
+    change_set = {'old_head': old_head, 'new_head': new_head, 'added': [], 'modified': [], 'removed': [], 'full': False}
+    if old_head == new_head:
+        return change_set
+    try:
+        result = subprocess.run(
+            ["git", "-C", REPO_DIR, "diff", "--name-status", "--no-renames", "-z", old_head, new_head],
+            capture_output=True, check=True, timeout=120
+        )
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"计算变更集失败，将按全量变化处理: {e}")
+        return make_full_change_set(new_head)
+    # 输出格式为 "<状态>\0<路径>\0<状态>\0<路径>\0..."
+    fields = result.stdout.decode('utf-8', 'surrogateescape').split('\0')
+    buckets = {'A': 'added', 'M': 'modified', 'T': 'modified', 'D': 'removed'}
+    for status, path in zip(fields[0::2], fields[1::2]):
+        bucket = buckets.get(status[:1])
+        if bucket:
+            change_set[bucket].append(path)
+    return change_set
 
 def get_clone_url(mirror):
     """根据镜像地址构建完整的克隆URL"""
+    if mirror == DIRECT:
+        return REPO_URL
     repo_path = f"{REPO_USER}/{REPO_NAME}.git"
     if "gitclone.com" in mirror:
         return f"https://gitclone.com/github.com/{repo_path}"
@@ -27,71 +92,217 @@ def get_clone_url(mirror):
     # 其他代理类镜像的通用拼接规则
     return f"{mirror}https://github.com/{repo_path}"
 
+def start_probe(mirror):
+    """启动一个 git ls-remote 探测进程，失败时返回None"""
+    try:
+        return subprocess.Popen(
+            ["git", "ls-remote", "--heads", get_clone_url(mirror), "main"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=GIT_ENV
+        )
+    except OSError as e:
+        logger.error(f"启动镜像探测失败: {e}")
+        return None
+
+def wait_probes(probes, deadline, stop_at_first=False):
+    """
+    轮询探测进程直到全部结束或到达截止时间，每个成功的镜像都会记录其耗时，失败的镜像记录一次失败；
+    探测成功不计入成功率，由调用方决定（竞速胜出的镜像以随后的克隆/拉取结果为准）。
+    返回按完成先后排列的成功镜像列表，以及仍未结束的探测 {镜像: 进程}。
+    """
+    start = time.monotonic()
+    succeeded = []
+    while probes and time.monotonic() < deadline:
+        for mirror, proc in list(probes.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del probes[mirror]
+            if code == 0:
+                elapsed = time.monotonic() - start
+                record_proxy_latency(mirror, elapsed)
+                record_outbound('git_probe', host_label(get_clone_url(mirror)), elapsed)
+                succeeded.append((mirror, elapsed))
+                if stop_at_first:
+                    return succeeded, probes
+            else:
+                logger.warning(f"镜像 {get_clone_url(mirror)} 探测失败 (退出码 {code})。")
+                update_proxy_status(mirror, False)
+                record_outbound('git_probe', host_label(get_clone_url(mirror)), 0, ok=False)
+        time.sleep(0.05)
+    return succeeded, probes
+
+def race_mirrors(exclude=()):
+    """
+    同时用 git ls-remote 探测若干个镜像（总会包含GitHub原始地址），
+    返回最先成功响应的镜像，其余探测立即终止；在 MIRROR_PROBE_TIMEOUT 内
+    没有任何镜像响应时返回None。成功的耗时和失败的镜像都会记录到代理状态中，
+    胜出镜像的成功或失败由随后的克隆/拉取记录。
+    """
+    candidates = rank_proxies(exclude, skip_backoff=True)[:MIRROR_RACE_WIDTH]
+    if DIRECT not in exclude:
+        candidates.append(DIRECT)
+    probes = {m: p for m, p in ((m, start_probe(m)) for m in candidates) if p is not None}
+    if not probes:
+        return None
+    logger.info(f"开始镜像竞速，候选: {[get_clone_url(m) for m in probes]}")
+
+    succeeded, pending = wait_probes(probes, time.monotonic() + MIRROR_PROBE_TIMEOUT, stop_at_first=True)
+    # 终止仍在进行的探测：有胜者时它们只是较慢，没有胜者时说明已超时
+    for mirror, proc in pending.items():
+        proc.kill()
+        proc.wait()
+        if not succeeded:
+            logger.warning(f"镜像 {get_clone_url(mirror)} 探测超时。")
+            update_proxy_status(mirror, False)
+            record_outbound('git_probe', host_label(get_clone_url(mirror)), 0, ok=False)
+
+    if not succeeded:
+        logger.error("本轮镜像竞速没有任何镜像在限定时间内响应。")
+        return None
+    winner, elapsed = succeeded[0]
+    logger.info(f"镜像竞速胜出: {get_clone_url(winner)} (耗时 {elapsed:.2f} 秒)")
+    return winner
+
+def probe_all_mirrors():
+    """同时探测所有不在退避期的镜像，刷新它们的延迟和成功率"""
+    probes = {m: p for m, p in ((m, start_probe(m)) for m in rank_proxies(skip_backoff=True)) if p is not None}
+    if not probes:
+        return
+    succeeded, pending = wait_probes(probes, time.monotonic() + MIRROR_PROBE_TIMEOUT)
+    for mirror, _ in succeeded:
+        update_proxy_status(mirror, True)
+    for mirror, proc in pending.items():
+        proc.kill()
+        proc.wait()
+        update_proxy_status(mirror, False)
+        record_outbound('git_probe', host_label(get_clone_url(mirror)), 0, ok=False)
+    logger.info(f"镜像探测完成: {len(succeeded)} 个可用, {len(pending)} 个超时。")
+
+def background_proxy_prober():
+    """后台定时任务，在同步流程之外周期性地探测镜像并保存代理状态"""
+    logger.info("启动后台镜像探测器...")
+    while True:
+        time.sleep(PROXY_PROBE_INTERVAL)
+        try:
+            probe_all_mirrors()
+        except Exception as e:
+            logger.error(f"后台镜像探测失败: {e}")
+        flush_proxy_status()
+
+def get_pack_size():
+    """通过 git count-objects -v 返回本地仓库对象占用的字节数，失败时返回None"""
+    try:
+        result = subprocess.run(["git", "-C", REPO_DIR, "count-objects", "-v"],
+                                capture_output=True, text=True, check=True, timeout=30)
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    sizes = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(':')
+        sizes[key.strip()] = value.strip()
+    try:
+        # size 和 size-pack 的单位是 KiB
+        return (int(sizes.get('size', 0)) + int(sizes.get('size-pack', 0))) * 1024
+    except ValueError:
+        return None
+
 def update_repo():
     """克隆或更新仓库，并管理代理状态"""
     global last_update_time, last_update_status
 
     def do_clone():
-        """执行克隆操作"""
-        cloned_successfully = False
-        # 尝试使用最优代理进行克隆
+        """执行克隆操作：每轮先竞速选出最快的镜像，克隆失败则排除该镜像再竞速"""
+        failed = set()
         while True:
-            best_proxy = get_best_proxy()
-            if not best_proxy:
-                logger.error("没有可用的代理进行克隆。")
-                break
-            
-            clone_url = get_clone_url(best_proxy)
-            logger.info(f"尝试从最优代理 {clone_url} 克隆...")
+            mirror = race_mirrors(exclude=failed)
+            if mirror is None:
+                logger.critical("没有可用的镜像进行克隆。")
+                return False
+            clone_url = get_clone_url(mirror)
+            logger.info(f"尝试从 {clone_url} 克隆...")
             try:
+                start = time.monotonic()
                 # 移除 capture_output=True 让日志直接显示在终端
-                subprocess.run(["git", "clone", "--depth=1", clone_url, REPO_DIR], check=True, timeout=300)
+                subprocess.run(["git", "clone", "--depth=1", clone_url, REPO_DIR], check=True, timeout=300, env=GIT_ENV)
+                elapsed = time.monotonic() - start
                 logger.info(f"从 {clone_url} 克隆成功。")
-                update_proxy_status(best_proxy, True)
-                cloned_successfully = True
-                break
+                update_proxy_status(mirror, True)
+                record_proxy_throughput(mirror, get_pack_size() or 0, elapsed)
+                record_outbound('git_clone', host_label(clone_url), elapsed)
+                return True
             except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
                 logger.error(f"从 {clone_url} 克隆失败: {e}")
-                update_proxy_status(best_proxy, False)
+                update_proxy_status(mirror, False)
+                record_outbound('git_clone', host_label(clone_url), 0, ok=False)
+                failed.add(mirror)
                 if os.path.exists(REPO_DIR):
-                    shutil.rmtree(REPO_DIR)
-        
-        # 如果所有代理都失败了，尝试从原始地址克隆
-        if not cloned_successfully:
-            logger.info("所有代理克隆失败，尝试从原始GitHub地址克隆...")
+                    shutil.rmtree(REPO_DIR, onerror=handle_remove_readonly)
+
+    def do_fetch():
+        """从竞速胜出的镜像浅拉取 main 分支的最新提交，失败则排除该镜像再竞速"""
+        failed = set()
+        while True:
+            mirror = race_mirrors(exclude=failed)
+            if mirror is None:
+                return False
+            fetch_url = get_clone_url(mirror)
             try:
-                subprocess.run(["git", "clone", "--depth=1", REPO_URL, REPO_DIR], check=True, timeout=300)
-                logger.info("从原始GitHub地址克隆成功。")
-                cloned_successfully = True
+                subprocess.run(["git", "-C", REPO_DIR, "remote", "set-url", "origin", fetch_url], check=True, timeout=30)
+                pack_size_before = get_pack_size()
+                start = time.monotonic()
+                # 只浅拉取 main 分支的最新提交，耗时与变化量成正比
+                subprocess.run(["git", "-C", REPO_DIR, "fetch", "--depth=1", "origin", "main"], check=True, timeout=120, env=GIT_ENV)
+                elapsed = time.monotonic() - start
+                update_proxy_status(mirror, True)
+                record_outbound('git_fetch', host_label(fetch_url), elapsed)
+                # 用对象库大小的增量估算本次传输的数据量
+                pack_size_after = get_pack_size()
+                if pack_size_before is not None and pack_size_after is not None:
+                    record_proxy_throughput(mirror, pack_size_after - pack_size_before, elapsed)
+                return True
             except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-                logger.critical(f"从原始GitHub地址克隆失败: {e}")
-        return cloned_successfully
+                logger.error(f"从 {fetch_url} 拉取失败: {e}")
+                update_proxy_status(mirror, False)
+                record_outbound('git_fetch', host_label(fetch_url), 0, ok=False)
+                failed.add(mirror)
 
     def do_pull():
-        """执行拉取更新操作"""
+        """执行拉取更新操作，成功时返回变更集，失败时返回None"""
         try:
             # 清理可能存在的锁文件
             if os.path.exists(os.path.join(REPO_DIR, '.git', 'index.lock')):
                 os.remove(os.path.join(REPO_DIR, '.git', 'index.lock'))
-            # 重置本地改动并拉取最新
-            subprocess.run(["git", "-C", REPO_DIR, "fetch", "--all"], check=True, timeout=120)
-            subprocess.run(["git", "-C", REPO_DIR, "reset", "--hard", "origin/main"], check=True, timeout=120) # 修正：使用 main 分支
-            subprocess.run(["git", "-C", REPO_DIR, "pull"], check=True, timeout=120)
-            logger.info("仓库更新成功。")
-            return True
+            old_head = get_head()
+            if not do_fetch():
+                return None
+            subprocess.run(["git", "-C", REPO_DIR, "reset", "--hard", "FETCH_HEAD"], check=True, timeout=120)
+            new_head = get_head()
+            if old_head and new_head:
+                change_set = diff_change_set(old_head, new_head)
+            else:
+                change_set = make_full_change_set(new_head)
+            logger.info(
+                f"仓库更新成功: {old_head} -> {new_head}, 新增 {len(change_set['added'])}, "
+                f"修改 {len(change_set['modified'])}, 删除 {len(change_set['removed'])} 个文件。"
+            )
+            return change_set
         except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             logger.error(f"更新仓库失败: {e}")
-            return False
+            return None
 
+    start = time.monotonic()
+    change_set = None
     if not os.path.exists(REPO_DIR):
         logger.info(f"目录 '{REPO_DIR}' 不存在。正在克隆仓库...")
         if do_clone():
             last_update_status = "克隆成功"
+            change_set = make_full_change_set(get_head())
         else:
             last_update_status = "克隆失败"
     else:
         logger.info("仓库已存在。正在拉取最新更改...")
-        if do_pull():
+        change_set = do_pull()
+        if change_set is not None:
             last_update_status = "更新成功"
         else:
             logger.warning("更新失败。尝试删除并重新克隆...")
@@ -102,12 +313,21 @@ def update_repo():
                 logger.info(f"成功删除旧的仓库目录: {REPO_DIR}")
                 if do_clone():
                     last_update_status = "重新克隆成功"
+                    change_set = make_full_change_set(get_head())
                 else:
                     last_update_status = "重新克隆失败"
             except OSError as e:
                 logger.error(f"删除仓库目录 {REPO_DIR} 失败: {e}")
                 last_update_status = f"删除仓库失败: {e}"
 
+    # 把变更集发布给索引、缓存、压缩版本等消费者
+    if change_set is not None and (change_set['full'] or change_set['old_head'] != change_set['new_head']):
+        publish_change_set(change_set)
+        record_sync('changed', time.monotonic() - start)
+    elif change_set is not None:
+        record_sync('unchanged', time.monotonic() - start)
+    else:
+        record_sync('failed', time.monotonic() - start)
 
     last_update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -135,3 +355,8 @@ def background_updater():
 def get_last_update_status():
     """返回最后更新时间和状态"""
     return last_update_time, last_update_status
+
+def set_last_update_status(update_time, status):
+    """多进程部署时，从进程用主进程共享的同步状态覆盖本进程的状态"""
+    global last_update_time, last_update_status
+    last_update_time, last_update_status = update_time, status
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# 多进程部署配置，使用方法: gunicorn -c gunicorn.conf.py main:app
+# gunicorn 为可选依赖，见 requirements-optional.txt
+# 每个工作进程都提供HTTP服务；通过锁文件选出的一个主进程额外负责仓库同步等后台任务，
+# 同步状态、代理状态和变更集经由 system.db 共享给其他工作进程（见 cluster.py）。
+
+import multiprocessing
+
+bind = "0.0.0.0:5000"
+workers = multiprocessing.cpu_count()
+# 使用线程型工作进程：日志实时推送(SSE)等长连接只占用一个线程，不会独占整个进程
+worker_class = "gthread"
+threads = 8
+# 应用必须在 fork 之后再启动后台线程，不能预加载
+preload_app = False
+
+
+def on_starting(server):
+    """主控进程启动时执行一次数据库迁移，避免多个工作进程同时迁移"""
+    from database import init_db
+    from db_pool import close_all_connections
+    from metrics import reset_metrics_dir
+    init_db()
+    # 清除上次运行留下的指标文件；运行期间退出的工作进程的文件保留，计数不会倒退
+    reset_metrics_dir()
+    # 数据库连接不能跨 fork 使用
+    close_all_connections()
+
+
+def post_worker_init(worker):
+    """工作进程加载应用后启动本进程的后台服务"""
+    from main import start_services
+    start_services()
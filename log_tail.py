@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# 日志文件的增量读取
+# 游标格式为 "<inode>-<字节偏移>"。客户端首次请求时从文件末尾向前读取最后若干行，
+# 之后带上游标只读取新增的内容。日志轮转后原文件被重命名为 LOG_FILE.1，
+# 此时先读完旧文件中剩余的内容，再从新文件开头继续。
+
+import os
+import logging
+from config import LOG_FILE, LOG_TAIL_LINES, LOG_TAIL_MAX_BYTES
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 从文件末尾向前读取时每次读取的块大小
+READ_BLOCK_SIZE = 64 * 1024
+
+def _make_cursor(inode, offset):
+    return f"{inode:x}-{offset:x}"
+
+def _parse_cursor(cursor):
+    """解析游标，格式不正确时返回None"""
+    try:
+        inode, _, offset = cursor.partition('-')
+        return int(inode, 16), int(offset, 16)
+    except (AttributeError, ValueError):
+        return None
+
+def _decode(data):
+    return data.decode('utf-8', 'replace')
+
+def read_tail(lines=LOG_TAIL_LINES):
+    """
+    从文件末尾向前按块读取，返回 (最后lines行文本, 游标)。
+    读取量只与返回的行数有关，与日志文件大小无关。文件不存在时返回 (None, None)。
+    """
+    try:
+        f = open(LOG_FILE, 'rb')
+    except FileNotFoundError:
+        return None, None
+    with f:
+        st = os.fstat(f.fileno())
+        end = st.st_size
+        position = end
+        chunks = []
+        newlines = 0
+        # 多读一个换行符，以便丢弃最前面不完整的一行
+        while position > 0 and newlines <= lines:
+            size = min(READ_BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            chunk = f.read(size)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+        data = b''.join(reversed(chunks))
+    tail = data.split(b'\n')
+    # 最后一个元素是最后一个换行符之后的内容（通常为空）
+    if data.endswith(b'\n'):
+        tail.pop()
+    tail = tail[-lines:] if lines else []
+    text = _decode(b'\n'.join(tail) + b'\n') if tail else ''
+    return text, _make_cursor(st.st_ino, end)
+
+def _read_from(path, inode, offset, limit):
+    """从指定文件的偏移处读取最多limit字节的完整行，返回 (数据, 新偏移)；文件已不是该inode时返回None"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        st = os.fstat(f.fileno())
+        if st.st_ino != inode:
+            return None
+        if offset > st.st_size:
+            # 文件被截断，从头开始
+            offset = 0
+        f.seek(offset)
+        data = f.read(limit)
+    # 只返回完整的行，剩余部分留给下一次读取
+    cut = data.rfind(b'\n') + 1
+    if cut == 0 and len(data) >= limit:
+        # 单行超过上限，直接按上限截断
+        cut = len(data)
+    return data[:cut], offset + cut
+
+def read_since(cursor):
+    """
+    返回 (游标之后的新日志文本, 新游标, 是否重置)。
+    游标无效或对应的文件已无法找到时，退化为返回文件末尾的若干行，并把"是否重置"置为True，
+    客户端应清空已显示的内容。
+    """
+    parsed = _parse_cursor(cursor)
+    try:
+        current_inode = os.stat(LOG_FILE).st_ino
+    except FileNotFoundError:
+        return '', cursor, False
+    if parsed is None:
+        text, new_cursor = read_tail()
+        return text or '', new_cursor, True
+
+    inode, offset = parsed
+    if inode == current_inode:
+        result = _read_from(LOG_FILE, current_inode, offset, LOG_TAIL_MAX_BYTES)
+        if result is not None:
+            data, new_offset = result
+            return _decode(data), _make_cursor(current_inode, new_offset), False
+
+    # 文件已轮转：先读完旧文件（现在是 LOG_FILE.1）剩余的内容
+    rotated = _read_from(f"{LOG_FILE}.1", inode, offset, LOG_TAIL_MAX_BYTES)
+    if rotated is None:
+        # 旧文件已找不到（例如短时间内轮转了多次），重新从末尾开始
+        text, new_cursor = read_tail()
+        return text or '', new_cursor, True
+    data, new_offset = rotated
+    if data:
+        return _decode(data), _make_cursor(inode, new_offset), False
+    result = _read_from(LOG_FILE, current_inode, 0, LOG_TAIL_MAX_BYTES)
+    if result is None:
+        return '', cursor, False
+    data, new_offset = result
+    return _decode(data), _make_cursor(current_inode, new_offset), False
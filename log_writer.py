@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# 异步批量写入（write-behind）队列
+# 请求线程只负责把访问记录放入内存队列，由后台刷写线程按时间间隔
+# (LOG_FLUSH_INTERVAL_MS) 或积压数量 (LOG_FLUSH_BATCH_SIZE) 将记录分组，
+# 每张表用一次 executemany 事务写入数据库。
+#
+# 溢出策略：队列长度上限为 LOG_QUEUE_MAXSIZE。队列已满时丢弃新到的记录
+# (drop-newest)，绝不阻塞请求线程，被丢弃的数量计入 dropped 计数器。
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from config import LOG_QUEUE_MAXSIZE, LOG_FLUSH_INTERVAL_MS, LOG_FLUSH_BATCH_SIZE
+from database import record_traffic_batch, record_ncm_access_batch, remove_ncm_no_lyrics_entries, record_not_found_batch
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 记录类型
+KIND_TRAFFIC = 'traffic'
+KIND_NCM_ACCESS = 'ncm_access'
+KIND_NCM_FOUND = 'ncm_found'
+KIND_NOT_FOUND = 'not_found'
+
+# 每种记录类型对应的批量写入函数
+BATCH_WRITERS = {
+    KIND_TRAFFIC: record_traffic_batch,
+    KIND_NCM_ACCESS: record_ncm_access_batch,
+    KIND_NCM_FOUND: remove_ncm_no_lyrics_entries,
+    KIND_NOT_FOUND: record_not_found_batch,
+}
+
+# 全局变量
+_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+_writer_thread = None
+_atexit_registered = False
+_start_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_stop_event = threading.Event()
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'dropped': 0,
+    'written': 0,
+    'failed': 0,
+    'flush_count': 0,
+    'last_flush_ms': 0.0,
+    'max_flush_ms': 0.0,
+    'total_flush_ms': 0.0,
+}
+
+def start_log_writer():
+    """启动后台刷写线程（重复调用是安全的）"""
+    global _writer_thread, _atexit_registered
+    with _start_lock:
+        if _writer_thread and _writer_thread.is_alive():
+            return
+        _stop_event.clear()
+        _writer_thread = threading.Thread(target=_writer_loop, name='log-writer', daemon=True)
+        _writer_thread.start()
+        # 进程正常退出时把队列中剩余的记录写入数据库
+        if not _atexit_registered:
+            atexit.register(stop_log_writer)
+            _atexit_registered = True
+    logger.info("异步日志写入线程已启动。")
+
+def stop_log_writer(timeout=5):
+    """停止后台刷写线程，并把队列中剩余的记录全部写入数据库"""
+    global _writer_thread
+    with _start_lock:
+        thread = _writer_thread
+        _writer_thread = None
+    if thread is None:
+        return
+    _stop_event.set()
+    thread.join(timeout)
+    flush()
+    logger.info("异步日志写入线程已停止，剩余记录已写入。")
+
+def flush():
+    """同步地清空队列并写入数据库"""
+    while True:
+        batch = _drain_nowait(LOG_FLUSH_BATCH_SIZE)
+        if not batch:
+            break
+        _write_batch(batch)
+
+def enqueue_traffic(path, ip_address, user_agent, response_size_bytes):
+    """将一条流量记录放入队列"""
+    _enqueue(KIND_TRAFFIC, (path, ip_address, user_agent, response_size_bytes, datetime.now()))
+
+def enqueue_ncm_access(song_id):
+    """将一条NCM访问记录放入队列"""
+    _enqueue(KIND_NCM_ACCESS, (song_id, datetime.now()))
+
+def enqueue_ncm_lyrics_found(song_id):
+    """标记歌曲已有歌词，稍后从'无歌词'列表中移除"""
+    _enqueue(KIND_NCM_FOUND, song_id)
+
+def enqueue_not_found(path):
+    """将一条404路径记录放入队列"""
+    _enqueue(KIND_NOT_FOUND, (path, datetime.now()))
+
+def get_log_writer_stats():
+    """返回队列深度和刷写耗时等计数器"""
+    with _stats_lock:
+        stats = dict(_stats)
+    flush_count = stats.pop('flush_count')
+    total_flush_ms = stats.pop('total_flush_ms')
+    stats['flush_count'] = flush_count
+    stats['avg_flush_ms'] = round(total_flush_ms / flush_count, 2) if flush_count else 0.0
+    stats['queue_depth'] = _queue.qsize()
+    stats['queue_maxsize'] = LOG_QUEUE_MAXSIZE
+    return stats
+
+def _enqueue(kind, row):
+    """放入队列，队满时按drop-newest策略丢弃"""
+    if _writer_thread is None:
+        start_log_writer()
+    try:
+        _queue.put_nowait((kind, row))
+    except queue.Full:
+        with _stats_lock:
+            _stats['dropped'] += 1
+            dropped = _stats['dropped']
+        # 避免在持续溢出时刷屏，每丢弃1000条记录一次警告
+        if dropped % 1000 == 1:
+            logger.warning(f"日志写入队列已满，丢弃新记录 (累计丢弃 {dropped} 条)。")
+        return
+    with _stats_lock:
+        _stats['enqueued'] += 1
+
+def _drain_nowait(limit):
+    """非阻塞地从队列中取出最多limit条记录"""
+    batch = []
+    while len(batch) < limit:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _writer_loop():
+    """后台刷写循环：凑满一批或到达刷写间隔时写入一次"""
+    interval = LOG_FLUSH_INTERVAL_MS / 1000
+    while not _stop_event.is_set():
+        batch = []
+        deadline = time.monotonic() + interval
+        while len(batch) < LOG_FLUSH_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if batch:
+            _write_batch(batch)
+
+def _write_batch(batch):
+    """按记录类型分组，每张表执行一次批量写入"""
+    grouped = {}
+    for kind, row in batch:
+        grouped.setdefault(kind, []).append(row)
+
+    with _flush_lock:
+        start = time.perf_counter()
+        written = failed = 0
+        for kind, rows in grouped.items():
+            try:
+                BATCH_WRITERS[kind](rows)
+                written += len(rows)
+            except Exception as e:
+                failed += len(rows)
+                logger.error(f"批量写入 {kind} 记录失败 ({len(rows)} 条): {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+    with _stats_lock:
+        _stats['written'] += written
+        _stats['failed'] += failed
+        _stats['flush_count'] += 1
+        _stats['last_flush_ms'] = round(elapsed_ms, 2)
+        _stats['max_flush_ms'] = max(_stats['max_flush_ms'], round(elapsed_ms, 2))
+        _stats['total_flush_ms'] += elapsed_ms
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import os
 import logging
 import logging.handlers
+import threading
+from collections import deque
 from flask import request
-from config import LOG_FILE
+from config import LOG_FILE, LOG_RING_BUFFER_SIZE, LOG_STREAM_MAX_CLIENTS, SLOW_REQUEST_LOG_FILE
 
 class NoApiLogFilter(logging.Filter):
     """一个日志过滤器，用于忽略对特定API端点的访问日志。"""
@@ -14,18 +17,111 @@ class NoApiLogFilter(logging.Filter):
         # 同时，我们也要确保 request context 是可用的
         try:
             # 只有在Flask的请求上下文中，request对象才可用
-            if request and request.path == '/api/log':
+            if request and request.path.startswith('/api/log'):
                 return False  # 返回False，表示这条日志不应被处理
         except RuntimeError:
             # 如果不在请求上下文中（例如，应用启动时的日志），正常处理
             pass
         
         # 对于其他更通用的日志，也可以通过消息内容来判断
+        # 同时覆盖 /api/log?cursor=... 和 /api/log/stream
         if 'GET /api/log' in record.getMessage():
             return False
             
         return True # 返回True，表示这条日志应该被处理
 
+class RingBufferHandler(logging.Handler):
+    """
+    把最近的日志保存在内存环形缓冲区中，并唤醒等待新日志的实时推送连接。
+    序号只在本进程的本次运行中有效，对外使用的游标为 "<进程标识>-<序号>"，
+    进程标识由进程号和启动时生成的随机数组成，来自其他进程或重启之前的游标会被识别出来。
+    """
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.seq = 0
+        self.condition = threading.Condition()
+        self._boot = os.urandom(4).hex()
+        # 每条新日志写入后调用的无参函数，供事件循环中的推送连接注册唤醒回调
+        self._listeners = []
+
+    @property
+    def token(self):
+        # 多进程部署时工作进程由主进程 fork 而来，随机数相同，加上进程号区分
+        return f"{os.getpid():x}.{self._boot}"
+
+    def cursor(self, seq=None):
+        """返回指定序号（默认为当前序号）的游标"""
+        return f"{self.token}-{self.seq if seq is None else seq}"
+
+    def parse_cursor(self, cursor):
+        """解析游标，返回序号；游标来自其他进程、重启之前或格式不正确时返回None"""
+        token, _, seq = (cursor or '').rpartition('-')
+        if token != self.token:
+            return None
+        try:
+            seq = int(seq)
+        except ValueError:
+            return None
+        return seq if 0 <= seq <= self.seq else None
+
+    def stream_start(self, cursor):
+        """
+        实时推送的起点序号：没有游标时从当前位置开始；游标来自其他工作进程或重启之前时
+        序号没有意义，从缓冲区中最旧的记录开始重发
+        """
+        if not cursor:
+            return self.seq
+        seq = self.parse_cursor(cursor)
+        return 0 if seq is None else seq
+
+    def format_event(self, seq, text):
+        """把一条日志格式化为SSE消息，多行日志拆成多个 data 字段"""
+        data = "\n".join(f"data: {line}" for line in text.split("\n"))
+        return f"id: {self.cursor(seq)}\n{data}\n\n"
+
+    def emit(self, record):
+        try:
+            text = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.condition:
+            self.seq += 1
+            self.records.append((self.seq, text))
+            self.condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception:
+                # 例如事件循环已经关闭
+                pass
+
+    def add_listener(self, listener):
+        with self.condition:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self._listeners.remove(listener)
+
+    def get_since(self, after_seq, timeout=None):
+        """
+        返回序号大于 after_seq 的日志 [(序号, 文本)]，没有新日志时最多等待 timeout 秒。
+        after_seq 早于缓冲区中最旧的记录时，从最旧的记录开始返回。
+        """
+        with self.condition:
+            if self.seq <= after_seq and timeout:
+                self.condition.wait_for(lambda: self.seq > after_seq, timeout)
+            return [(seq, text) for seq, text in self.records if seq > after_seq]
+
+# 全局的日志环形缓冲区，setup_logging 时挂到根 logger 和 werkzeug logger 上
+log_buffer = RingBufferHandler(LOG_RING_BUFFER_SIZE)
+# 实时推送连接的名额，建立连接时非阻塞地获取，连接关闭时释放
+log_stream_slots = threading.BoundedSemaphore(LOG_STREAM_MAX_CLIENTS)
+
 def setup_logging():
     """配置全局日志"""
     # 创建 formatter
@@ -45,6 +141,10 @@ def setup_logging():
     stream_handler.setLevel(logging.INFO)
     stream_handler.setFormatter(formatter)
 
+    # --- 内存环形缓冲区 ---
+    log_buffer.setLevel(logging.INFO)
+    log_buffer.setFormatter(formatter)
+
     # --- 配置根 logger ---
     # 使用 basicConfig 配置根 logger。
     # 这将确保任何通过 logging.getLogger(__name__) 创建的 logger
@@ -52,7 +152,7 @@ def setup_logging():
     # 设置 force=True (Python 3.8+) 可以覆盖任何由库进行的预先配置。
     logging.basicConfig(
         level=logging.INFO,
-        handlers=[file_handler, stream_handler],
+        handlers=[file_handler, stream_handler, log_buffer],
         force=True  # 强制重新配置
     )
 
@@ -64,9 +164,21 @@ def setup_logging():
     werkzeug_logger.propagate = False # 防止日志被传递到根logger，避免重复记录
     werkzeug_logger.addHandler(file_handler)
     werkzeug_logger.addHandler(stream_handler)
+    werkzeug_logger.addHandler(log_buffer)
     
     # 添加我们自定义的过滤器
     werkzeug_logger.addFilter(NoApiLogFilter())
 
+    # --- 慢请求日志 ---
+    # 单独写入一个文件，每行是一个JSON对象，便于用 jq 等工具分析
+    slow_handler = logging.handlers.RotatingFileHandler(
+        SLOW_REQUEST_LOG_FILE, maxBytes=5*1024*1024, backupCount=5, encoding='utf-8'
+    )
+    slow_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_logger = logging.getLogger('slow_requests')
+    slow_logger.setLevel(logging.INFO)
+    slow_logger.propagate = False
+    slow_logger.handlers = [slow_handler]
+
     # 初始日志，确认配置已加载
     logging.info("Logging configuration loaded successfully.")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from config import REPO_DIR, LYRIC_CACHE_MAX_BYTES, LYRIC_CACHE_MAX_ENTRY_BYTES
+from compressed_cache import get_variant_paths
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 全局变量：(仓库路径, 编码) -> (ETag, 文件内容)，按最近使用顺序排列
+_entries = OrderedDict()
+_lock = threading.Lock()
+_total_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+def get_cached_body(path, encoding, etag):
+    """
+    从缓存中取出文件内容。encoding 为 None 表示未压缩的原始内容。
+    缓存的ETag与当前索引中的不一致时视为过期并移除。
+    """
+    key = (path, encoding)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == etag:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return entry[1]
+        if entry is not None:
+            _remove(key)
+            _stats['invalidations'] += 1
+        _stats['misses'] += 1
+    return None
+
+def put_cached_body(path, encoding, etag, body):
+    """放入缓存，超出总大小上限时淘汰最久未使用的条目"""
+    global _total_bytes
+    if len(body) > LYRIC_CACHE_MAX_ENTRY_BYTES:
+        return
+    key = (path, encoding)
+    with _lock:
+        if key in _entries:
+            _remove(key)
+        _entries[key] = (etag, body)
+        _total_bytes += len(body)
+        while _total_bytes > LYRIC_CACHE_MAX_BYTES and _entries:
+            _remove(next(iter(_entries)))
+            _stats['evictions'] += 1
+
+def can_cache(size):
+    """文件大小是否允许放入缓存"""
+    return size <= LYRIC_CACHE_MAX_ENTRY_BYTES
+
+def invalidate_paths(paths):
+    """仓库同步后移除内容已变化或已删除的文件的所有编码版本"""
+    paths = set(paths)
+    if not paths:
+        return
+    with _lock:
+        stale_keys = [key for key in _entries if key[0] in paths]
+        for key in stale_keys:
+            _remove(key)
+        _stats['invalidations'] += len(stale_keys)
+    if stale_keys:
+        logger.info(f"热门歌词缓存: 移除了 {len(stale_keys)} 个已变化的条目。")
+
+def _remove(key):
+    """移除一个条目（调用方需持有锁）"""
+    global _total_bytes
+    _, body = _entries.pop(key)
+    _total_bytes -= len(body)
+
+def prewarm_lyric_cache(index, song_ids):
+    """按热门程度把歌词文件（原始内容及各压缩版本）预先读入缓存"""
+    if index is None:
+        return
+    loaded = 0
+    for song_id in song_ids:
+        path = f"ncm-lyrics/{song_id}.ttml"
+        entry = index.get_file(path)
+        if entry is None or not can_cache(entry[0]):
+            continue
+        _, _, etag = entry
+        sources = [(None, os.path.join(REPO_DIR, path))] + get_variant_paths(etag)
+        for encoding, source in sources:
+            try:
+                with open(source, 'rb') as f:
+                    put_cached_body(path, encoding, etag, f.read())
+            except OSError as e:
+                logger.warning(f"预热缓存时读取 {source} 失败: {e}")
+        loaded += 1
+        with _lock:
+            if _total_bytes >= LYRIC_CACHE_MAX_BYTES:
+                break
+    logger.info(f"热门歌词缓存预热完成: {loaded} 首歌曲。")
+
+def get_lyric_cache_stats():
+    """返回命中、未命中、淘汰等计数器"""
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_entries)
+        stats['bytes'] = _total_bytes
+    stats['max_bytes'] = LYRIC_CACHE_MAX_BYTES
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
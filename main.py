@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
+import signal
+import sys
 import threading
 
 # --- 核心初始化 ---
@@ -12,33 +15,137 @@ setup_logging()
 # 导入Flask app实例
 from app import app
 # 导入需要在启动时运行的函数
-from database import init_db
+from database import init_db, get_ncm_stats, get_last_sync_event_id
 from proxy_manager import load_proxy_status
-from git_manager import background_updater
+from git_manager import background_updater, background_proxy_prober, register_sync_listener
+import repo_index
+import compressed_cache
+from lyric_cache import prewarm_lyric_cache, invalidate_paths
+from config import LYRIC_CACHE_PREWARM_COUNT
+from log_writer import start_log_writer, enqueue_ncm_lyrics_found
+from ncm_enricher import start_enricher
+from contributors import background_contributors_refresher, on_repo_synced
+from cluster import try_become_leader, follower_loop, leader_publisher, publish_sync_event
+from metrics import start_metrics, reset_metrics_dir
+from retention import background_retention
 
 # 获取logger实例
 logger = logging.getLogger(__name__)
 
+# 全局变量：本进程的后台服务是否已经启动
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def warm_up_caches(index):
+    """生成压缩版本，然后按访问统计把热门歌词预先读入内存缓存"""
+    compressed_cache.build_compressed_variants(index)
+    hot_song_ids = [row['song_id'] for row in get_ncm_stats()[:LYRIC_CACHE_PREWARM_COUNT]]
+    prewarm_lyric_cache(index, hot_song_ids)
+
+
+def invalidate_changed_lyrics(change_set):
+    """从内存缓存中移除内容已变化或被删除的文件"""
+    if change_set['full']:
+        # 无法得知具体变化，按旧ETag校验即可，缓存命中时会发现ETag不一致
+        return
+    invalidate_paths(change_set['modified'] + change_set['removed'])
+
+
+def mark_new_ncm_lyrics(change_set):
+    """新增的NCM歌词文件对应的歌曲不再属于'无歌词'列表"""
+    for path in change_set['added']:
+        directory, _, name = path.rpartition('/')
+        song_id, ext = os.path.splitext(name)
+        if directory == 'ncm-lyrics' and ext == '.ttml' and song_id.isdigit():
+            enqueue_ncm_lyrics_found(song_id)
+
+
+# 仓库同步后按顺序通知本进程的各消费者：先更新索引，其余消费者依赖新索引。
+# 多进程部署时从进程收到主进程转发的变更集后也会调用这些监听者
+register_sync_listener(repo_index.apply_change_set)
+register_sync_listener(invalidate_changed_lyrics)
+register_sync_listener(compressed_cache.apply_change_set)
+
+
+def start_leader_services():
+    """启动只应在一个进程中运行的后台任务：仓库同步、镜像探测、贡献者刷新和日志归档"""
+    # 以下监听者只在主进程中运行：它们写数据库或写共享文件，每次同步只需执行一次
+    register_sync_listener(mark_new_ncm_lyrics)
+    register_sync_listener(on_repo_synced)
+    # 最后把变更集转发给其他工作进程，此时主进程的索引和压缩文件都已更新
+    register_sync_listener(publish_sync_event)
+
+    logger.info("Starting background repository updater...")
+    threading.Thread(target=background_updater, daemon=True).start()
+    # 在同步流程之外周期性地探测镜像健康状况
+    threading.Thread(target=background_proxy_prober, daemon=True).start()
+    # 贡献者数据在后台刷新，接口只返回预先生成的快照
+    threading.Thread(target=background_contributors_refresher, daemon=True).start()
+    # 把同步状态和代理状态共享给其他工作进程
+    threading.Thread(target=leader_publisher, daemon=True).start()
+    # 过期的原始日志移入归档文件，保持数据库文件较小
+    threading.Thread(target=background_retention, daemon=True).start()
+
+
+def start_services():
+    """
+    启动本进程的后台服务。单进程运行时由 __main__ 调用；多进程部署时
+    每个工作进程在 fork 之后各调用一次（见 gunicorn.conf.py）；ASGI 模式下由
+    lifespan 事件调用（见 asgi.py）。重复调用是安全的。
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    # 1. 加载代理状态
+    logger.info("Loading proxy status...")
+    load_proxy_status()
+
+    # 2. 如果仓库已存在，先构建一次路径索引，使服务在首次同步完成前即可使用。
+    # 构建之前先记下最新的同步事件，作为从进程跟随的起点
+    last_event_id = get_last_sync_event_id()
+    logger.info("Building repository index...")
+    initial_index = repo_index.rebuild_repo_index()
+    # 预压缩和缓存预热可能需要一些时间，放到后台执行，完成前先直接读取文件
+    threading.Thread(target=warm_up_caches, args=(initial_index,), daemon=True).start()
+
+    # 3. 启动异步日志写入线程，进程退出时会自动把剩余记录写入数据库
+    logger.info("Starting async log writer...")
+    start_log_writer()
+    # 404歌词的有效性检测也在后台进行
+    start_enricher()
+    # 定期把本进程的指标写入文件，供 /metrics 合并
+    start_metrics()
+
+    # 4. 选举主进程：抢到锁的进程负责同步任务，其余进程跟随主进程的状态
+    if try_become_leader():
+        start_leader_services()
+    else:
+        threading.Thread(target=follower_loop, args=(start_leader_services, last_event_id), daemon=True).start()
+
 
 # --- 应用主入口 ---
 if __name__ == "__main__":
     logger.info("----------------------- Application Begin -----------------------")
     
-    # 1. 初始化数据库
+    # 初始化数据库
     logger.info("Initializing database...")
     init_db()
+    # 清除上次运行留下的指标文件
+    reset_metrics_dir()
+
+    # 启动后台服务
+    start_services()
+    # 收到SIGTERM时走正常退出流程，以便触发退出时的刷写
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
-    # 2. 加载代理状态
-    logger.info("Loading proxy status...")
-    load_proxy_status()
-    
-    # 3. 在后台线程中启动仓库更新器
-    logger.info("Starting background repository updater...")
-    updater_thread = threading.Thread(target=background_updater, daemon=True)
-    updater_thread.start()
-    
-    # 4. 运行Flask Web服务器
+    # 运行Flask Web服务器
     logger.info("Starting Flask server, listening on http://0.0.0.0:5000")
-    # 在生产环境中，建议使用Gunicorn或uWSGI等WSGI服务器代替Flask内置的开发服务器
-    # 例如: gunicorn --workers 4 --bind 0.0.0.0:5000 main:app
+    # 在生产环境中，建议使用多进程部署以利用全部CPU核心：
+    # gunicorn -c gunicorn.conf.py main:app
+    # 需要保持大量长连接时，可以改用异步方式运行（见 asgi.py）：
+    # gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+# Prometheus 格式的运行指标
+# 记录指标的代码遍布请求路径和后台任务，必须足够便宜：每个线程把计数写入自己的字典，
+# 记录时不加锁，只有首次记录的线程登记字典时需要一次加锁。读取时把各线程的字典合并。
+# 多进程部署时每个进程定期把合并结果写入 METRICS_DIR/<进程号>.json，
+# /metrics 读取所有进程的文件并与本进程的实时数据相加。
+
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+from urllib.parse import urlparse
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 各类直方图的分桶上界（秒）
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQLITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+OUTBOUND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SYNC_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# 指标定义 {名称: (类型, 说明, 标签名, 分桶)}
+METRICS = {
+    'amll_http_requests_total': (
+        'counter', 'HTTP requests by route, method and status.', ('route', 'method', 'status'), None),
+    'amll_http_request_duration_seconds': (
+        'histogram', 'Time until the response headers are ready.', ('route',), REQUEST_BUCKETS),
+    'amll_http_response_bytes_total': (
+        'counter', 'Response body bytes sent.', ('route',), None),
+    'amll_sqlite_query_duration_seconds': (
+        'histogram', 'SQLite statement execution time by database file.', ('db',), SQLITE_BUCKETS),
+    'amll_outbound_request_duration_seconds': (
+        'histogram', 'Successful outbound calls by service and host.', ('service', 'host'), OUTBOUND_BUCKETS),
+    'amll_outbound_errors_total': (
+        'counter', 'Failed outbound calls by service and host.', ('service', 'host'), None),
+    'amll_sync_duration_seconds': (
+        'histogram', 'Repository sync duration by result.', ('result',), SYNC_BUCKETS),
+    'amll_retention_archived_rows_total': (
+        'counter', 'Raw log rows moved to archive files.', ('table',), None),
+}
+
+# 读取时根据代理状态生成的指标 {名称: (说明, 代理报告中的字段, 换算系数)}
+PROXY_GAUGES = {
+    'amll_proxy_expected_seconds': ('Expected transfer time used to rank mirrors.', 'expected_seconds', 1),
+    'amll_proxy_latency_seconds': ('Smoothed probe latency.', 'latency_ms', 0.001),
+    'amll_proxy_throughput_bytes_per_second': ('Smoothed transfer throughput.', 'throughput_kbps', 1024),
+    'amll_proxy_success_ratio': ('Smoothed success rate.', 'success_rate', 1),
+    'amll_proxy_consecutive_failures': ('Consecutive failures.', 'consecutive_failures', 1),
+}
+
+# 全局变量
+# 每个线程各自的指标字典 {(名称, 标签值): 计数 或 [各分桶计数..., 总和]}，以及所属线程
+_shards = []
+# 已结束线程的指标合并到这里，避免每个请求一个线程时字典无限增多
+_retired = {}
+_shards_lock = threading.Lock()
+_local = threading.local()
+_flush_started = False
+
+
+def _shard():
+    """返回当前线程的指标字典，首次调用时登记"""
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def inc(name, labels=(), amount=1):
+    """计数器加 amount，labels 为与定义中标签名对应的取值元组"""
+    shard = _shard()
+    key = (name, labels)
+    shard[key] = shard.get(key, 0) + amount
+
+
+def observe(name, labels, value):
+    """向直方图记录一个观测值"""
+    shard = _shard()
+    key = (name, labels)
+    counts = shard.get(key)
+    if counts is None:
+        # 最后两项分别是 +Inf 分桶和观测值总和
+        counts = shard[key] = [0] * (len(METRICS[name][3]) + 2)
+    counts[bisect.bisect_left(METRICS[name][3], value)] += 1
+    counts[-1] += value
+
+
+def host_label(url):
+    """把URL转换为主机名标签，本地路径（如 file://）统一为 local"""
+    return urlparse(url).netloc or 'local'
+
+
+def record_request(route, method, status, sent_bytes, elapsed):
+    inc('amll_http_requests_total', (route, method, str(status)))
+    observe('amll_http_request_duration_seconds', (route,), elapsed)
+    if sent_bytes:
+        inc('amll_http_response_bytes_total', (route,), sent_bytes)
+
+
+def record_response_bytes(route, sent_bytes):
+    """流式响应在输出结束后补记字节数"""
+    if sent_bytes:
+        inc('amll_http_response_bytes_total', (route,), sent_bytes)
+
+
+def record_sqlite(db, elapsed):
+    observe('amll_sqlite_query_duration_seconds', (db,), elapsed)
+
+
+def record_outbound(service, host, elapsed, ok=True):
+    """记录一次对外请求：成功时记录耗时，失败时计数"""
+    if ok:
+        observe('amll_outbound_request_duration_seconds', (service, host), elapsed)
+    else:
+        inc('amll_outbound_errors_total', (service, host))
+
+
+def record_sync(result, elapsed):
+    observe('amll_sync_duration_seconds', (result,), elapsed)
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            for i, v in enumerate(value):
+                current[i] += v
+        else:
+            target[key] = current + value
+
+
+def snapshot():
+    """
+    合并所有线程的指标，返回新的字典。各线程的字典只由其所属线程写入，这里复制后再读取；
+    直方图的分桶和总和不是同时更新的，读取时可能相差一次观测，对监控没有影响。
+    """
+    result = {}
+    with _shards_lock:
+        alive = []
+        for thread, shard in _shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                _merge(result, dict(shard))
+            else:
+                # 线程已结束，不会再写入，直接并入汇总
+                _merge(_retired, shard)
+        _shards[:] = alive
+        _merge(result, _retired)
+    return result
+
+
+def _metrics_file(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush_metrics():
+    """原子地把本进程的指标写入指标文件"""
+    data = [[name, list(labels), value] for (name, labels), value in snapshot().items()]
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _metrics_file(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _read_other_processes():
+    """读取其他进程的指标文件并合并"""
+    result = {}
+    own_name = f"{os.getpid()}.json"
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return result
+    for name in names:
+        if not name.endswith('.json') or name == own_name:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取指标文件 {name} 失败: {e}")
+            continue
+        _merge(result, {(metric, tuple(labels)): value for metric, labels, value in data if metric in METRICS})
+    return result
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 进程存在但无权发送信号
+        return True
+    return True
+
+
+def reset_metrics_dir():
+    """删除所有指标文件。在所有工作进程启动之前调用（gunicorn 主控进程或单进程模式）"""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError as e:
+            logger.warning(f"删除指标文件 {name} 失败: {e}")
+
+
+def prune_metrics_dir():
+    """
+    删除已退出进程的指标文件，用于没有主控进程钩子的部署方式（如 uvicorn --workers）。
+    退出进程的计数随之消失，Prometheus 会把合计值的减少当作计数器重置处理。
+    """
+    if os.name == 'nt':
+        # Windows 上 os.kill 会直接结束目标进程，不能用来检测进程是否存在
+        return
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext == '.json' and stem.isdigit() and int(stem) != os.getpid() and not _pid_alive(int(stem)):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _metrics_flusher():
+    """后台任务：定期写入本进程的指标文件"""
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush_metrics()
+        except Exception as e:
+            logger.error(f"写入指标文件失败: {e}")
+
+
+def start_metrics():
+    """启动本进程的指标文件写入线程（重复调用无效）"""
+    global _flush_started
+    with _shards_lock:
+        if _flush_started:
+            return
+        _flush_started = True
+    threading.Thread(target=_metrics_flusher, daemon=True, name='metrics-flusher').start()
+    # 进程退出前写入最后一次，退出进程的计数仍会计入合计
+    atexit.register(flush_metrics)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(proxy_report=()):
+    """生成 Prometheus 文本格式（0.0.4）的指标，proxy_report 为 proxy_manager.get_proxy_report() 的结果"""
+    merged = _read_other_processes()
+    _merge(merged, snapshot())
+
+    by_name = {}
+    for (name, labels), value in merged.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name.get(name, ())):
+            if kind == 'counter':
+                lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(label_names, labels)} {cumulative}")
+
+    # 代理评分在读取时从本进程的代理状态生成（从进程的代理状态由主进程同步而来）
+    for name, (help_text, field, scale) in PROXY_GAUGES.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for entry in proxy_report:
+            if entry[field] is not None:
+                mirror = entry['mirror'] or 'direct'
+                lines.append(f"{name}{_format_labels(('mirror',), (mirror,))} {_format_value(entry[field] * scale)}")
+    lines.append("# HELP amll_proxy_backoff Whether the mirror is currently backing off.")
+    lines.append("# TYPE amll_proxy_backoff gauge")
+    for entry in proxy_report:
+        mirror = entry['mirror'] or 'direct'
+        lines.append(f"amll_proxy_backoff{_format_labels(('mirror',), (mirror,))} {int(entry['backoff_until'] is not None)}")
+    return '\n'.join(lines) + '\n'
@@ -1,51 +1,124 @@
 # -*- coding: utf-8 -*-
 
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import NCM_API_BASE, NCM_API_CHUNK_SIZE, NCM_API_MAX_WORKERS, NCM_API_RATE_LIMIT, NCM_API_TIMEOUT
+from metrics import record_outbound, host_label
 
 logger = logging.getLogger(__name__)
 
-def fetch_song_details_from_api(song_ids):
-    """从网易云API获取歌曲详情"""
-    if not song_ids:
-        return {}
-    
-    # 确保所有ID都是字符串
-    song_ids_str = [str(sid) for sid in song_ids]
-    
-    url = f"https://music.163.com/api/song/detail?ids=[{','.join(song_ids_str)}]"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://music.163.com/',
-        'Accept': 'application/json'
-    }
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://music.163.com/',
+    'Accept': 'application/json'
+}
+
+NCM_HOST = host_label(NCM_API_BASE)
+
+# 全局变量：请求线程池，以及每个线程各自持有的会话（requests.Session 不保证线程安全）
+_executor = ThreadPoolExecutor(max_workers=NCM_API_MAX_WORKERS, thread_name_prefix='ncm-api')
+_local = threading.local()
+# 限速器：下一个请求最早可以发出的时间
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+
+def _get_session():
+    """返回当前线程的会话，连接保持 keep-alive 并在线程内复用"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        # 只对连接错误和服务端临时错误做少量重试
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+def _wait_for_rate_limit():
+    """按 NCM_API_RATE_LIMIT 均匀地放行请求，必要时在调用线程中等待"""
+    global _next_request_at
+    with _rate_lock:
+        now = time.monotonic()
+        slot = max(now, _next_request_at)
+        _next_request_at = slot + 1 / NCM_API_RATE_LIMIT
+    if slot > now:
+        time.sleep(slot - now)
+
+def _parse_songs(data):
+    """把API响应解析为 {歌曲ID: 详情}"""
     song_details_map = {}
+    if data.get('code') == 200 and 'songs' in data:
+        for song in data['songs']:
+            song_id_str = str(song['id'])
+
+            # 增强鲁棒性：同时处理两种可能的歌手和专辑字段
+            artist_list = song.get('artists', song.get('ar', []))
+            artists = ', '.join([artist['name'] for artist in artist_list])
+
+            album_info = song.get('album', song.get('al', {}))
+            album = album_info.get('name', 'N/A')
+
+            song_details_map[song_id_str] = {
+                'song_name': song.get('name', 'N/A'),
+                'artists': artists,
+                'album': album
+            }
+    return song_details_map
+
+def _fetch_chunk(song_ids):
+    """请求一批歌曲的详情，失败时抛出异常"""
+    _wait_for_rate_limit()
+    start = time.perf_counter()
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        response = _get_session().get(
+            f"{NCM_API_BASE}/api/song/detail",
+            params={'ids': f"[{','.join(song_ids)}]"},
+            timeout=NCM_API_TIMEOUT
+        )
         response.raise_for_status()
-        data = response.json()
-        #print(f"API响应数据: {data}")  # 调试输出
-        if data.get('code') == 200 and 'songs' in data:
-            for song in data['songs']:
-                song_id_str = str(song['id'])
-                
-                # 增强鲁棒性：同时处理两种可能的歌手和专辑字段
-                #print(song.get('artists', song.get('ar', [])))  # 调试输出
-                artist_list = song.get('artists', song.get('ar', []))
-                artists = ', '.join([artist['name'] for artist in artist_list])
-                
-                album_info = song.get('album', song.get('al', {}))
-                album = album_info.get('name', 'N/A')
-
-                song_details_map[song_id_str] = {
-                    'song_name': song.get('name', 'N/A'),
-                    'artists': artists,
-                    'album': album
-                }
-                #print(f"处理歌曲ID {song_id_str} 的详情: {song_details_map[song_id_str]}")
-    except requests.RequestException as e:
-        logger.error(f"请求歌曲详情API失败: {e}")
-    except Exception as e:
-        logger.error(f"处理歌曲详情API响应时出错: {e}")
-        
+    except requests.RequestException:
+        record_outbound('ncm_api', NCM_HOST, 0, ok=False)
+        raise
+    record_outbound('ncm_api', NCM_HOST, time.perf_counter() - start)
+    return _parse_songs(response.json())
+
+def fetch_song_details(song_ids):
+    """
+    从网易云API获取歌曲详情。ID按 NCM_API_CHUNK_SIZE 分批并发请求，
+    返回 (歌曲详情字典, 请求失败的ID列表)；不在详情字典中也不在失败列表中的ID即为无效歌曲。
+    """
+    if not song_ids:
+        return {}, []
+
+    # 确保所有ID都是字符串，并去除重复
+    song_ids_str = list(dict.fromkeys(str(sid) for sid in song_ids))
+    chunks = [song_ids_str[i:i + NCM_API_CHUNK_SIZE] for i in range(0, len(song_ids_str), NCM_API_CHUNK_SIZE)]
+
+    song_details_map = {}
+    failed_ids = []
+    futures = [(chunk, _executor.submit(_fetch_chunk, chunk)) for chunk in chunks]
+    for chunk, future in futures:
+        try:
+            song_details_map.update(future.result())
+        except requests.RequestException as e:
+            failed_ids.extend(chunk)
+            logger.error(f"请求歌曲详情API失败 ({len(chunk)} 个ID): {e}")
+        except Exception as e:
+            failed_ids.extend(chunk)
+            logger.error(f"处理歌曲详情API响应时出错 ({len(chunk)} 个ID): {e}")
+    if failed_ids:
+        logger.warning(f"歌曲详情共 {len(song_ids_str)} 个ID，其中 {len(failed_ids)} 个请求失败，返回部分结果。")
+
+    return song_details_map, failed_ids
+
+def fetch_song_details_from_api(song_ids):
+    """从网易云API获取歌曲详情，部分批次失败时返回其余批次的结果"""
+    song_details_map, _ = fetch_song_details(song_ids)
     return song_details_map
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# NCM无歌词检测后台任务
+# 请求 ncm-lyrics/<id>.ttml 得到404时，请求线程只把歌曲ID放入去重队列后立即返回。
+# 后台线程把队列中的ID凑成一批，通过网易云API批量确认是否为有效歌曲，
+# 有效歌曲记录到 ncm_no_lyrics。检测结果（有效和无效）都会缓存一段时间，
+# 缓存期内同一ID的重复404不会再请求上游，只累加尝试次数。
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import (NCM_ENRICH_QUEUE_MAXSIZE, NCM_ENRICH_BATCH_SIZE, NCM_ENRICH_INTERVAL_MS,
+                    NCM_ENRICH_POSITIVE_TTL, NCM_ENRICH_NEGATIVE_TTL, NCM_ENRICH_CACHE_MAX_ENTRIES)
+from database import update_song_info, add_ncm_no_lyrics_entries
+from ncm_api import fetch_song_details
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 全局变量
+# 待处理的ID -> 期间累计的404次数，同一ID只排队一次
+_pending = OrderedDict()
+# 检测结果缓存：ID -> (过期时间, 歌曲详情)，详情为None表示无效歌曲
+_results = OrderedDict()
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker_thread = None
+_start_lock = threading.Lock()
+_stats = {
+    'submitted': 0,
+    'dropped': 0,
+    'cache_hits': 0,
+    'resolved': 0,
+    'invalid': 0,
+    'api_failures': 0,
+    'batches': 0,
+    'writes': 0,
+}
+
+def start_enricher():
+    """启动后台检测线程（重复调用是安全的）"""
+    global _worker_thread
+    with _start_lock:
+        if _worker_thread and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(target=_worker_loop, name='ncm-enricher', daemon=True)
+        _worker_thread.start()
+    logger.info("NCM无歌词检测线程已启动。")
+
+def submit_missing_song(song_id):
+    """记录一次对不存在的歌词文件的访问，稍后在后台确认歌曲是否有效"""
+    if _worker_thread is None:
+        start_enricher()
+    song_id = str(song_id)
+    with _lock:
+        _stats['submitted'] += 1
+        if song_id not in _pending and len(_pending) >= NCM_ENRICH_QUEUE_MAXSIZE:
+            _stats['dropped'] += 1
+            return
+        _pending[song_id] = _pending.get(song_id, 0) + 1
+        if len(_pending) >= NCM_ENRICH_BATCH_SIZE:
+            _wakeup.set()
+
+def get_enricher_stats():
+    """返回队列深度、缓存大小和处理计数"""
+    with _lock:
+        stats = dict(_stats)
+        stats['queue_depth'] = len(_pending)
+        stats['cached_results'] = len(_results)
+    return stats
+
+def _lookup(song_id, now):
+    """返回 (是否命中, 歌曲详情)，调用方需持有 _lock"""
+    entry = _results.get(song_id)
+    if entry is None:
+        return False, None
+    expires_at, details = entry
+    if expires_at <= now:
+        del _results[song_id]
+        return False, None
+    return True, details
+
+def _remember(song_id, details, now):
+    """缓存检测结果，超出容量时淘汰最早写入的条目，调用方需持有 _lock"""
+    ttl = NCM_ENRICH_POSITIVE_TTL if details is not None else NCM_ENRICH_NEGATIVE_TTL
+    _results.pop(song_id, None)
+    _results[song_id] = (now + ttl, details)
+    while len(_results) > NCM_ENRICH_CACHE_MAX_ENTRIES:
+        _results.popitem(last=False)
+
+def _take_batch():
+    """取出最多 NCM_ENRICH_BATCH_SIZE 个待处理ID及其404次数"""
+    with _lock:
+        batch = {}
+        while _pending and len(batch) < NCM_ENRICH_BATCH_SIZE:
+            song_id, count = _pending.popitem(last=False)
+            batch[song_id] = count
+        return batch
+
+def _worker_loop():
+    """后台循环：凑满一批或到达间隔时处理一次"""
+    interval = NCM_ENRICH_INTERVAL_MS / 1000
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        while True:
+            batch = _take_batch()
+            if not batch:
+                break
+            try:
+                _process_batch(batch)
+            except Exception as e:
+                logger.error(f"处理NCM无歌词检测批次失败 ({len(batch)} 个ID): {e}")
+
+def _process_batch(batch):
+    """先查缓存，只把未缓存的ID交给API，然后批量写入数据库"""
+    now = time.time()
+    attempts = {}
+    unknown = []
+    with _lock:
+        for song_id, count in batch.items():
+            hit, details = _lookup(song_id, now)
+            if not hit:
+                unknown.append(song_id)
+                continue
+            _stats['cache_hits'] += 1
+            if details is not None:
+                attempts[song_id] = count
+
+    new_details = {}
+    if unknown:
+        new_details, failed_ids = fetch_song_details(unknown)
+        failed = set(failed_ids)
+        with _lock:
+            _stats['batches'] += 1
+            _stats['api_failures'] += len(failed)
+            for song_id in unknown:
+                if song_id in failed:
+                    # 请求失败的ID不缓存，下次404时重新检测
+                    continue
+                details = new_details.get(song_id)
+                _remember(song_id, details, now)
+                if details is None:
+                    _stats['invalid'] += 1
+                else:
+                    _stats['resolved'] += 1
+                    attempts[song_id] = batch[song_id]
+
+    if new_details:
+        update_song_info(new_details)
+    if attempts:
+        add_ncm_no_lyrics_entries(attempts)
+        with _lock:
+            _stats['writes'] += 1
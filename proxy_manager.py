@@ -1,70 +1,198 @@
 # -*- coding: utf-8 -*-
 
+# 镜像健康模型
+# 每个镜像记录：连接延迟和传输吞吐量的指数加权移动平均 (EWMA)、最近若干次
+# 结果组成的成功率窗口、连续失败次数，以及失败后按指数增长的退避截止时间。
+# 选择镜像时按"预计传输耗时"排序，处于退避期的镜像排在最后。
+
 import os
 import json
+import time
 import logging
-from config import PROXY_STATUS_FILE, MIRRORS
+import threading
+from config import (PROXY_STATUS_FILE, MIRRORS,
+                    PROXY_EWMA_ALPHA, PROXY_SUCCESS_WINDOW, PROXY_BACKOFF_BASE, PROXY_BACKOFF_MAX,
+                    PROXY_EXPECTED_TRANSFER_BYTES, PROXY_DEFAULT_THROUGHPUT, PROXY_SAVE_INTERVAL)
 
 # 获取logger实例
 logger = logging.getLogger(__name__)
 
 # 全局变量
 proxy_status = {}
+# 代理状态每变化一次加一，供缓存等判断状态是否有更新
+status_version = 0
+_lock = threading.RLock()
+_last_save = 0.0
+_dirty = False
+
+def _new_entry():
+    """新镜像的初始状态：没有测量数据，也不处于退避期"""
+    return {
+        'latency_ms': None,
+        'throughput_bps': None,
+        'window': [],
+        'consecutive_failures': 0,
+        'backoff_until': 0.0,
+        'last_success': None,
+    }
+
+def _migrate_entry(value):
+    """把旧版本的'可用次数'整数转换为健康状态，可用次数大于0视为最近一次成功"""
+    entry = _new_entry()
+    if isinstance(value, int):
+        entry['window'] = [1] if value > 0 else [0]
+    return entry
 
 def load_proxy_status():
-    """从文件加载代理状态，如果文件不存在则初始化"""
+    """从文件加载代理状态，如果文件不存在则初始化；兼容旧版本的文件格式"""
     global proxy_status
+    loaded = {}
     if os.path.exists(PROXY_STATUS_FILE):
-        with open(PROXY_STATUS_FILE, 'r') as f:
-            proxy_status = json.load(f)
-        # 确保所有在MIRRORS中的代理都在状态文件中
-        for mirror in MIRRORS:
-            if mirror not in proxy_status:
-                proxy_status[mirror] = 0
-    else:
-        # 初始化所有镜像的可用次数为1，给它们一个初始机会
-        proxy_status = {mirror: 1 for mirror in MIRRORS}
-    save_proxy_status()
+        try:
+            with open(PROXY_STATUS_FILE, 'r') as f:
+                loaded = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取代理状态文件失败，将重新初始化: {e}")
+    status = {}
+    for mirror in MIRRORS:
+        value = loaded.get(mirror)
+        if isinstance(value, dict):
+            entry = _new_entry()
+            entry.update(value)
+        else:
+            entry = _migrate_entry(value)
+        status[mirror] = entry
+    with _lock:
+        proxy_status = status
+    save_proxy_status(force=True)
     logger.info("代理状态加载完成。")
 
-def save_proxy_status():
-    """保存代理状态到文件"""
-    with open(PROXY_STATUS_FILE, 'w') as f:
-        json.dump(proxy_status, f, indent=4)
-
-def get_best_proxy():
-    """选择可用次数最多的代理"""
-    if not proxy_status:
-        return None
-    # 过滤掉可用次数小于等于0的代理
-    available_proxies = {p: c for p, c in proxy_status.items() if c > 0}
-    if not available_proxies:
-        # 如果所有代理都不可用，则重置所有代理的可用次数为1，重新开始
-        logger.warning("所有代理均不可用，正在重置所有代理状态。")
-        for mirror in MIRRORS:
-            proxy_status[mirror] = 1
-        save_proxy_status()
-        return max(proxy_status, key=proxy_status.get)
-
-    # 返回可用次数最多的代理
-    best_proxy = max(available_proxies, key=available_proxies.get)
-    logger.info(f"选择最优代理: {best_proxy} (可用次数: {proxy_status[best_proxy]})")
-    return best_proxy
+def save_proxy_status(force=False):
+    """
+    原子地保存代理状态（先写临时文件再替换），距离上次保存不足
+    PROXY_SAVE_INTERVAL 秒时只标记为待保存，由后台探测线程稍后保存。
+    """
+    global _last_save, _dirty
+    with _lock:
+        now = time.time()
+        if not force and now - _last_save < PROXY_SAVE_INTERVAL:
+            _dirty = True
+            return
+        data = json.dumps(proxy_status, indent=4)
+        _last_save = now
+        _dirty = False
+    # 多进程部署时每个工作进程启动时都会保存一次，临时文件名带上进程号，避免一个进程替换另一个进程写了一半的文件
+    tmp_path = f"{PROXY_STATUS_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, PROXY_STATUS_FILE)
+    except OSError as e:
+        logger.error(f"保存代理状态失败: {e}")
+
+def flush_proxy_status():
+    """如果有待保存的状态则立即保存"""
+    if _dirty:
+        save_proxy_status(force=True)
+
+def _ewma(old, sample):
+    return sample if old is None else PROXY_EWMA_ALPHA * sample + (1 - PROXY_EWMA_ALPHA) * old
+
+def _changed():
+    """状态变化后递增版本号并（节流地）保存"""
+    global status_version
+    status_version += 1
+    save_proxy_status()
+
+def success_rate(entry):
+    """成功率窗口中的成功比例，没有记录时视为1"""
+    window = entry['window']
+    return sum(window) / len(window) if window else 1.0
+
+def expected_transfer_time(entry):
+    """
+    预计传输耗时（秒）= 连接延迟 + 预期数据量 / 吞吐量，再除以成功率，
+    使经常失败的镜像即使速度快也会被排到后面。没有测量数据时使用默认值。
+    """
+    latency = (entry['latency_ms'] or 1000) / 1000
+    throughput = entry['throughput_bps'] or PROXY_DEFAULT_THROUGHPUT
+    return (latency + PROXY_EXPECTED_TRANSFER_BYTES / throughput) / max(success_rate(entry), 0.05)
+
+def is_backing_off(entry, now=None):
+    return (now or time.time()) < entry['backoff_until']
+
+def rank_proxies(exclude=(), skip_backoff=False):
+    """按预计传输耗时从小到大排列代理，处于退避期的代理排在最后（skip_backoff为True时直接跳过）"""
+    now = time.time()
+    with _lock:
+        candidates = [(m, e) for m, e in proxy_status.items()
+                      if m not in exclude and not (skip_backoff and is_backing_off(e, now))]
+        candidates.sort(key=lambda item: (is_backing_off(item[1], now), expected_transfer_time(item[1])))
+    return [mirror for mirror, _ in candidates]
 
 def update_proxy_status(mirror, success):
-    """更新代理的可用状态"""
-    if mirror not in proxy_status:
+    """记录一次成功或失败：更新成功率窗口，失败时按连续失败次数指数退避"""
+    with _lock:
+        entry = proxy_status.get(mirror)
+        if entry is None:
+            return
+        entry['window'] = (entry['window'] + [1 if success else 0])[-PROXY_SUCCESS_WINDOW:]
+        if success:
+            entry['consecutive_failures'] = 0
+            entry['backoff_until'] = 0.0
+            entry['last_success'] = time.time()
+        else:
+            entry['consecutive_failures'] += 1
+            backoff = min(PROXY_BACKOFF_BASE * 2 ** (entry['consecutive_failures'] - 1), PROXY_BACKOFF_MAX)
+            entry['backoff_until'] = time.time() + backoff
+            logger.warning(f"代理 {mirror} 使用失败 (连续 {entry['consecutive_failures']} 次)，退避 {backoff} 秒。")
+        _changed()
+
+def record_proxy_latency(mirror, elapsed):
+    """记录镜像一次探测的连接延迟（秒）；成功或失败由调用方用 update_proxy_status 记录"""
+    with _lock:
+        entry = proxy_status.get(mirror)
+        if entry is None:
+            return
+        entry['latency_ms'] = round(_ewma(entry['latency_ms'], elapsed * 1000), 1)
+        _changed()
+
+def record_proxy_throughput(mirror, transferred_bytes, elapsed):
+    """记录一次传输的吞吐量（字节/秒），数据量太小时测量不准确，直接忽略"""
+    if transferred_bytes < 64 * 1024 or elapsed <= 0:
         return
-    if success:
-        # 如果成功，增加可用次数
-        proxy_status[mirror] += 1
-        logger.info(f"代理 {mirror} 使用成功，可用次数增加到 {proxy_status[mirror]}")
-    else:
-        # 如果失败，可用次数归零
-        proxy_status[mirror] = 0
-        logger.warning(f"代理 {mirror} 使用失败，可用次数归零。")
-    save_proxy_status()
+    with _lock:
+        entry = proxy_status.get(mirror)
+        if entry is None:
+            return
+        entry['throughput_bps'] = round(_ewma(entry['throughput_bps'], transferred_bytes / elapsed))
+        _changed()
+
+def replace_proxy_status(status):
+    """多进程部署时，从进程用主进程共享的代理状态整体替换本进程的状态（不写文件）"""
+    global proxy_status, status_version
+    with _lock:
+        proxy_status = {mirror: dict(_new_entry(), **entry) for mirror, entry in status.items()}
+        status_version += 1
 
 def get_proxy_status():
     """返回当前的代理状态"""
     return proxy_status
+
+def get_proxy_report():
+    """返回按优先级排序的代理健康指标列表，供状态页展示"""
+    now = time.time()
+    report = []
+    with _lock:
+        for mirror in rank_proxies():
+            entry = proxy_status[mirror]
+            report.append({
+                'mirror': mirror,
+                'expected_seconds': round(expected_transfer_time(entry), 2),
+                'latency_ms': entry['latency_ms'],
+                'throughput_kbps': round(entry['throughput_bps'] / 1024, 1) if entry['throughput_bps'] else None,
+                'success_rate': round(success_rate(entry), 2),
+                'consecutive_failures': entry['consecutive_failures'],
+                'backoff_until': entry['backoff_until'] if entry['backoff_until'] > now else None,
+            })
+    return report
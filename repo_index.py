@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import bisect
+import logging
+import posixpath
+import threading
+import subprocess
+from config import REPO_DIR
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+# 全局变量：当前生效的索引。新索引构建完成后整体替换引用，读者无需加锁
+_current_index = None
+_generation = 0
+_rebuild_lock = threading.Lock()
+
+def _swap_index(new_index):
+    """替换当前索引并分配新的代数，调用方需持有 _rebuild_lock"""
+    global _current_index, _generation
+    _generation += 1
+    if new_index is not None:
+        new_index.generation = _generation
+    _current_index = new_index
+
+class RepoIndex:
+    """镜像仓库的内存路径索引，路径统一使用 '/' 分隔、相对仓库根目录，根目录为 ''"""
+
+    def __init__(self, dirs, files, built_at, total_size=None):
+        # dirs: 目录路径 -> (排好序的子目录名元组, 排好序的文件名元组)
+        self.dirs = dirs
+        # files: 文件路径 -> (大小字节数, 修改时间, ETag)
+        self.files = files
+        self.built_at = built_at
+        # 增量更新时由调用方根据变更集算出总大小，避免重新累加所有文件
+        self.total_size = sum(entry[0] for entry in files.values()) if total_size is None else total_size
+        # 每次替换当前索引时递增，供依赖索引的缓存判断是否需要重新计算
+        self.generation = 0
+
+    def is_dir(self, path):
+        return path in self.dirs
+
+    def is_file(self, path):
+        return path in self.files
+
+    def exists(self, path):
+        return path in self.files or path in self.dirs
+
+    def get_file(self, path):
+        """返回 (大小, 修改时间, ETag)，文件不存在时返回None"""
+        return self.files.get(path)
+
+    def list_dir(self, path):
+        """返回 (子目录名列表, 文件名列表)，均已排序；目录不存在时返回None"""
+        return self.dirs.get(path)
+
+    def list_dir_page(self, path, after=None, limit=None):
+        """
+        分页列出目录：先目录后文件，均按名称排序。
+        after 为上一页返回的游标（'d/名称' 或 'f/名称'，名称中不会含有 '/'），
+        返回 (子目录名列表, 文件名列表, 下一页游标)，没有下一页时游标为None；目录不存在时返回None。
+        """
+        listing = self.dirs.get(path)
+        if listing is None:
+            return None
+        dirs, files = listing
+
+        dir_start, file_start = 0, 0
+        if after:
+            kind, _, name = after.partition('/')
+            if kind == 'd':
+                dir_start = bisect.bisect_right(dirs, name)
+            else:
+                dir_start = len(dirs)
+                file_start = bisect.bisect_right(files, name)
+
+        if limit is None:
+            return list(dirs[dir_start:]), list(files[file_start:]), None
+
+        page_dirs = list(dirs[dir_start:dir_start + limit])
+        page_files = list(files[file_start:file_start + limit - len(page_dirs)])
+        next_after = None
+        if page_files:
+            if file_start + len(page_files) < len(files):
+                next_after = f"f/{page_files[-1]}"
+        elif page_dirs and (dir_start + len(page_dirs) < len(dirs) or files):
+            next_after = f"d/{page_dirs[-1]}"
+        return page_dirs, page_files, next_after
+
+    def has_ncm_lyrics(self, song_id):
+        """判断指定的NCM歌曲是否有歌词文件"""
+        return f"ncm-lyrics/{song_id}.ttml" in self.files
+
+def normalize_path(path):
+    """把请求路径规范化为索引中的相对路径，试图跳出仓库目录时返回None"""
+    path = path.replace('\\', '/')
+    if '..' in path.split('/'):
+        return None
+    return posixpath.normpath('/' + path).lstrip('/')
+
+# 按路径读取 blob SHA 时，每次 git ls-tree 调用携带的路径数量上限（避免命令行过长）
+LS_TREE_CHUNK_SIZE = 500
+
+def read_blob_shas(repo_dir=REPO_DIR, paths=None):
+    """
+    通过 git ls-tree 读取 HEAD 中文件的 blob SHA，失败时返回空字典。
+    paths 为None时一次性读取全部文件，否则只读取给定的路径。
+    """
+    if paths is None:
+        chunks = [[]]
+    else:
+        paths = list(paths)
+        if not paths:
+            return {}
+        chunks = [paths[i:i + LS_TREE_CHUNK_SIZE] for i in range(0, len(paths), LS_TREE_CHUNK_SIZE)]
+    shas = {}
+    for chunk in chunks:
+        command = ["git", "-C", repo_dir, "ls-tree", "-r", "-z", "HEAD"]
+        if chunk:
+            # 路径按字面匹配，不做通配符展开
+            command = ["git", "--literal-pathspecs"] + command[1:] + ["--"] + chunk
+        try:
+            result = subprocess.run(command, capture_output=True, check=True, timeout=60)
+        except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"读取仓库 blob SHA 失败，将使用大小和修改时间生成ETag: {e}")
+            return {}
+        # 每条记录格式为 "<mode> <type> <sha>\t<path>\0"
+        for record in result.stdout.split(b'\0'):
+            if not record:
+                continue
+            meta, _, path = record.partition(b'\t')
+            parts = meta.split()
+            if len(parts) == 3 and parts[1] == b'blob':
+                shas[path.decode('utf-8', 'surrogateescape')] = parts[2].decode('ascii')
+    return shas
+
+def build_repo_index(repo_dir=REPO_DIR):
+    """
+    遍历仓库目录构建新的索引（跳过 .git 目录）。
+    文件的ETag使用git blob SHA（内容哈希），不在git中的文件退化为由大小和修改时间生成。
+    """
+    blob_shas = read_blob_shas(repo_dir)
+    dirs = {}
+    files = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(repo_dir, rel_dir) if rel_dir else repo_dir
+        sub_dirs = []
+        sub_files = []
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    if entry.name == '.git':
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(entry.name)
+                            stack.append(rel_path)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            sub_files.append(entry.name)
+                            etag = blob_shas.get(rel_path) or f"{st.st_size:x}-{st.st_mtime_ns:x}"
+                            files[rel_path] = (st.st_size, st.st_mtime, etag)
+                    except OSError as e:
+                        logger.warning(f"索引 {rel_path} 时出错: {e}")
+        except OSError as e:
+            logger.warning(f"读取目录 {abs_dir} 时出错: {e}")
+        dirs[rel_dir] = (tuple(sorted(sub_dirs)), tuple(sorted(sub_files)))
+    return RepoIndex(dirs, files, time.time())
+
+def rebuild_repo_index():
+    """重建索引并原子地替换当前索引，仓库不存在时清空索引"""
+    with _rebuild_lock:
+        if not os.path.isdir(REPO_DIR):
+            _swap_index(None)
+            logger.warning(f"仓库目录 {REPO_DIR} 不存在，无法构建索引。")
+            return None
+        start = time.perf_counter()
+        new_index = build_repo_index()
+        _swap_index(new_index)
+        elapsed = time.perf_counter() - start
+        logger.info(f"仓库索引构建完成: {len(new_index.files)} 个文件, {len(new_index.dirs)} 个目录, 耗时 {elapsed:.2f} 秒。")
+        return new_index
+
+def update_repo_index(old_index, change_set, repo_dir=REPO_DIR):
+    """
+    根据变更集在旧索引的基础上构建新索引：只重新stat发生变化的文件，
+    只重组受影响的目录，其余条目直接复用。旧索引本身不会被修改。
+    """
+    dirs = dict(old_index.dirs)
+    files = dict(old_index.files)
+    total_size = old_index.total_size
+    changed = change_set['added'] + change_set['modified']
+    blob_shas = read_blob_shas(repo_dir, changed)
+
+    # 受影响的目录 -> (需要加入的文件名, 需要移除的文件名)
+    touched = {}
+    for path in change_set['removed']:
+        old_entry = files.pop(path, None)
+        if old_entry:
+            total_size -= old_entry[0]
+        parent, _, name = path.rpartition('/')
+        touched.setdefault(parent, (set(), set()))[1].add(name)
+    for path in changed:
+        old_entry = files.pop(path, None)
+        if old_entry:
+            total_size -= old_entry[0]
+        try:
+            st = os.stat(os.path.join(repo_dir, path))
+        except OSError as e:
+            logger.warning(f"索引 {path} 时出错: {e}")
+            parent, _, name = path.rpartition('/')
+            touched.setdefault(parent, (set(), set()))[1].add(name)
+            continue
+        etag = blob_shas.get(path) or f"{st.st_size:x}-{st.st_mtime_ns:x}"
+        files[path] = (st.st_size, st.st_mtime, etag)
+        total_size += st.st_size
+        parent, _, name = path.rpartition('/')
+        touched.setdefault(parent, (set(), set()))[0].add(name)
+
+    # 从最深的目录开始处理，这样子目录的新增或清空能够传递给父目录
+    pending = sorted(touched, key=lambda d: d.count('/') + bool(d), reverse=True)
+    child_changes = {}
+    while pending:
+        rel_dir = pending.pop(0)
+        added_files, removed_files = touched.get(rel_dir, (set(), set()))
+        added_dirs, removed_dirs = child_changes.pop(rel_dir, (set(), set()))
+        existed = rel_dir in dirs
+        sub_dirs, sub_files = dirs.get(rel_dir, ((), ()))
+        sub_dirs = (set(sub_dirs) | added_dirs) - removed_dirs
+        sub_files = (set(sub_files) | added_files) - removed_files
+        if rel_dir and not sub_dirs and not sub_files and not os.path.isdir(os.path.join(repo_dir, rel_dir)):
+            # 目录已被清空并删除
+            dirs.pop(rel_dir, None)
+            change = 1 if existed else None
+        else:
+            dirs[rel_dir] = (tuple(sorted(sub_dirs)), tuple(sorted(sub_files)))
+            change = 0 if not existed else None
+        if change is not None and rel_dir:
+            parent, _, name = rel_dir.rpartition('/')
+            if parent not in child_changes and parent not in pending:
+                pending.append(parent)
+                pending.sort(key=lambda d: d.count('/') + bool(d), reverse=True)
+            child_changes.setdefault(parent, (set(), set()))[change].add(name)
+    return RepoIndex(dirs, files, time.time(), total_size)
+
+def apply_change_set(change_set):
+    """同步监听者：按变更集增量更新索引，需要全量刷新或尚无旧索引时重建索引"""
+    if change_set['full'] or _current_index is None:
+        rebuild_repo_index()
+        return
+    with _rebuild_lock:
+        start = time.perf_counter()
+        new_index = update_repo_index(_current_index, change_set)
+        _swap_index(new_index)
+        elapsed = time.perf_counter() - start
+        logger.info(f"仓库索引增量更新完成: {len(new_index.files)} 个文件, {len(new_index.dirs)} 个目录, 耗时 {elapsed:.3f} 秒。")
+
+def get_repo_index():
+    """返回当前生效的索引，尚未构建时返回None"""
+    return _current_index
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# 单个请求的耗时分解
+# 请求开始时创建一个 RequestTiming 放入 contextvars，文件读写、SQLite、模板渲染、
+# 外部HTTP请求等步骤用 span() 记录耗时；不在请求中执行（如后台线程）时 span() 什么也不做。
+# 响应头中的 Server-Timing 给出到响应头生成为止的分解；响应结束后总耗时超过
+# SLOW_REQUEST_THRESHOLD_MS 的请求，把完整的分解写入慢请求日志（每行一个JSON对象）。
+
+import os
+import json
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from config import SLOW_REQUEST_THRESHOLD_MS, REQUEST_TIMING_MAX_EVENTS
+
+# 获取logger实例；慢请求日志的处理器在 logging_config.setup_logging 中配置
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('slow_requests')
+
+# 当前请求的耗时记录，不在请求中时为None
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """
+    一个请求的耗时记录：按步骤名称汇总的 {名称: [总耗时, 次数]}，以及按发生顺序排列的明细。
+    同一个请求的各步骤依次执行，记录时不加锁。
+    """
+    __slots__ = ('start', 'headers_ready', 'totals', 'events', 'dropped')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.headers_ready = None
+        self.totals = {}
+        self.events = []
+        self.dropped = 0
+
+    def add(self, name, start, elapsed):
+        total = self.totals.get(name)
+        if total is None:
+            self.totals[name] = [elapsed, 1]
+        else:
+            total[0] += elapsed
+            total[1] += 1
+        if len(self.events) < REQUEST_TIMING_MAX_EVENTS:
+            self.events.append((name, start - self.start, elapsed))
+        else:
+            self.dropped += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def begin_request():
+    """为当前请求创建耗时记录"""
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+
+def current_timing():
+    return _current.get()
+
+
+def add_span(name, start, elapsed):
+    """记录一个已经结束的步骤，start 为 time.perf_counter() 的取值"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, start, elapsed)
+
+
+@contextmanager
+def span(name):
+    """记录 with 块的耗时"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, start, time.perf_counter() - start)
+
+
+def timed_iter(name, iterable):
+    """
+    包装生成器（如流式模板渲染），累计每次产生下一块的耗时（不含发送的时间），
+    输出结束后作为一个步骤记录，避免逐块渲染产生大量明细
+    """
+    timing = _current.get()
+    iterator = iter(iterable)
+    first_start = None
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            if first_start is None:
+                first_start = start
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        if timing is not None and first_start is not None:
+            timing.add(name, first_start, total)
+
+
+def server_timing_header(timing):
+    """生成 Server-Timing 响应头，同时记下响应头生成的时间"""
+    timing.headers_ready = timing.elapsed()
+    parts = [f"{name};dur={total * 1000:.2f}" for name, (total, _) in timing.totals.items()]
+    parts.append(f"total;dur={timing.headers_ready * 1000:.2f}")
+    return ', '.join(parts)
+
+
+def finish_request(timing, method, path, route, status, query=''):
+    """响应结束时调用：总耗时超过阈值时把完整分解写入慢请求日志，并清除当前请求的记录"""
+    if _current.get() is timing:
+        _current.set(None)
+    total = timing.elapsed()
+    if total * 1000 < SLOW_REQUEST_THRESHOLD_MS:
+        return
+    entry = {
+        'time': datetime.now().isoformat(timespec='milliseconds'),
+        'pid': os.getpid(),
+        'method': method,
+        'path': path,
+        'query': query,
+        'route': route,
+        'status': status,
+        'total_ms': round(total * 1000, 3),
+        'headers_ms': round(timing.headers_ready * 1000, 3) if timing.headers_ready is not None else None,
+        # 各步骤之外的耗时，例如纯Python的处理逻辑或向客户端发送响应
+        'unaccounted_ms': round((total - sum(t for t, _ in timing.totals.values())) * 1000, 3),
+        'spans': {name: {'ms': round(t * 1000, 3), 'count': n} for name, (t, n) in timing.totals.items()},
+        'events': [{'name': name, 'start_ms': round(start * 1000, 3), 'ms': round(elapsed * 1000, 3)}
+                   for name, start, elapsed in timing.events],
+        'events_dropped': timing.dropped,
+    }
+    slow_logger.warning(json.dumps(entry, ensure_ascii=False))
+    logger.warning(f"慢请求: {method} {path} 耗时 {entry['total_ms']:.0f} 毫秒，耗时分解已写入慢请求日志。")
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# 原始日志的保留与归档
+# 访问统计全部来自预聚合表，原始日志 (ncm_access_log / traffic_log) 只用于排查问题。
+# 后台任务把早于 RETENTION_DAYS 的行按月写入 RETENTION_ARCHIVE_DIR/<表名>/<YYYY-MM>.jsonl.gz，
+# 归档文件落盘后再分批删除数据库中的行，最后用增量 VACUUM 把空间还给文件系统，
+# 使数据库文件保持在页缓存能容纳的大小。
+#
+# 归档文件由多个 gzip 成员首尾相接组成：每次归档把新行压缩为一个新成员，追加到已有文件的副本后面，
+# 再原子地替换原文件，中途退出不会损坏已有的归档。删除前退出时，下次会再次归档同样的行，
+# 读取和恢复时按 id 去重。
+#
+# 命令行用法:
+#   python retention.py run                                   立即执行一次归档
+#   python retention.py query traffic_log 2026-01-01 2026-02-01       输出归档中的行 (JSON Lines)
+#   python retention.py rehydrate traffic_log 2026-01-01 2026-02-01   恢复到 traffic_log_rehydrated 表
+#   python retention.py drop-rehydrated traffic_log                   删除恢复的表
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import logging
+from datetime import date, timedelta
+from config import (RETENTION_DAYS, RETENTION_ARCHIVE_DIR, RETENTION_INTERVAL, RETENTION_BATCH_SIZE,
+                    RETENTION_BATCH_PAUSE_MS, RETENTION_VACUUM_PAGES, RETENTION_CONVERT_AUTO_VACUUM)
+from database import (ARCHIVABLE_LOGS, get_oldest_log_time, get_log_rows, delete_log_rows,
+                      insert_rehydrated_rows, drop_rehydrated_table, get_vacuum_info,
+                      enable_incremental_vacuum, incremental_vacuum)
+from metrics import inc
+
+# 获取logger实例
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.jsonl.gz'
+
+
+def archive_path(table, month):
+    return os.path.join(RETENTION_ARCHIVE_DIR, table, f"{month}{ARCHIVE_SUFFIX}")
+
+
+def _month_range(month):
+    """'YYYY-MM' -> 该月第一天和下个月第一天的日期键 [start, end)"""
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.isoformat(), end.isoformat()
+
+
+def _months_between(first_month, last_month):
+    """依次返回 first_month 到 last_month（含）之间的月份键"""
+    month = first_month
+    while month <= last_month:
+        yield month
+        month = _month_range(month)[1][:7]
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Windows 上不能对目录执行 fsync
+        pass
+    finally:
+        os.close(fd)
+
+
+def archive_month(table, month, cutoff):
+    """把指定月份中早于 cutoff 的行写入归档文件，然后从数据库中分批删除，返回删除的行数"""
+    _, time_column = ARCHIVABLE_LOGS[table]
+    start, end = _month_range(month)
+    end = min(end, cutoff)
+    if start >= end:
+        return 0
+
+    path = archive_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    # 已有的归档原样复制，新行作为一个新的gzip成员追加在后面，不需要重新压缩旧数据
+    if os.path.exists(path):
+        shutil.copyfile(path, tmp_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    archived, max_id, after = 0, 0, None
+    with gzip.open(tmp_path, 'ab') as out:
+        while True:
+            rows = get_log_rows(table, start, end, after, RETENTION_BATCH_SIZE)
+            if not rows:
+                break
+            out.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8'))
+            archived += len(rows)
+            max_id = max(max_id, max(row['id'] for row in rows))
+            after = (rows[-1][time_column], rows[-1]['id'])
+    if not archived:
+        os.remove(tmp_path)
+        return 0
+    _fsync(tmp_path)
+    os.replace(tmp_path, path)
+    _fsync(os.path.dirname(path))
+
+    # 归档文件落盘后再删除；每批一个短事务，批次之间让出写锁
+    deleted = 0
+    while True:
+        count = delete_log_rows(table, start, end, max_id, RETENTION_BATCH_SIZE)
+        deleted += count
+        if count < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE_MS / 1000)
+    logger.info(f"{table}: 已将 {month} 的 {archived} 行归档到 {path}，删除 {deleted} 行。")
+    return deleted
+
+
+def compact_db(db_key, convert):
+    """分批执行增量 VACUUM；数据库尚未启用增量 auto_vacuum 时，按 convert 决定是否执行一次完整的 VACUUM"""
+    info = get_vacuum_info(db_key)
+    if info['auto_vacuum'] != 2:
+        if convert and RETENTION_CONVERT_AUTO_VACUUM:
+            logger.info(f"数据库 {db_key}: 执行完整的 VACUUM 并切换为增量 auto_vacuum...")
+            start = time.perf_counter()
+            enable_incremental_vacuum(db_key)
+            logger.info(f"数据库 {db_key}: VACUUM 完成，耗时 {time.perf_counter() - start:.1f} 秒。")
+        return
+    freed = 0
+    remaining = info['freelist_count']
+    while remaining > 0:
+        remaining_after = incremental_vacuum(db_key, RETENTION_VACUUM_PAGES)
+        freed += remaining - remaining_after
+        if remaining_after >= remaining:
+            break
+        remaining = remaining_after
+        time.sleep(RETENTION_BATCH_PAUSE_MS / 1000)
+    if freed:
+        logger.info(f"数据库 {db_key}: 增量 VACUUM 释放了 {freed} 页。")
+
+
+def run_retention():
+    """执行一次归档和压缩，返回 {表名: 删除的行数}"""
+    if RETENTION_DAYS is None:
+        return {}
+    # 按整天截止，日期键与时间戳字符串按字典序比较
+    cutoff = (date.today() - timedelta(days=RETENTION_DAYS)).isoformat()
+    results = {}
+    for table in ARCHIVABLE_LOGS:
+        oldest = get_oldest_log_time(table)
+        deleted = 0
+        if oldest is not None and str(oldest) < cutoff:
+            for month in _months_between(str(oldest)[:7], cutoff[:7]):
+                deleted += archive_month(table, month, cutoff)
+        results[table] = deleted
+        if deleted:
+            inc('amll_retention_archived_rows_total', (table,), deleted)
+
+    for db_key in dict.fromkeys(db_key for db_key, _ in ARCHIVABLE_LOGS.values()):
+        tables = [table for table, (key, _) in ARCHIVABLE_LOGS.items() if key == db_key]
+        # 刚删除过大量数据时数据库最小，此时转换的代价最低
+        compact_db(db_key, convert=any(results[table] for table in tables))
+    return results
+
+
+def iter_archive(table, start, end):
+    """
+    读取归档中时间在 [start, end) 内的行（字典），start/end 为日期键或时间戳字符串。
+    各月份依次读取，月份内按归档的先后顺序返回；重复归档的行只返回一次。
+    """
+    _, time_column = ARCHIVABLE_LOGS[table]
+    for month in _months_between(start[:7], end[:7]):
+        path = archive_path(table, month)
+        if not os.path.exists(path):
+            continue
+        seen = set()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if start <= row[time_column] < end and row['id'] not in seen:
+                    seen.add(row['id'])
+                    yield row
+
+
+def rehydrate(table, start, end):
+    """把归档中时间在 [start, end) 内的行恢复到 <表名>_rehydrated 表，返回新写入的行数"""
+    restored = 0
+    batch = []
+    for row in iter_archive(table, start, end):
+        batch.append(row)
+        if len(batch) >= RETENTION_BATCH_SIZE:
+            restored += insert_rehydrated_rows(table, batch)
+            batch = []
+    restored += insert_rehydrated_rows(table, batch)
+    logger.info(f"已从归档恢复 {restored} 行到 {table}_rehydrated ({start} ~ {end})。")
+    return restored
+
+
+def background_retention():
+    """后台任务（仅主进程）：周期性地归档过期的原始日志并压缩数据库"""
+    logger.info("启动后台日志归档任务...")
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            logger.error(f"归档原始日志失败: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+
+def main(argv):
+    from logging_config import setup_logging
+    from database import init_db
+    setup_logging()
+    init_db()
+
+    command, args = (argv[0], argv[1:]) if argv else ('', [])
+    if command == 'run' and not args:
+        print(json.dumps(run_retention(), ensure_ascii=False))
+    elif command == 'query' and len(args) == 3 and args[0] in ARCHIVABLE_LOGS:
+        for row in iter_archive(*args):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + '\n')
+    elif command == 'rehydrate' and len(args) == 3 and args[0] in ARCHIVABLE_LOGS:
+        rehydrate(*args)
+    elif command == 'drop-rehydrated' and len(args) == 1 and args[0] in ARCHIVABLE_LOGS:
+        drop_rehydrated_table(args[0])
+    else:
+        print(f"用法: python retention.py run | query <表名> <开始> <结束> | rehydrate <表名> <开始> <结束> | "
+              f"drop-rehydrated <表名>\n表名: {', '.join(ARCHIVABLE_LOGS)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# 主页状态快照
+# 快照以其全部输入的版本号为键：同步状态、仓库索引代数、代理状态版本、
+# 日志写入线程和NCM检测任务的写入次数。键不变时直接返回上次的结果，
+# 只有输入变化后的第一次请求才会重新计算，而重新计算本身也只读取
+# 索引中累计好的仓库大小和由触发器维护的计数器。
+
+import threading
+import proxy_manager
+from database import get_db_stats, get_ncm_no_lyrics_count
+from git_manager import get_last_update_status
+from repo_index import get_repo_index
+from log_writer import get_log_writer_stats
+from ncm_enricher import get_enricher_stats
+from utils import format_size_mb
+
+# 全局变量
+_snapshot = None
+_snapshot_key = None
+_lock = threading.Lock()
+
+def _inputs_key():
+    """快照依赖的所有输入的版本号"""
+    index = get_repo_index()
+    return (
+        get_last_update_status(),
+        index.generation if index else None,
+        proxy_manager.status_version,
+        get_log_writer_stats()['flush_count'],
+        get_enricher_stats()['writes'],
+    )
+
+def _build_snapshot():
+    last_update_time, last_update_status = get_last_update_status()
+    index = get_repo_index()
+    ncm_count, not_found_count = get_db_stats()
+    return {
+        'last_update_time': last_update_time,
+        'last_update_status': last_update_status,
+        'dir_size_mb': format_size_mb(index.total_size if index else 0),
+        'ncm_count': ncm_count,
+        'not_found_count': not_found_count,
+        'no_lyrics_count': get_ncm_no_lyrics_count(),
+        # 代理健康指标已按预计传输耗时排序，前端可直接使用
+        'proxy_status': proxy_manager.get_proxy_report(),
+    }
+
+def get_status_snapshot():
+    """返回状态快照，输入未变化时不做任何计算"""
+    global _snapshot, _snapshot_key
+    key = _inputs_key()
+    if key == _snapshot_key:
+        return _snapshot
+    with _lock:
+        if key != _snapshot_key:
+            # 先计算再一起替换，其他线程不会读到半成品
+            snapshot = _build_snapshot()
+            _snapshot, _snapshot_key = snapshot, key
+    return _snapshot